@@ -0,0 +1,94 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Compare timings in two benchmark reports."""
+
+import sys
+import json
+import argparse
+
+
+def compare(baseline, report, threshold):
+    """Compare fastest time of each benchmark in two reports.
+
+    Parameters
+    ----------
+    baseline : dict
+        Report used as reference.
+    report : dict
+        Report to compare to reference.
+    threshold : float
+        Relative change in time considered significant.
+
+    Returns
+    -------
+    list
+        Name, baseline time, new time, ratio, and status of each benchmark.
+    """
+
+    rows = []
+    for name in sorted(set(baseline['results']) | set(report['results'])):
+        if name not in baseline['results'] or name not in report['results']:
+            rows.append((name, None, None, None, 'missing'))
+            continue
+
+        base_time = baseline['results'][name]['min']
+        new_time = report['results'][name]['min']
+        ratio = new_time / base_time if base_time > 0 else float('inf')
+
+        status = 'same'
+        if ratio > 1 + threshold:
+            status = 'slower'
+        elif ratio < 1.0 / (1 + threshold):
+            status = 'faster'
+
+        rows.append((name, base_time, new_time, ratio, status))
+
+    return rows
+
+
+def main():
+    """Compare reports from the command line."""
+
+    parser = argparse.ArgumentParser(description='Compare timings in two benchmark reports.')
+    parser.add_argument('baseline', help='reference JSON report')
+    parser.add_argument('report', help='JSON report to compare to reference')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change in time considered significant')
+    parser.add_argument('--fail_on_regression', action='store_true', help='exit with an error if any benchmark is slower')
+    args = parser.parse_args()
+
+    baseline = json.load(open(args.baseline))
+    report = json.load(open(args.report))
+
+    if baseline['scale'] != report['scale'] or baseline['params'] != report['params']:
+        sys.stderr.write('Warning: reports were generated with different data set sizes.\n')
+
+    rows = compare(baseline, report, args.threshold)
+
+    print('%-30s %12s %12s %8s  %s' % ('Benchmark', 'Baseline (s)', 'New (s)', 'Ratio', 'Status'))
+    for name, base_time, new_time, ratio, status in rows:
+        if status == 'missing':
+            print('%-30s %12s %12s %8s  %s' % (name, '-', '-', '-', status))
+        else:
+            print('%-30s %12.4f %12.4f %8.2f  %s' % (name, base_time, new_time, ratio, status))
+
+    if args.fail_on_regression and any(row[4] == 'slower' for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,495 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Deterministic generators of GTDB-shaped input files.
+
+All generators take a seed so the same files are produced on
+every run, allowing timings to be compared between runs.
+"""
+
+import os
+import random
+
+from genometreetk.default_values import DefaultValues
+
+RANK_PREFIXES = ('d__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__')
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+NUCLEOTIDES = 'ACGT'
+
+METADATA_FIELDS = ['genome',
+                    'checkm_completeness',
+                    'checkm_contamination',
+                    'contig_count',
+                    'scaffold_count',
+                    'n50_scaffolds',
+                    'ambiguous_bases',
+                    'total_gap_length',
+                    'ssu_count',
+                    'gtdb_taxonomy',
+                    'gtdb_representative',
+                    'ncbi_taxonomy',
+                    'ncbi_organism_name',
+                    'ncbi_molecule_count',
+                    'ncbi_unspanned_gaps',
+                    'ncbi_spanned_gaps',
+                    'ncbi_genome_representation',
+                    'ncbi_assembly_level',
+                    'ncbi_refseq_category',
+                    'ncbi_type_material_designation',
+                    'lpsn_strain']
+
+
+def genome_taxonomy(num_genomes, seed, genomes_per_species=8, branching=4):
+    """Create genome ids with a GTDB taxonomy.
+
+    Genomes are assigned to species with a geometric-like size
+    distribution, and each higher rank has on average the
+    specified number of child taxa.
+
+    Parameters
+    ----------
+    num_genomes : int
+        Number of genomes.
+    seed : int
+        Seed for random number generator.
+    genomes_per_species : int
+        Mean number of genomes in a species.
+    branching : int
+        Mean number of child taxa for taxa above species.
+
+    Returns
+    -------
+    list
+        Genome ids.
+    dict : d[genome_id] -> taxonomy list
+        GTDB taxonomy of each genome.
+    """
+
+    rnd = random.Random(seed)
+
+    genome_ids = []
+    for i in range(num_genomes):
+        r = rnd.random()
+        if r < 0.45:
+            genome_ids.append('RS_GCF_%09d.1' % (i + 1))
+        elif r < 0.95:
+            genome_ids.append('GB_GCA_%09d.1' % (i + 1))
+        else:
+            genome_ids.append('U_%d' % (i + 1))
+
+    # assign genomes to species
+    species = []
+    i = 0
+    while i < num_genomes:
+        size = min(1 + int(rnd.expovariate(1.0 / genomes_per_species)), num_genomes - i)
+        species.append(genome_ids[i:i + size])
+        i += size
+
+    # assign species to genera, genera to families, and so on
+    parents_by_rank = []
+    num_taxa = len(species)
+    for _ in range(5):
+        num_parents = max(1, num_taxa // branching)
+        parents = [rnd.randrange(num_parents) for _ in range(num_taxa)]
+        parents_by_rank.append(parents)
+        num_taxa = num_parents
+
+    taxonomy = {}
+    for sp_index, sp_genomes in enumerate(species):
+        taxon_index = sp_index
+        ranks = []
+        for parents in parents_by_rank:
+            taxon_index = parents[taxon_index]
+            ranks.append(taxon_index)
+
+        genus = 'Genus%d' % ranks[0]
+        taxa = ['d__Bacteria',
+                'p__Phylum%d' % ranks[4],
+                'c__Class%d' % ranks[3],
+                'o__Order%d' % ranks[2],
+                'f__Family%d' % ranks[1],
+                'g__' + genus]
+
+        # a fraction of genomes lack a species name
+        if rnd.random() < 0.1:
+            sp_name = 's__'
+        else:
+            sp_name = 's__%s species%d' % (genus, sp_index)
+
+        for genome_id in sp_genomes:
+            taxonomy[genome_id] = taxa + [sp_name]
+
+    return genome_ids, taxonomy
+
+
+def write_metadata(metadata_file, genome_ids, taxonomy, seed):
+    """Write GTDB metadata CSV file.
+
+    Parameters
+    ----------
+    metadata_file : str
+        Output CSV file.
+    genome_ids : list
+        Genome ids.
+    taxonomy : d[genome_id] -> taxonomy list
+        GTDB taxonomy of each genome.
+    seed : int
+        Seed for random number generator.
+    """
+
+    rnd = random.Random(seed)
+
+    fout = open(metadata_file, 'w')
+    fout.write(','.join(METADATA_FIELDS) + '\n')
+    rep_species = set()
+    for genome_id in genome_ids:
+        taxa = taxonomy[genome_id]
+
+        comp = min(100.0, 50 + 50 * rnd.betavariate(5, 1))
+        cont = 10 * rnd.betavariate(1, 8)
+        contigs = 1 + int(rnd.expovariate(1.0 / 150))
+        n50 = int(5e6 / contigs * rnd.uniform(0.5, 1.5))
+        ambiguous = int(rnd.expovariate(1.0 / 200))
+        gap_length = int(rnd.expovariate(1.0 / 2000))
+
+        is_rep = taxa[6] not in rep_species
+        if is_rep:
+            rep_species.add(taxa[6])
+
+        # NCBI taxonomy usually agrees with GTDB taxonomy
+        ncbi_taxa = list(taxa)
+        if rnd.random() < 0.1:
+            ncbi_taxa[6] = 's__'
+        organism_name = ncbi_taxa[6][3:] or 'bacterium'
+
+        refseq_category = ''
+        if genome_id.startswith('RS_') and rnd.random() < 0.1:
+            refseq_category = 'representative genome'
+
+        type_material = ''
+        if rnd.random() < 0.05:
+            type_material = 'assembly from type material'
+
+        row = [genome_id,
+                '%.2f' % comp,
+                '%.2f' % cont,
+                str(contigs),
+                str(contigs),
+                str(n50),
+                str(ambiguous),
+                str(gap_length),
+                str(rnd.randint(0, 3)),
+                ';'.join(taxa),
+                't' if is_rep else 'f',
+                ';'.join(ncbi_taxa),
+                organism_name,
+                str(rnd.randint(1, 3)),
+                str(rnd.randint(0, 10)),
+                str(rnd.randint(0, 10)),
+                'full',
+                'Complete Genome' if contigs == 1 else 'Scaffold',
+                refseq_category,
+                type_material,
+                '']
+        fout.write(','.join(row) + '\n')
+    fout.close()
+
+
+def write_mash_table(mash_file, genome_ids, taxonomy, seed, pairs_per_genome=20):
+    """Write table of pairwise Mash distances.
+
+    Genomes in the same species are given small distances and
+    a number of random genomes are given larger distances, as
+    only pairs within a maximum distance are reported by Mash.
+
+    Parameters
+    ----------
+    mash_file : str
+        Output file in the format produced by 'mash dist'.
+    genome_ids : list
+        Genome ids.
+    taxonomy : d[genome_id] -> taxonomy list
+        GTDB taxonomy of each genome.
+    seed : int
+        Seed for random number generator.
+    pairs_per_genome : int
+        Maximum number of pairs reported for each genome.
+    """
+
+    rnd = random.Random(seed)
+
+    genus_genomes = {}
+    for genome_id in genome_ids:
+        genus_genomes.setdefault(taxonomy[genome_id][5], []).append(genome_id)
+
+    fout = open(mash_file, 'w')
+    for genome_id in genome_ids:
+        same_genus = genus_genomes[taxonomy[genome_id][5]]
+        num_pairs = min(pairs_per_genome, len(same_genus) - 1)
+        for ref_id in rnd.sample(same_genus, num_pairs + 1):
+            if ref_id == genome_id:
+                continue
+
+            if taxonomy[ref_id][6] == taxonomy[genome_id][6]:
+                d = rnd.uniform(0.0, 0.06)
+            else:
+                d = rnd.uniform(0.04, 0.2)
+
+            fout.write('%s\t%s\t%.6f\t0\t%d/1000\n' % (ref_id, genome_id, d, max(0, int(1000 * (1 - 5 * d)))))
+    fout.close()
+
+
+def random_seq(rnd, length, alphabet):
+    """Generate a random sequence."""
+
+    return ''.join(rnd.choice(alphabet) for _ in range(length))
+
+
+def mutate_seq(rnd, seq, rate, alphabet):
+    """Introduce random substitutions into a sequence."""
+
+    seq = list(seq)
+    for _ in range(int(len(seq) * rate)):
+        seq[rnd.randrange(len(seq))] = rnd.choice(alphabet)
+
+    return ''.join(seq)
+
+
+def write_marker_alignments(alignment_dir, genome_ids, num_markers, marker_length, seed, missing_rate=0.05):
+    """Write masked multiple sequence alignment of each marker gene.
+
+    Parameters
+    ----------
+    alignment_dir : str
+        Output directory for <marker>.aln.masked.faa files.
+    genome_ids : list
+        Genome ids.
+    num_markers : int
+        Number of marker genes.
+    marker_length : int
+        Length of each marker alignment.
+    seed : int
+        Seed for random number generator.
+    missing_rate : float
+        Fraction of genomes missing each marker.
+
+    Returns
+    -------
+    list
+        Marker gene ids.
+    """
+
+    rnd = random.Random(seed)
+
+    marker_genes = []
+    for m in range(num_markers):
+        marker_id = 'PF%05d.1' % (m + 1)
+        marker_genes.append(marker_id)
+
+        ancestral = random_seq(rnd, marker_length, AMINO_ACIDS)
+        fout = open(os.path.join(alignment_dir, marker_id + '.aln.masked.faa'), 'w')
+        for genome_id in genome_ids:
+            if rnd.random() < missing_rate:
+                continue
+
+            seq = mutate_seq(rnd, ancestral, 0.3, AMINO_ACIDS + '-')
+            fout.write('>%s%s%s_%d\n' % (genome_id, DefaultValues.SEQ_CONCAT_CHAR, genome_id, m))
+            fout.write(seq + '\n')
+        fout.close()
+
+    return marker_genes
+
+
+def write_stockholm(stockholm_file, num_seqs, model_length, seed, insert_rate=0.2):
+    """Write HMMER alignment in Stockholm format with a reference annotation.
+
+    Parameters
+    ----------
+    stockholm_file : str
+        Output file.
+    num_seqs : int
+        Number of sequences.
+    model_length : int
+        Number of match states in model.
+    seed : int
+        Seed for random number generator.
+    insert_rate : float
+        Fraction of columns that are insert states.
+    """
+
+    rnd = random.Random(seed)
+
+    mask = ''.join('.' if rnd.random() < insert_rate else 'x' for _ in range(model_length))
+    ancestral = random_seq(rnd, len(mask), AMINO_ACIDS)
+
+    fout = open(stockholm_file, 'w')
+    fout.write('# STOCKHOLM 1.0\n\n')
+    for i in range(num_seqs):
+        seq = mutate_seq(rnd, ancestral, 0.3, AMINO_ACIDS)
+        seq = ''.join(ch.lower() if m == '.' else ch for ch, m in zip(seq, mask))
+        fout.write('genome_%d%sgene_%d %s\n' % (i, DefaultValues.SEQ_CONCAT_CHAR, i, seq))
+    fout.write('#=GC RF %s\n' % mask)
+    fout.write('//\n')
+    fout.close()
+
+
+def write_nucleotide_msa(msa_file, num_seqs, msa_length, seed, identical_rate=0.1):
+    """Write rRNA-like nucleotide alignment with ragged ends.
+
+    Parameters
+    ----------
+    msa_file : str
+        Output FASTA file.
+    num_seqs : int
+        Number of sequences.
+    msa_length : int
+        Length of alignment.
+    seed : int
+        Seed for random number generator.
+    identical_rate : float
+        Fraction of sequences identical to a previous sequence.
+    """
+
+    rnd = random.Random(seed)
+
+    ancestral = random_seq(rnd, msa_length, NUCLEOTIDES)
+    prev_seq = None
+    fout = open(msa_file, 'w')
+    for i in range(num_seqs):
+        if prev_seq and rnd.random() < identical_rate:
+            seq = prev_seq
+        else:
+            seq = mutate_seq(rnd, ancestral, 0.05, NUCLEOTIDES + '-')
+            start = int(rnd.expovariate(1.0 / (0.02 * msa_length)))
+            end = msa_length - int(rnd.expovariate(1.0 / (0.02 * msa_length)))
+            start = min(start, msa_length // 2)
+            end = max(end, msa_length // 2)
+            seq = '-' * start + seq[start:end] + '.' * (msa_length - end)
+
+        fout.write('>seq_%d\n%s\n' % (i, seq))
+        prev_seq = seq
+    fout.close()
+
+
+def write_top_hits(genome_dir, genome_ids, num_markers, genes_per_genome, seed):
+    """Write Pfam and TIGRfam top hit tables for each genome.
+
+    Parameters
+    ----------
+    genome_dir : str
+        Directory to create a subdirectory for each genome.
+    genome_ids : list
+        Genome ids.
+    num_markers : int
+        Number of Pfam and of TIGRfam families.
+    genes_per_genome : int
+        Number of genes with a hit in each genome.
+    seed : int
+        Seed for random number generator.
+
+    Returns
+    -------
+    d[genome_id] -> directory
+        Directory of each genome.
+    """
+
+    rnd = random.Random(seed)
+
+    genome_dirs = {}
+    for genome_id in genome_ids:
+        assembly = genome_id.replace('RS_', '').replace('GB_', '')
+        cur_genome_dir = os.path.join(genome_dir, assembly)
+        os.makedirs(cur_genome_dir, exist_ok=True)
+        genome_dirs[genome_id] = cur_genome_dir
+
+        for ext, prefix in [(DefaultValues.PFAM_EXTENSION, 'PF%05d.1'),
+                            (DefaultValues.TIGR_EXTENSION, 'TIGR%05d')]:
+            fout = open(os.path.join(cur_genome_dir, assembly + ext), 'w')
+            fout.write('Gene Id\tTop hits (Family id,e-value,bitscore)\n')
+            for g in range(genes_per_genome):
+                hits = []
+                for _ in range(1 + int(rnd.expovariate(2.0))):
+                    family_id = prefix % rnd.randrange(num_markers)
+                    hits.append('%s,%.1e,%.1f' % (family_id, 10 ** -rnd.uniform(10, 100), rnd.uniform(30, 900)))
+                fout.write('%s_%d\t%s\n' % (assembly, g, ';'.join(hits)))
+            fout.close()
+
+    return genome_dirs
+
+
+def write_tree(tree_file, genome_ids, taxonomy, seed):
+    """Write random binary tree decorated with the GTDB taxonomy.
+
+    The subtree of each taxon is a random binary tree over its
+    child taxa, with the internal node spanning a taxon above the
+    species rank labelled with the taxon name.
+
+    Parameters
+    ----------
+    tree_file : str
+        Output Newick file.
+    genome_ids : list
+        Genome ids at leaves of tree.
+    taxonomy : d[genome_id] -> taxonomy list
+        GTDB taxonomy of each genome.
+    seed : int
+        Seed for random number generator.
+    """
+
+    rnd = random.Random(seed)
+
+    def join(subtrees):
+        """Randomly join subtrees into a single binary tree."""
+
+        subtrees = list(subtrees)
+        while len(subtrees) > 1:
+            i = rnd.randrange(len(subtrees))
+            subtrees[i], subtrees[-1] = subtrees[-1], subtrees[i]
+            left = subtrees.pop()
+            j = rnd.randrange(len(subtrees))
+            subtrees[j], subtrees[-1] = subtrees[-1], subtrees[j]
+            right = subtrees.pop()
+            subtrees.append('(%s:%.5f,%s:%.5f)' % (left, rnd.expovariate(20), right, rnd.expovariate(20)))
+
+        return subtrees[0]
+
+    # group genomes by the full taxonomy of each rank
+    children = {}
+    for genome_id in genome_ids:
+        taxa = taxonomy[genome_id]
+        parent = None
+        for rank in range(len(RANK_PREFIXES)):
+            node = tuple(taxa[0:rank + 1])
+            children.setdefault(parent, set()).add(node)
+            parent = node
+        children.setdefault(parent, set()).add(genome_id)
+
+    # build subtrees from species up to domain
+    subtree = {}
+    for rank in range(len(RANK_PREFIXES) - 1, -1, -1):
+        for node in sorted(n for n in children if n is not None and len(n) == rank + 1):
+            child_subtrees = [subtree.pop(c) if isinstance(c, tuple) else c for c in sorted(children[node])]
+            s = join(child_subtrees)
+            if 0 < rank < len(RANK_PREFIXES) - 1 and s.startswith('('):
+                s += node[-1]
+            subtree[node] = s
+
+    roots = [subtree[n] for n in sorted(children[None])]
+    fout = open(tree_file, 'w')
+    fout.write(join(roots) + ';\n')
+    fout.close()
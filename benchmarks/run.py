@@ -0,0 +1,605 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Time performance critical code on synthetic data and write a JSON report."""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from benchmarks import generators
+
+# size of synthetic data sets at each scale
+SCALES = {'tiny': {'genomes': 500,
+                    'mash_pairs': 10,
+                    'markers': 5,
+                    'marker_length': 100,
+                    'stockholm_seqs': 500,
+                    'model_length': 200,
+                    'msa_seqs': 500,
+                    'msa_length': 800,
+                    'tophit_genomes': 50,
+                    'genes_per_genome': 100,
+                    'support_taxa': 50,
+                    'support_replicates': 3},
+            'small': {'genomes': 5000,
+                        'mash_pairs': 20,
+                        'markers': 20,
+                        'marker_length': 200,
+                        'stockholm_seqs': 5000,
+                        'model_length': 400,
+                        'msa_seqs': 5000,
+                        'msa_length': 1600,
+                        'tophit_genomes': 200,
+                        'genes_per_genome': 500,
+                        'support_taxa': 200,
+                        'support_replicates': 10},
+            'medium': {'genomes': 30000,
+                        'mash_pairs': 30,
+                        'markers': 50,
+                        'marker_length': 300,
+                        'stockholm_seqs': 30000,
+                        'model_length': 500,
+                        'msa_seqs': 30000,
+                        'msa_length': 1600,
+                        'tophit_genomes': 1000,
+                        'genes_per_genome': 2000,
+                        'support_taxa': 1000,
+                        'support_replicates': 20},
+            'large': {'genomes': 150000,
+                        'mash_pairs': 40,
+                        'markers': 120,
+                        'marker_length': 300,
+                        'stockholm_seqs': 150000,
+                        'model_length': 500,
+                        'msa_seqs': 150000,
+                        'msa_length': 1600,
+                        'tophit_genomes': 5000,
+                        'genes_per_genome': 3000,
+                        'support_taxa': 3000,
+                        'support_replicates': 50}}
+
+
+class BenchmarkData(object):
+    """Synthetic input files, generated on first use."""
+
+    def __init__(self, data_dir, params, seed):
+        """Initialization.
+
+        Parameters
+        ----------
+        data_dir : str
+            Directory to write files.
+        params : dict
+            Size of data sets.
+        seed : int
+            Seed for random number generators.
+        """
+
+        self.logger = logging.getLogger('benchmarks')
+
+        self.data_dir = data_dir
+        self.params = params
+        self.seed = seed
+        self.cache = {}
+
+    def _get(self, name, create):
+        """Get data set, creating it if necessary."""
+
+        if name not in self.cache:
+            self.logger.info('Generating %s.' % name)
+            self.cache[name] = create()
+
+        return self.cache[name]
+
+    def _path(self, name):
+        """Get path to file in data directory."""
+
+        return os.path.join(self.data_dir, name)
+
+    @property
+    def taxonomy(self):
+        """Genome ids and their GTDB taxonomy."""
+
+        return self._get('taxonomy',
+                            lambda: generators.genome_taxonomy(self.params['genomes'], self.seed))
+
+    @property
+    def metadata_file(self):
+        """GTDB metadata file."""
+
+        def create():
+            genome_ids, taxonomy = self.taxonomy
+            generators.write_metadata(self._path('metadata.csv'), genome_ids, taxonomy, self.seed)
+            return self._path('metadata.csv')
+
+        return self._get('metadata_file', create)
+
+    @property
+    def mash_file(self):
+        """Pairwise Mash distances."""
+
+        def create():
+            genome_ids, taxonomy = self.taxonomy
+            generators.write_mash_table(self._path('mash.tsv'), genome_ids, taxonomy, self.seed, self.params['mash_pairs'])
+            return self._path('mash.tsv')
+
+        return self._get('mash_file', create)
+
+    @property
+    def rep_file(self):
+        """Representative genome of each species."""
+
+        def create():
+            genome_ids, taxonomy = self.taxonomy
+            fout = open(self._path('reps.tsv'), 'w')
+            species = set()
+            for genome_id in genome_ids:
+                sp = taxonomy[genome_id][6]
+                if sp == 's__' or sp not in species:
+                    species.add(sp)
+                    fout.write('%s\n' % genome_id)
+            fout.close()
+            return self._path('reps.tsv')
+
+        return self._get('rep_file', create)
+
+    @property
+    def marker_alignments(self):
+        """Masked alignment of each marker gene."""
+
+        def create():
+            genome_ids, _taxonomy = self.taxonomy
+            alignment_dir = self._path('marker_msa')
+            os.makedirs(alignment_dir, exist_ok=True)
+            marker_genes = generators.write_marker_alignments(alignment_dir,
+                                                                genome_ids,
+                                                                self.params['markers'],
+                                                                self.params['marker_length'],
+                                                                self.seed)
+            return alignment_dir, marker_genes
+
+        return self._get('marker_alignments', create)
+
+    @property
+    def stockholm_file(self):
+        """HMMER alignment in Stockholm format."""
+
+        def create():
+            generators.write_stockholm(self._path('marker.stockholm'),
+                                        self.params['stockholm_seqs'],
+                                        self.params['model_length'],
+                                        self.seed)
+            return self._path('marker.stockholm')
+
+        return self._get('stockholm_file', create)
+
+    @property
+    def nucleotide_msa(self):
+        """rRNA-like nucleotide alignment."""
+
+        def create():
+            generators.write_nucleotide_msa(self._path('rna.fna'),
+                                            self.params['msa_seqs'],
+                                            self.params['msa_length'],
+                                            self.seed)
+            return self._path('rna.fna')
+
+        return self._get('nucleotide_msa', create)
+
+    @property
+    def top_hits(self):
+        """Top hit tables of genomes."""
+
+        def create():
+            genome_ids, _taxonomy = self.taxonomy
+            genome_ids = genome_ids[0:self.params['tophit_genomes']]
+            genome_dir = self._path('genomes')
+            os.makedirs(genome_dir, exist_ok=True)
+            genome_dirs = generators.write_top_hits(genome_dir,
+                                                    genome_ids,
+                                                    self.params['markers'],
+                                                    self.params['genes_per_genome'],
+                                                    self.seed)
+            return genome_ids, genome_dirs
+
+        return self._get('top_hits', create)
+
+    @property
+    def tree_file(self):
+        """Decorated tree spanning all genomes."""
+
+        def create():
+            genome_ids, taxonomy = self.taxonomy
+            generators.write_tree(self._path('genomes.tree'), genome_ids, taxonomy, self.seed)
+            return self._path('genomes.tree')
+
+        return self._get('tree_file', create)
+
+    @property
+    def support_trees(self):
+        """Tree and replicate trees spanning random subsets of its taxa."""
+
+        def create():
+            from genometreetk.array_tree import ArrayTree
+
+            genome_ids, taxonomy = self.taxonomy
+            genome_ids = genome_ids[0:self.params['support_taxa']]
+            tree_file = self._path('support.tree')
+            generators.write_tree(tree_file, genome_ids, taxonomy, self.seed)
+
+            tree = ArrayTree.read(tree_file)
+            leaves = tree.leaves().tolist()
+            rnd = random.Random(self.seed)
+            rep_tree_files = []
+            for r in range(self.params['support_replicates']):
+                rep_tree_file = self._path('support.r_%d.tree' % r)
+                tree.retain_leaves(sorted(rnd.sample(leaves, int(0.8 * len(leaves))))).write(rep_tree_file)
+                rep_tree_files.append(rep_tree_file)
+
+            return tree_file, rep_tree_files
+
+        return self._get('support_trees', create)
+
+
+def bench_filter_genomes(data, output_dir):
+    """Time filtering of genomes on quality metadata."""
+
+    from genometreetk.common import filter_genomes
+
+    metadata_file = data.metadata_file
+
+    def run():
+        filter_genomes(metadata_file, 50, 10, 50, 1000, 5000, 10000, 100000)
+
+    return run, len(data.taxonomy[0])
+
+
+def bench_greedy_representatives(data, output_dir):
+    """Time greedy selection of representatives using Mash distances."""
+
+    from genometreetk.representatives import Representatives
+    from genometreetk.common import read_gtdb_taxonomy, read_gtdb_ncbi_taxonomy
+
+    reps = Representatives()
+    gtdb_taxonomy = read_gtdb_taxonomy(data.metadata_file)
+    ncbi_taxonomy = read_gtdb_ncbi_taxonomy(data.metadata_file)
+    mash_file = data.mash_file
+
+    init_reps = [line.strip() for line in open(data.rep_file)]
+    init_reps = set(init_reps[0:len(init_reps) // 2])
+    ordered_genomes = [g for g in data.taxonomy[0] if g not in init_reps]
+
+    def run():
+        reps._greedy_representatives(set(init_reps),
+                                        list(ordered_genomes),
+                                        gtdb_taxonomy,
+                                        ncbi_taxonomy,
+                                        mash_file)
+
+    return run, len(ordered_genomes)
+
+
+def bench_cluster(data, output_dir):
+    """Time clustering of genomes to representatives."""
+
+    from genometreetk.representatives import Representatives
+
+    reps = Representatives()
+    rep_file = data.rep_file
+    metadata_file = data.metadata_file
+    mash_file = data.mash_file
+    output_file = os.path.join(output_dir, 'clusters.tsv')
+
+    def run():
+        reps.cluster(rep_file, metadata_file, mash_file, output_file)
+
+    return run, len(data.taxonomy[0])
+
+
+def bench_create_concatenated_alignment(data, output_dir):
+    """Time concatenation of marker gene alignments."""
+
+    from genometreetk.common import create_concatenated_alignment
+
+    genome_ids = data.taxonomy[0]
+    alignment_dir, marker_genes = data.marker_alignments
+    msa_file = os.path.join(output_dir, 'concatenated.faa')
+    marker_file = os.path.join(output_dir, 'concatenated.markers.tsv')
+
+    def run():
+        create_concatenated_alignment(genome_ids, marker_genes, alignment_dir, msa_file, marker_file)
+
+    return run, len(genome_ids) * len(marker_genes)
+
+
+def bench_mask_alignment(data, output_dir):
+    """Time masking of a HMMER alignment."""
+
+    from genometreetk.markers.align_markers import AlignMarkers
+
+    align_markers = AlignMarkers(1)
+    stockholm_file = data.stockholm_file
+    output_file = os.path.join(output_dir, 'masked.faa')
+
+    def run():
+        align_markers._mask_alignment(stockholm_file, output_file)
+
+    return run, data.params['stockholm_seqs']
+
+
+def bench_genes_in_genomes(data, output_dir):
+    """Time reading of Pfam and TIGRfam top hit tables."""
+
+    from genometreetk.markers.align_markers import AlignMarkers
+
+    align_markers = AlignMarkers(1)
+    genome_ids, genome_dirs = data.top_hits
+
+    def run():
+        align_markers._genes_in_genomes(genome_ids, genome_dirs)
+
+    return run, len(genome_ids)
+
+
+def _pd_groups(data):
+    """Divide genomes into ingroup and outgroup by phylum."""
+
+    genome_ids, taxonomy = data.taxonomy
+    phyla = sorted(set(taxonomy[g][1] for g in genome_ids))
+    ingroup_phyla = set(phyla[0:max(1, len(phyla) // 2)])
+    ingroup = set(g for g in genome_ids if taxonomy[g][1] in ingroup_phyla)
+    outgroup = set(genome_ids) - ingroup
+
+    return ingroup, outgroup
+
+
+def bench_taxon_pd(data, output_dir):
+    """Time calculation of phylogenetic gain of ingroup taxa."""
+
+    from genometreetk.array_tree import ArrayTree
+    from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
+    pd = PhylogeneticDiversity()
+    tree = ArrayTree.read(data.tree_file)
+    ingroup, outgroup = _pd_groups(data)
+
+    def run():
+        pd._taxon_pd(tree, ingroup, outgroup, {})
+
+    return run, len(ingroup)
+
+
+def bench_clade_pd(data, output_dir):
+    """Time calculation of PD for all named clades."""
+
+    from genometreetk.array_tree import ArrayTree
+    from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
+    pd = PhylogeneticDiversity()
+    tree_index = pd._tree_index(ArrayTree.read(data.tree_file))
+    ingroup, outgroup = _pd_groups(data)
+    ingroup_count = dict((g, 1) for g in ingroup)
+    outgroup_count = dict((g, 1) for g in outgroup)
+
+    def run():
+        pd._clade_pd(tree_index, ingroup_count, outgroup_count)
+
+    return run, len(tree_index.clades)
+
+
+def bench_subset_taxa(data, output_dir):
+    """Time calculation of support from trees spanning subsets of taxa."""
+
+    from genometreetk.tree_support import TreeSupport
+
+    tree_support = TreeSupport()
+    tree_file, rep_tree_files = data.support_trees
+    output_tree = os.path.join(output_dir, 'support.tree')
+
+    def run():
+        tree_support.subset_taxa(tree_file, rep_tree_files, output_tree)
+
+    return run, len(rep_tree_files)
+
+
+def bench_trim_seqs(data, output_dir):
+    """Time trimming and removal of identical rRNA sequences."""
+
+    from genometreetk.rna_workflow import RNA_Workflow
+
+    rna_workflow = RNA_Workflow(1)
+    msa_file = data.nucleotide_msa
+    output_msa = os.path.join(output_dir, 'trimmed.fna')
+
+    def run():
+        rna_workflow._trim_seqs(msa_file, output_msa, remove_identical=True, min_per_taxa=0.5, min_bp=data.params['msa_length'] // 2)
+
+    return run, data.params['msa_seqs']
+
+
+def bench_msa_subset(data, output_dir):
+    """Time extraction of a subset of sequences from an indexed alignment."""
+
+    from genometreetk.fasta_index import FastaIndex
+
+    msa_index = FastaIndex(data.nucleotide_msa, os.path.join(output_dir, 'msa.gtk_idx'))
+    seq_ids = msa_index.ids()
+    subset = random.Random(data.seed).sample(seq_ids, max(1, len(seq_ids) // 10))
+    output_msa = os.path.join(output_dir, 'subset.fna')
+
+    def run():
+        msa_index.write_subset(subset, output_msa)
+
+    return run, len(subset)
+
+
+def bench_cli_startup(data, output_dir):
+    """Time start up of the command line script running a small taxonomy command."""
+
+    from benchmarks import startup
+
+    taxonomy_file = os.path.join(output_dir, 'startup_taxonomy.tsv')
+    startup.write_taxonomy(taxonomy_file, 100)
+    output_file = os.path.join(output_dir, 'startup_filled.tsv')
+
+    def run():
+        startup.time_command('fill_ranks', taxonomy_file, output_file, 1, script=True)
+
+    return run, 1
+
+
+BENCHMARKS = [('filter_genomes', bench_filter_genomes),
+                ('greedy_representatives', bench_greedy_representatives),
+                ('cluster', bench_cluster),
+                ('create_concatenated_alignment', bench_create_concatenated_alignment),
+                ('mask_alignment', bench_mask_alignment),
+                ('genes_in_genomes', bench_genes_in_genomes),
+                ('taxon_pd', bench_taxon_pd),
+                ('clade_pd', bench_clade_pd),
+                ('subset_taxa', bench_subset_taxa),
+                ('trim_seqs', bench_trim_seqs),
+                ('msa_subset', bench_msa_subset),
+                ('cli_startup', bench_cli_startup)]
+
+
+def git_commit():
+    """Get commit of working tree, if available."""
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scale, repeats, seed, data_dir, selected=None):
+    """Run benchmarks and return report.
+
+    Parameters
+    ----------
+    scale : str
+        Size of synthetic data sets.
+    repeats : int
+        Number of times to time each benchmark.
+    seed : int
+        Seed for random number generators.
+    data_dir : str
+        Directory for synthetic data and outputs.
+    selected : iterable
+        Names of benchmarks to run, or None for all benchmarks.
+
+    Returns
+    -------
+    dict
+        Timings of each benchmark along with a description of the run.
+    """
+
+    logger = logging.getLogger('benchmarks')
+
+    params = SCALES[scale]
+    data = BenchmarkData(data_dir, params, seed)
+    output_dir = os.path.join(data_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    report = {'scale': scale,
+                'params': params,
+                'seed': seed,
+                'repeats': repeats,
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': {}}
+
+    for name, bench in BENCHMARKS:
+        if selected and name not in selected:
+            continue
+
+        with redirect_stdout(io.StringIO()):
+            run, num_items = bench(data, output_dir)
+
+        times = []
+        for _ in range(repeats):
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+
+        best = min(times)
+        report['results'][name] = {'times': times,
+                                    'min': best,
+                                    'median': float(np.median(times)),
+                                    'items': num_items,
+                                    'items_per_second': num_items / best if best > 0 else None}
+
+        logger.info('%-30s %10.4f s  (%d items)' % (name, best, num_items))
+
+    return report
+
+
+def main():
+    """Run benchmarks from the command line."""
+
+    parser = argparse.ArgumentParser(description='Time performance critical code on synthetic data.')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='size of synthetic data sets')
+    parser.add_argument('--repeats', type=int, default=3, help='number of times to time each benchmark')
+    parser.add_argument('--seed', type=int, default=1, help='seed for generating synthetic data')
+    parser.add_argument('--data_dir', help='directory for synthetic data (default: temporary directory)')
+    parser.add_argument('--only', nargs='+', choices=[name for name, _ in BENCHMARKS], help='benchmarks to run')
+    parser.add_argument('--output', help='JSON report (default: stdout)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    logging.getLogger('benchmarks').setLevel(logging.INFO)
+
+    data_dir = args.data_dir
+    if not data_dir:
+        data_dir = tempfile.mkdtemp(prefix='genometreetk_bench_')
+    os.makedirs(data_dir, exist_ok=True)
+
+    try:
+        report = run_benchmarks(args.scale, args.repeats, args.seed, data_dir, args.only)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    report_str = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fout:
+            fout.write(report_str + '\n')
+    else:
+        sys.stdout.write(report_str + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Time start up of small taxonomy commands and check for eager imports.
+
+Small commands such as fill_ranks are run many times from scripts, so
+loading the command line interface must not import the workflows or
+the external program wrappers used by other commands. Commands are
+timed both through the command line script and through the Python
+interface, so the cost of the script itself is visible. Run with:
+    python -m benchmarks.startup --repeats 10 --max_time 0.5
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# command line script dispatching commands
+BIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'bin',
+                            'genometreetk')
+
+# genometreetk modules which may be loaded before a command is run
+ALLOWED_MODULES = set(['genometreetk',
+                        'genometreetk.main',
+                        'genometreetk.exceptions',
+                        'genometreetk.profiler'])
+
+# third-party modules which must only be loaded by commands requiring them
+HEAVY_MODULES = set(['dendropy',
+                        'scipy',
+                        'biolib.external.hmmer',
+                        'biolib.external.fasttree',
+                        'biolib.external.blast'])
+
+LIST_MODULES = """
+import sys
+import genometreetk.main
+print('\\n'.join(sorted(sys.modules)))
+"""
+
+# modules loaded by the command line script before it dispatches a
+# command, determined by requesting help for the command
+LIST_SCRIPT_MODULES = """
+import sys
+import runpy
+sys.argv = [sys.argv[1], sys.argv[2], '-h']
+sys.stdout = open('/dev/null', 'w')
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print('\\n'.join(sorted(sys.modules)))
+"""
+
+RUN_COMMAND = """
+import sys
+import argparse
+from genometreetk.main import OptionsParser
+options = argparse.Namespace(subparser_name=sys.argv[1],
+                                input_taxonomy=sys.argv[2],
+                                output_taxonomy=sys.argv[3],
+                                silent=True)
+OptionsParser().parse_options(options)
+"""
+
+
+def check_script():
+    """Check that the command line script compiles under the running interpreter.
+
+    Returns
+    -------
+    str
+        Compilation error, or None if the script compiles.
+    """
+
+    with open(BIN_SCRIPT) as f:
+        source = f.read()
+
+    try:
+        compile(source, BIN_SCRIPT, 'exec')
+    except SyntaxError as e:
+        return '%s (line %s)' % (e.msg, e.lineno)
+
+    return None
+
+
+def eager_imports(command=None):
+    """Get modules loaded by the command line interface which should be loaded lazily.
+
+    Parameters
+    ----------
+    command : str
+        Command dispatched by the command line script, or None to
+        check the modules loaded by genometreetk.main.
+
+    Returns
+    -------
+    list
+        Names of modules which should not have been loaded.
+    """
+
+    if command is None:
+        output = subprocess.check_output([sys.executable, '-c', LIST_MODULES])
+    else:
+        output = subprocess.check_output([sys.executable, '-c', LIST_SCRIPT_MODULES, BIN_SCRIPT, command])
+
+    eager = []
+    for module in output.decode('utf-8').split():
+        if module.startswith('genometreetk.') and module not in ALLOWED_MODULES:
+            eager.append(module)
+        elif module in HEAVY_MODULES or module.split('.')[0] in HEAVY_MODULES:
+            eager.append(module)
+
+    return eager
+
+
+def write_taxonomy(taxonomy_file, num_genomes):
+    """Write small taxonomy file."""
+
+    with open(taxonomy_file, 'w') as fout:
+        for i in range(num_genomes):
+            genus = 'Genus%d' % (i % 23)
+            fout.write('G%06d\td__Bacteria;p__Phylum%d;c__Class%d;o__Order%d;f__Family%d;g__%s;s__%s sp%d\n'
+                        % (i, i % 3, i % 5, i % 7, i % 11, genus, genus, i))
+
+
+def time_command(command, taxonomy_file, output_file, repeats, script=False):
+    """Time running command in a new interpreter.
+
+    Parameters
+    ----------
+    command : str
+        Name of command taking an input and output taxonomy file.
+    taxonomy_file : str
+        Input taxonomy file.
+    output_file : str
+        Output taxonomy file.
+    repeats : int
+        Number of times to run command.
+    script : boolean
+        Run command through the command line script instead of OptionsParser.
+
+    Returns
+    -------
+    list
+        Wall time of each run of the command.
+    """
+
+    if script:
+        cmd = [sys.executable, BIN_SCRIPT, command, taxonomy_file, output_file, '--silent']
+    else:
+        cmd = [sys.executable, '-c', RUN_COMMAND, command, taxonomy_file, output_file]
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.check_call(cmd,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def time_interpreter(repeats):
+    """Time start up of a bare interpreter."""
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'pass'])
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def main():
+    """Time start up of small commands from the command line."""
+
+    parser = argparse.ArgumentParser(description='Time start up of small taxonomy commands.')
+    parser.add_argument('--repeats', type=int, default=10, help='number of times to run each command')
+    parser.add_argument('--commands', nargs='+', default=['fill_ranks', 'binomial'], help='commands to time')
+    parser.add_argument('--max_time', type=float, help='exit with an error if any command takes longer than this many seconds')
+    args = parser.parse_args()
+
+    failed = False
+
+    error = check_script()
+    if error:
+        print('Command line script does not compile: %s' % error)
+        sys.exit(1)
+
+    eager = eager_imports()
+    if eager:
+        print('Modules imported before a command is run: %s' % ', '.join(eager))
+        failed = True
+
+    for command in args.commands:
+        eager = eager_imports(command)
+        if eager:
+            print('Modules imported by %s before %s is run: %s' % (BIN_SCRIPT, command, ', '.join(eager)))
+            failed = True
+
+    tmp_dir = tempfile.mkdtemp(prefix='genometreetk_startup_')
+    try:
+        taxonomy_file = os.path.join(tmp_dir, 'taxonomy.tsv')
+        write_taxonomy(taxonomy_file, 100)
+
+        interpreter_time = min(time_interpreter(args.repeats))
+        print('%-21s %8.3f s' % ('python', interpreter_time))
+
+        for command in args.commands:
+            output_file = os.path.join(tmp_dir, command + '.tsv')
+            for script in [False, True]:
+                label = command + (' (script)' if script else '')
+                best = min(time_command(command, taxonomy_file, output_file, args.repeats, script))
+                print('%-21s %8.3f s  (%.3f s over interpreter)' % (label, best, best - interpreter_time))
+
+                if args.max_time is not None and best > args.max_time:
+                    print('Start up of %s exceeds %.3f s.' % (label, args.max_time))
+                    failed = True
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
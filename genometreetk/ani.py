@@ -16,14 +16,12 @@
 ###############################################################################
 
 import os
-import sys
 import shutil
 import logging
 import operator
 import itertools
 import tempfile
 from collections import defaultdict
-import multiprocessing as mp
 
 from biolib.taxonomy import Taxonomy
 from biolib.external.execute import check_on_path
@@ -31,6 +29,9 @@ from biolib.external.execute import check_on_path
 from genometreetk.common import (read_gtdb_taxonomy,
                                     read_gtdb_metadata,
                                     filter_genomes)
+from genometreetk.ani_cache import ANICache
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler
                                     
 from numpy import (mean as np_mean,
                     percentile as np_percentile)
@@ -51,111 +52,131 @@ class ANI(object):
         self.logger = logging.getLogger('timestamp')
 
         self.cpus = cpus
+
+        # maximum number of genome pairs processed by a worker per job
+        self.pairs_per_job = 10
         
         check_on_path('ani_calculator')
 
-    def __worker(self,
-                    metadata_file,
-                    nt_files,
-                    max_genomes,
-                    queue_in,
-                    queue_out):
-        """Process each species in parallel."""
-        
-        metadata = read_gtdb_metadata(metadata_file, ['checkm_completeness', 
-                                                        'checkm_contamination'])
-            
-        genome_quality = {}
-        for genome_id, m in metadata.items():
-            genome_quality[genome_id] = m.checkm_completeness - 5*m.checkm_contamination
-                
-        while True:
-            species, genome_ids = queue_in.get(block=True, timeout=None)
-            if species == None:
-                break
-                
-            # select highest quality genomes
-            if len(genome_ids) > max_genomes:
-                t = [(genome_id, q) 
-                        for genome_id, q in genome_quality.items() 
-                        if genome_id in genome_ids]
-                hq_genomes = sorted(t, key=lambda x: x[1], reverse=True)[0:max_genomes]
-                genome_ids = [x[0] for x in hq_genomes]
+    def __calculate_ani(self, genome1_fna, genome2_fna, tmp_dir):
+        """Calculate ANI and AF between a pair of genomes with ani_calculator."""
+
+        tmp_file = tempfile.NamedTemporaryFile(delete=False, dir=tmp_dir)
+        tmp_file.close()
+        cmd = ('ani_calculator ' + 
+                '-genome1fna %s ' + 
+                '-genome2fna %s ' +
+                '-outfile %s -outdir %s ' +
+                '> /dev/null') % (genome1_fna, 
+                                    genome2_fna,
+                                    tmp_file.name,
+                                    tmp_dir)
+
+        os.system(cmd)
+
+        values = None
+        with open(tmp_file.name) as f:
+            f.readline()
+            for line in f:
+                line_split = line.strip().split('\t')
+                values = tuple([float(v) for v in line_split[2:6]])
+        os.remove(tmp_file.name)
 
-            ani = []
-            af = []
-            results = ''
-            tmp_dir = tempfile.mkdtemp()
-            for gi, gj in itertools.combinations(genome_ids, 2):
-                tmp_file = tempfile.NamedTemporaryFile(delete=False, dir=tmp_dir)
-                tmp_file.close()
-                cmd = ('ani_calculator ' + 
-                        '-genome1fna %s ' + 
-                        '-genome2fna %s ' +
-                        '-outfile %s -outdir %s ' +
-                        '> /dev/null') % (nt_files[gi], 
-                                            nt_files[gj],
-                                            tmp_file.name,
-                                            tmp_dir)
-      
-                os.system(cmd)
-                with open(tmp_file.name) as f:
-                    f.readline()
-                    for line in f:
-                        results += '%s\t%s' % (species, line)
-                        line_split = line.strip().split('\t')
-                        ani.append(0.5*(float(line_split[2]) + float(line_split[3])))
-                        af.append(0.5*(float(line_split[4]) + float(line_split[5])))
+        return values
 
+    def _ani_producer(self, job):
+        """Calculate ANI between a block of genome pairs."""
+
+        species, genome_pairs = job
+
+        # each worker opens its own read-only connection to the cache
+        if self.worker_cache is None:
+            self.worker_cache = ANICache(self.cache_file, read_only=True)
+
+        ani = []
+        af = []
+        results = []
+        new_results = []
+        tmp_dir = None
+        for gi, gj in genome_pairs:
+            hi = self.genome_hashes[gi]
+            hj = self.genome_hashes[gj]
+            values = None
+            if hi and hj:
+                values = self.worker_cache.lookup(hi, hj, self.calculator_hash)
+
+            if values is None:
+                if tmp_dir is None:
+                    tmp_dir = tempfile.mkdtemp()
+                values = self.__calculate_ani(self.nt_files[gi], self.nt_files[gj], tmp_dir)
+                if values is None:
+                    continue
+
+                if hi and hj:
+                    new_results.append((hi, hj, values))
+
+            # values are written at full precision so cached and newly
+            # calculated results are reported as given by ani_calculator
+            results.append('%s\t%s\t%s\t%s\n' % (species, gi, gj, '\t'.join([repr(v) for v in values])))
+            ani.append(0.5*(values[0] + values[1]))
+            af.append(0.5*(values[2] + values[3]))
+
+        if tmp_dir:
             shutil.rmtree(tmp_dir)
 
-            queue_out.put((species, ani, af, genome_ids, results))
+        return (species, len(genome_pairs), ani, af, results, new_results)
 
-    def __writer(self, num_species, output_dir, writer_queue):
-        """Write results for each species."""
-        
-        # gather results for each genome
-        output_file = os.path.join(output_dir, 'ani_species.tsv')
-        fout = open(output_file, 'w')
-        fout.write('Species\tNo. Sampled Genomes\tMean ANI\tMedian ANI\t5th Percentile\t95th Percentile')
-        fout.write('\tMean AF\tMedian AF\t5th Percentile\t95th Percentile')
-        fout.write('\tSampled Genomes\n')
-        
-        output_file = os.path.join(output_dir, 'ani.tsv')
-        fout_pw = open(output_file, 'w')
-        fout_pw.write('Species\tGenome 1\tGenome 2\tANI(1->2)\tANI(2->1)\tAF(1->2)\tAF(2->1)\n')
-        processed = 0
-        while True:
-            species, ani, af, genome_ids, results = writer_queue.get(block=True, timeout=None)
-            if species == None:
-              break
-
-            processed += 1
-            statusStr = 'Finished processing %d of %d (%.2f%%) species.' % (processed,
-                                                                            num_species,
-                                                                            float(processed) * 100 / num_species)
-            sys.stdout.write('%s\r' % statusStr)
-            sys.stdout.flush()
-            
-            fout_pw.write(results)
-            
-            row = '%s\t%d' % (species, len(genome_ids))
-            mean_ani = np_mean(ani)
-            p5, median, p95 = np_percentile(ani, [5, 50, 95])
-            row += '\t%.2f\t%.2f\t%.2f\t%.2f' % (mean_ani,
-                                                    median,
-                                                    p5, p95)
-            mean_af = np_mean(af)
-            p5, median, p95 = np_percentile(af, [5, 50, 95])
-            row += '\t%.2f\t%.2f\t%.2f\t%.2f' % (mean_af*100,
-                                                    median*100,
-                                                    p5*100, p95*100)
-            fout.write('%s\t%s\n' % (row, ','.join(genome_ids)))
-
-        sys.stdout.write('\n')
-
-        fout.close()
-        fout_pw.close()
+    def _ani_consumer(self, produced_data, consumer_data):
+        """Write pairwise results as they arrive and summarize each completed species."""
+
+        if consumer_data == None:
+            # number of species with all pairs processed
+            consumer_data = 0
+
+        species, num_pairs, ani, af, results, new_results = produced_data
+
+        self.fout_pw.writelines(results)
+        self.fout_pw.flush()
+
+        if new_results:
+            self.cache.store(new_results, self.calculator_hash)
+            profiler.count('pairs_calculated', len(new_results))
+
+        self.species_ani[species].extend(ani)
+        self.species_af[species].extend(af)
+        self.pairs_remaining[species] -= num_pairs
+        if self.pairs_remaining[species] > 0:
+            return consumer_data
+
+        # all pairs processed so summarize species
+        consumer_data += 1
+
+        ani = self.species_ani.pop(species)
+        af = self.species_af.pop(species)
+        genome_ids = self.species_genomes[species]
+
+        row = '%s\t%d' % (species, len(genome_ids))
+        mean_ani = np_mean(ani)
+        p5, median, p95 = np_percentile(ani, [5, 50, 95])
+        row += '\t%.2f\t%.2f\t%.2f\t%.2f' % (mean_ani,
+                                                median,
+                                                p5, p95)
+        mean_af = np_mean(af)
+        p5, median, p95 = np_percentile(af, [5, 50, 95])
+        row += '\t%.2f\t%.2f\t%.2f\t%.2f' % (mean_af*100,
+                                                median*100,
+                                                p5*100, p95*100)
+        self.fout.write('%s\t%s\n' % (row, ','.join(genome_ids)))
+        self.fout.flush()
+
+        return consumer_data
+
+    def _ani_progress(self, processed_items, total_items):
+        """Report progress of ANI calculations."""
+
+        return '==> Processed %d of %d (%.2f%%) blocks of genome pairs.' % (processed_items,
+                                                                            total_items,
+                                                                            float(processed_items) * 100 / total_items)
 
     def run(self,
                 input_taxonomy,
@@ -169,8 +190,15 @@ class ANI(object):
                 min_N50, 
                 max_ambiguous, 
                 max_gap_length, 
-                output_dir):
-        """Calculate ANI for named species."""
+                output_dir,
+                cache_file=None):
+        """Calculate ANI for named species.
+
+        Results are stored in a persistent cache so only pairs of
+        genomes which have not been compared previously are processed
+        when the command is rerun. The cache is written to the output
+        directory unless a cache file is specified.
+        """
         
         # get genomes passing filtering criteria
         filtered_genome_ids = filter_genomes(metadata_file,
@@ -203,41 +231,88 @@ class ANI(object):
             nt_file = os.path.join(genome_dir, 'prodigal', genome_id + '_protein.fna')
             nt_files[gtdb_id] = nt_file
 
-        # populate worker queue with data to process
-        worker_queue = mp.Queue()
-        writer_queue = mp.Queue()
+        # select highest quality genomes in each species
+        metadata = read_gtdb_metadata(metadata_file, ['checkm_completeness', 
+                                                        'checkm_contamination'])
+            
+        genome_quality = {}
+        for genome_id, m in metadata.items():
+            genome_quality[genome_id] = m.checkm_completeness - 5*m.checkm_contamination
 
-        num_species = 0
+        species_genomes = {}
         for species, genome_ids in named_species.items():
+            if len(genome_ids) > max_genomes:
+                t = [(genome_id, genome_quality[genome_id]) 
+                        for genome_id in genome_ids 
+                        if genome_id in genome_quality]
+                hq_genomes = sorted(t, key=lambda x: x[1], reverse=True)[0:max_genomes]
+                genome_ids = [x[0] for x in hq_genomes]
+
             if len(genome_ids) > 1:
-                worker_queue.put((species, genome_ids))
-                num_species += 1
+                species_genomes[species] = list(genome_ids)
+
+        # create blocks of genome pairs, starting with the largest
+        # species so their results are completed early
+        jobs = []
+        num_pairs = 0
+        for species in sorted(species_genomes, key=lambda sp: len(species_genomes[sp]), reverse=True):
+            genome_pairs = list(itertools.combinations(species_genomes[species], 2))
+            num_pairs += len(genome_pairs)
+            for i in range(0, len(genome_pairs), self.pairs_per_job):
+                jobs.append((species, genome_pairs[i:i + self.pairs_per_job]))
 
-        for _ in range(self.cpus):
-          worker_queue.put((None, None))
+        # hash nucleotide files of genomes to identify previously calculated pairs
+        if not cache_file:
+            cache_file = os.path.join(output_dir, 'ani_cache.db')
+        self.logger.info('Reading previously calculated ANI values from: %s' % cache_file)
+
+        self.cache = ANICache(cache_file)
+        self.calculator_hash = self.cache.file_hash(shutil.which('ani_calculator'))
+        genome_ids = [genome_id for ids in species_genomes.values() for genome_id in ids]
+        file_hashes = self.cache.file_hashes([nt_files[genome_id] for genome_id in genome_ids], self.cpus)
+        genome_hashes = {}
+        for genome_id in genome_ids:
+            genome_hashes[genome_id] = file_hashes[nt_files[genome_id]]
+
+        self.logger.info('Calculating ANI between %d pairs of genomes in %d species.' % (num_pairs, len(species_genomes)))
+        profiler.count('genomes', len(genome_hashes))
+        profiler.count('species', len(species_genomes))
+        profiler.count('pairs', num_pairs)
+
+        # state used by workers
+        self.nt_files = nt_files
+        self.genome_hashes = genome_hashes
+        self.cache_file = cache_file
+        self.worker_cache = None
+
+        # state used to write results
+        self.species_genomes = species_genomes
+        self.pairs_remaining = {}
+        for species, genome_ids in species_genomes.items():
+            self.pairs_remaining[species] = len(genome_ids) * (len(genome_ids) - 1) // 2
+        self.species_ani = defaultdict(list)
+        self.species_af = defaultdict(list)
+
+        self.fout = open(os.path.join(output_dir, 'ani_species.tsv'), 'w')
+        self.fout.write('Species\tNo. Sampled Genomes\tMean ANI\tMedian ANI\t5th Percentile\t95th Percentile')
+        self.fout.write('\tMean AF\tMedian AF\t5th Percentile\t95th Percentile')
+        self.fout.write('\tSampled Genomes\n')
+
+        self.fout_pw = open(os.path.join(output_dir, 'ani.tsv'), 'w')
+        self.fout_pw.write('Species\tGenome 1\tGenome 2\tANI(1->2)\tANI(2->1)\tAF(1->2)\tAF(2->1)\n')
 
         try:
-          worker_proc = [mp.Process(target=self.__worker, args=(metadata_file,
-                                                                    nt_files,
-                                                                    max_genomes,
-                                                                    worker_queue,
-                                                                    writer_queue)) for _ in range(self.cpus)]
-          write_proc = mp.Process(target=self.__writer, args=(num_species,
-                                                                  output_dir,
-                                                                  writer_queue))
-
-          write_proc.start()
-
-          for p in worker_proc:
-              p.start()
-
-          for p in worker_proc:
-              p.join()
-
-          writer_queue.put((None, None, None, None, None))
-          write_proc.join()
-        except:
-          for p in worker_proc:
-            p.terminate()
-
-          write_proc.terminate()
+            with profiler.stage('calculate_ani'):
+                parallel = Parallel(self.cpus)
+                num_species = parallel.run(self._ani_producer,
+                                            self._ani_consumer,
+                                            jobs,
+                                            self._ani_progress)
+        finally:
+            if self.worker_cache is not None:
+                self.worker_cache.close()
+            self.cache.close()
+            self.fout.close()
+            self.fout_pw.close()
+
+        self.logger.info('Summarized ANI of %d species.' % (num_species or 0))
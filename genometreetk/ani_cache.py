@@ -0,0 +1,237 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import hashlib
+import logging
+import sqlite3
+from urllib.request import pathname2url
+
+from genometreetk.parallel import Parallel
+
+
+class ANICache(object):
+    """Persistent store of pairwise ANI results.
+
+    Results are keyed by the SHA-1 hash of the nucleotide file of
+    each genome and the hash of the program used to calculate ANI,
+    so results are reused whenever the same pair of sequence files
+    is compared with the same program, regardless of file names.
+    The hash of each file is also stored along with its size and
+    modification time to avoid rehashing unchanged files.
+    """
+
+    def __init__(self, cache_file, read_only=False):
+        """Initialization.
+
+        Parameters
+        ----------
+        cache_file : str
+            SQLite database containing cached results.
+        read_only : bool
+            Open existing cache as read-only, as done by workers.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cache_file = cache_file
+
+        if read_only:
+            # reject writes, which workers must leave to the main process
+            uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(cache_file))
+            self.conn = sqlite3.connect(uri, timeout=300, uri=True)
+        else:
+            self.conn = sqlite3.connect(cache_file, timeout=300)
+
+            # allow results to be read by workers while new results are written
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS file_hashes ('
+                                'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS ani ('
+                                'genome1 TEXT, genome2 TEXT, calculator TEXT, '
+                                'ani12 REAL, ani21 REAL, af12 REAL, af21 REAL, '
+                                'PRIMARY KEY (genome1, genome2, calculator))')
+            self.conn.commit()
+
+    def close(self):
+        """Close connection to cache."""
+
+        self.conn.close()
+
+    def _hash_file(self, path):
+        """Calculate SHA-1 hash of file contents."""
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                sha1.update(block)
+
+        return sha1.hexdigest()
+
+    def file_hash(self, path):
+        """Get hash of file, calculating it only if the file has changed.
+
+        Parameters
+        ----------
+        path : str
+            File to hash.
+
+        Returns
+        -------
+        str
+            SHA-1 hash of file contents, or None if the file does not exist.
+        """
+
+        if not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+        row = self.conn.execute('SELECT size, mtime, hash FROM file_hashes WHERE path=?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        h = self._hash_file(path)
+        self.conn.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                            (path, stat.st_size, stat.st_mtime, h))
+        self.conn.commit()
+
+        return h
+
+    def _hash_producer(self, path):
+        """Hash file in a worker process."""
+
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime, self._hash_file(path))
+
+    def _hash_consumer(self, produced_data, consumer_data):
+        """Record hash of file."""
+
+        if consumer_data == None:
+            consumer_data = {}
+
+        path, _size, _mtime, h = produced_data
+        consumer_data[path] = h
+        self.conn.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)', produced_data)
+
+        return consumer_data
+
+    def _hash_progress(self, processed_items, total_items):
+        """Report progress of hashed files."""
+
+        return '==> Hashed %d of %d (%.2f%%) files.' % (processed_items,
+                                                        total_items,
+                                                        float(processed_items) * 100 / total_items)
+
+    def file_hashes(self, paths, cpus=1):
+        """Get hash of files, calculating hashes of new or changed files in parallel.
+
+        Files are identified as unchanged by their size and
+        modification time, so only files not previously seen
+        or modified since being hashed are read.
+
+        Parameters
+        ----------
+        paths : iterable
+            Files to hash.
+        cpus : int
+            Number of files to hash in parallel.
+
+        Returns
+        -------
+        dict
+            SHA-1 hash of each file, or None if the file does not exist.
+        """
+
+        stored = {}
+        for path, size, mtime, h in self.conn.execute('SELECT path, size, mtime, hash FROM file_hashes'):
+            stored[path] = (size, mtime, h)
+
+        hashes = {}
+        paths_to_hash = []
+        for path in sorted(set(paths)):
+            if not os.path.exists(path):
+                hashes[path] = None
+                continue
+
+            stat = os.stat(path)
+            row = stored.get(path)
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                hashes[path] = row[2]
+            else:
+                paths_to_hash.append(path)
+
+        if paths_to_hash:
+            self.logger.info('Hashing %d new or modified files:' % len(paths_to_hash))
+            parallel = Parallel(cpus)
+            new_hashes = parallel.run(self._hash_producer,
+                                        self._hash_consumer,
+                                        paths_to_hash,
+                                        self._hash_progress)
+            self.conn.commit()
+            hashes.update(new_hashes)
+
+        return hashes
+
+    def lookup(self, genome1, genome2, calculator):
+        """Get cached result for a pair of genomes.
+
+        Parameters
+        ----------
+        genome1 : str
+            Hash of first genome.
+        genome2 : str
+            Hash of second genome.
+        calculator : str
+            Hash of program used to calculate ANI.
+
+        Returns
+        -------
+        (float, float, float, float)
+            ANI(1->2), ANI(2->1), AF(1->2), AF(2->1), or None if the pair is not cached.
+        """
+
+        row = self.conn.execute('SELECT ani12, ani21, af12, af21 FROM ani '
+                                    'WHERE genome1=? AND genome2=? AND calculator=?',
+                                    (genome1, genome2, calculator)).fetchone()
+        if row:
+            return row
+
+        row = self.conn.execute('SELECT ani21, ani12, af21, af12 FROM ani '
+                                    'WHERE genome1=? AND genome2=? AND calculator=?',
+                                    (genome2, genome1, calculator)).fetchone()
+        if row:
+            return row
+
+        return None
+
+    def store(self, results, calculator):
+        """Record results for pairs of genomes.
+
+        Parameters
+        ----------
+        results : iterable
+            Hash of both genomes along with ANI(1->2), ANI(2->1), AF(1->2), and AF(2->1) for each pair.
+        calculator : str
+            Hash of program used to calculate ANI.
+        """
+
+        self.conn.executemany('INSERT OR REPLACE INTO ani VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                [(g1, g2, calculator) + tuple(values) for g1, g2, values in results])
+        self.conn.commit()
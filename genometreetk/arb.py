@@ -20,8 +20,8 @@ import sys
 import csv
 import logging
 
-import biolib.seq_io as seq_io
-
+from genometreetk.fasta_index import FastaIndex
+from genometreetk.parallel import Parallel
 from genometreetk.common import (read_gtdb_metadata,
                                     read_genome_dir_file,
                                     read_gtdb_taxonomy)
@@ -42,45 +42,174 @@ class Arb(object):
                     aligned_seq):
         """Write out ARB record for genome."""
 
-        fout.write("BEGIN\n")
-        fout.write("db_name=%s\n" % genome_id)
+        record = ["BEGIN\n", "db_name=%s\n" % genome_id]
         for col_header, value in zip(metadata_fields, metadata_values):
             # replace equal signs as these are incompatible with the ARB parser
             if value:
                 value = value.replace('=', '/')
 
-            fout.write("%s=%s\n" % (col_header, value))
+            record.append("%s=%s\n" % (col_header, value))
         
-        fout.write("multiple_homologs=<n/a>\n")
-        fout.write("aligned_seq=%s\n" % (aligned_seq))
-        fout.write("END\n\n")
+        record.append("multiple_homologs=<n/a>\n")
+        record.append("aligned_seq=%s\n" % (aligned_seq))
+        record.append("END\n\n")
+
+        fout.write(''.join(record))
+
+    def _shard_ranges(self, metadata_file, num_shards):
+        """Divide rows of metadata file into byte ranges starting at record boundaries.
+
+        Quoted fields may contain line breaks, so a line starts a new
+        record only if all preceding lines contain an even number of
+        quote characters (escaped quotes are doubled in CSV files).
+        """
+
+        with open(metadata_file, 'rb') as f:
+            in_quotes = False
+            for line in f:
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes:
+                    break
+            data_start = f.tell()
+            size = os.fstat(f.fileno()).st_size
+
+            targets = [data_start + (size - data_start) * i // num_shards for i in range(1, num_shards)]
+
+            starts = [data_start]
+            pos = data_start
+            in_quotes = False
+            for line in f if targets else []:
+                if not in_quotes:
+                    while targets and pos >= targets[0]:
+                        targets.pop(0)
+                        starts.append(pos)
+
+                    if not targets:
+                        break
+
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                pos += len(line)
+            starts.append(size)
+
+        # files with fewer rows than shards produce empty ranges,
+        # which are dropped so no empty shards are written
+        ranges = [(start, end) for start, end in zip(starts[:-1], starts[1:]) if end > start]
+
+        return ranges if ranges else [(data_start, size)]
+
+    def _read_lines(self, metadata_file, start, end):
+        """Read lines within byte range of metadata file."""
+
+        with open(metadata_file, 'rb') as f:
+            f.seek(start)
+            pos = start
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len(line)
+                yield line.decode('utf-8')
+
+    def _shard_producer(self, shard):
+        """Write ARB records for rows in a shard of the metadata file."""
+
+        shard_index, (start, end), output_file = shard
+
+        num_records = 0
+        with open(output_file, 'w', buffering=self.write_buffer) as fout:
+            for row in csv.reader(self._read_lines(self.metadata_file, start, end)):
+                genome_id = row[0]
+                if self.genomes_to_keep and genome_id not in self.genomes_to_keep:
+                    continue
+
+                aligned_seq = ''
+                if self.msa_index is not None and genome_id in self.msa_index:
+                    aligned_seq = self.msa_index.sequence(genome_id)
+
+                self._record(fout, genome_id, self.fields, row[1:], aligned_seq)
+                num_records += 1
 
-    def create_records(self, metadata_file, msa_file, genome_list, output_file):
-        """Create ARB records from GTDB metadata."""
+        return num_records
+
+    def _shard_consumer(self, produced_data, consumer_data):
+        """Count records written to shards."""
+
+        if consumer_data == None:
+            consumer_data = 0
+
+        consumer_data += produced_data
+
+        return consumer_data
+
+    def _shard_progress(self, processed_items, total_items):
+        """Report progress of shards."""
+
+        return '==> Finished %d of %d shards.' % (processed_items, total_items)
+
+    def create_records(self, metadata_file, msa_file, genome_list, output_file, shards=1, cpus=1):
+        """Create ARB records from GTDB metadata.
+
+        Metadata rows are read one at a time and joined with their
+        aligned sequence through an index of the MSA, so neither file
+        is loaded into memory. If more than one shard is requested,
+        the metadata file is divided into byte ranges of whole records
+        and the records for each range are written in parallel to
+        separate files named <output_file>.<shard>.<ext>. Fewer
+        shards are written if there are fewer rows than shards.
+
+        Parameters
+        ----------
+        metadata_file : str
+            Metadata for all genomes in CSV file.
+        msa_file : str
+            Aligned sequences to include in records, or None.
+        genome_list : str
+            File with genome IDs to create records for, or None for all genomes.
+        output_file : str
+            Output file with ARB records.
+        shards : int
+            Number of output files to write.
+        cpus : int
+            Number of shards to write in parallel.
+
+        Returns
+        -------
+        list
+            Output files.
+        """
         
-        seqs = {}
+        self.metadata_file = metadata_file
+        self.write_buffer = 1024 * 1024
+
+        self.msa_index = None
         if msa_file:
-            seqs = seq_io.read(msa_file)
+            self.msa_index = FastaIndex(msa_file)
             
-        genomes_to_keep = set()
+        self.genomes_to_keep = set()
         if genome_list:
             for line in open(genome_list):
-                genomes_to_keep.add(line.strip())
-                
-        fout = open(output_file, 'w')
-        
-        header = True
-        for row in csv.reader(open(metadata_file, 'rb')):
-            if header:
-                fields = row[1:]
-                header = False
-            else:
-                genome_id = row[0]
-                values = row[1:]
-                aligned_seq = seqs.get(genome_id, '')
-                
-                if not genomes_to_keep or genome_id in genomes_to_keep:
-                    self._record(fout, genome_id, fields, values, aligned_seq)
-
-        fout.close()
-            
\ No newline at end of file
+                self.genomes_to_keep.add(line.strip())
+
+        with open(metadata_file, 'rt') as f:
+            self.fields = next(csv.reader(f))[1:]
+
+        ranges = self._shard_ranges(metadata_file, max(1, shards))
+        if len(ranges) == 1:
+            output_files = [output_file]
+        else:
+            root, ext = os.path.splitext(output_file)
+            output_files = ['%s.%d%s' % (root, i, ext) for i in range(len(ranges))]
+
+        jobs = [(i, r, f) for i, (r, f) in enumerate(zip(ranges, output_files))]
+
+        parallel = Parallel(cpus)
+        num_records = parallel.run(self._shard_producer,
+                                    self._shard_consumer,
+                                    jobs,
+                                    self._shard_progress if len(jobs) > 1 else None)
+
+        self.logger.info('Wrote %d ARB records to %d file(s).' % (num_records or 0, len(output_files)))
+
+        return output_files
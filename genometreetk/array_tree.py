@@ -0,0 +1,607 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import io
+import re
+
+import numpy as np
+
+from genometreetk.exceptions import GenomeTreeTkError
+
+
+class ArrayTree(object):
+    """Compact tree with nodes stored in preorder as NumPy arrays.
+
+    Node 0 is the root and the subtree of node i spans the
+    index range [i, subtree_end[i]). Labels of leaves are
+    taxon labels while labels of internal nodes are the
+    support values and/or taxa assigned to a node.
+    """
+
+    # Newick tokens: quoted label, comment, punctuation, or unquoted label
+    token_re = re.compile(r"\s*(?:'((?:[^']|'')*)'|(\[[^\]]*\])|([(),:;])|([^\s()\[\]',:;]+))")
+
+    # characters requiring a label to be quoted in Newick format
+    quote_re = re.compile(r"[\s()\[\]',:;]")
+
+    read_chunk_size = 1024 * 1024
+
+    def __init__(self, parent, edge_lengths, labels):
+        """Initialize.
+
+        Parameters
+        ----------
+        parent : np.array
+            Index of parent of each node in preorder, with -1 for the root.
+        edge_lengths : np.array
+            Length of edge leading to each node, with NaN for missing lengths.
+        labels : list
+            Label of each node, with None for unlabeled nodes.
+        """
+
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.edge_lengths = np.asarray(edge_lengths, dtype=np.float64)
+        self.labels = list(labels)
+
+        num_nodes = len(self.parent)
+
+        # children of each node stored as offsets into a single array
+        child_nodes = np.arange(1, num_nodes)
+        self.children = child_nodes[np.argsort(self.parent[1:], kind='stable')]
+        self.child_offsets = np.searchsorted(self.parent[1:][self.children - 1],
+                                                np.arange(num_nodes + 1))
+        self.num_children = np.diff(self.child_offsets)
+        self.is_leaf = self.num_children == 0
+
+        # extent of each subtree in preorder
+        subtree_end = np.arange(1, num_nodes + 1)
+        parent_list = self.parent.tolist()
+        end_list = subtree_end.tolist()
+        for i in range(num_nodes - 1, 0, -1):
+            p = parent_list[i]
+            if end_list[i] > end_list[p]:
+                end_list[p] = end_list[i]
+        self.subtree_end = np.array(end_list, dtype=np.int64)
+
+    def __len__(self):
+        """Number of nodes in tree."""
+
+        return len(self.parent)
+
+    @classmethod
+    def _tokens(cls, newick_stream):
+        """Generate tokens from a Newick stream read in chunks."""
+
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            m = cls.token_re.match(buf, pos)
+            if not eof and (m is None or m.end() == len(buf)):
+                # token may continue into the next chunk
+                chunk = newick_stream.read(cls.read_chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            if m is None:
+                if buf[pos:].strip():
+                    raise GenomeTreeTkError('Invalid Newick string near: %s' % buf[pos:pos + 50])
+                return
+
+            pos = m.end()
+
+            quoted, comment, punctuation, label = m.groups()
+            if comment is not None:
+                continue
+            elif punctuation is not None:
+                yield punctuation, None
+            elif quoted is not None:
+                yield 'label', quoted.replace("''", "'")
+            else:
+                yield 'label', label
+
+    @classmethod
+    def parse(cls, newick_stream):
+        """Parse first tree in a Newick stream.
+
+        Parameters
+        ----------
+        newick_stream : file
+            Stream containing tree in Newick format.
+
+        Returns
+        -------
+        ArrayTree
+            Parsed tree.
+        """
+
+        parent = []
+        edge_lengths = []
+        labels = []
+
+        def add_node(parent_node, label):
+            parent.append(parent_node)
+            edge_lengths.append(np.nan)
+            labels.append(label)
+            return len(parent) - 1
+
+        cur_node = -1           # internal node whose children are being read
+        last_node = None        # node most recently read or closed
+        expect_node = True
+        expect_length = False
+        for token, value in cls._tokens(newick_stream):
+            if expect_length:
+                if token != 'label':
+                    raise GenomeTreeTkError('Expected edge length after colon in Newick string.')
+                edge_lengths[last_node] = float(value)
+                expect_length = False
+                continue
+
+            if token == '(':
+                if not expect_node:
+                    raise GenomeTreeTkError('Unexpected parenthesis in Newick string.')
+                cur_node = add_node(cur_node, None)
+            elif token == 'label':
+                if expect_node:
+                    last_node = add_node(cur_node, value)
+                    expect_node = False
+                else:
+                    labels[last_node] = value
+            else:
+                if expect_node:
+                    # unlabeled leaf node
+                    last_node = add_node(cur_node, None)
+                    expect_node = False
+
+                if token == ',':
+                    expect_node = True
+                elif token == ')':
+                    if cur_node == -1:
+                        raise GenomeTreeTkError('Unbalanced parentheses in Newick string.')
+                    last_node = cur_node
+                    cur_node = parent[cur_node]
+                elif token == ':':
+                    expect_length = True
+                elif token == ';':
+                    break
+
+        if not parent:
+            raise GenomeTreeTkError('Newick string does not contain a tree.')
+
+        if cur_node != -1:
+            raise GenomeTreeTkError('Unbalanced parentheses in Newick string.')
+
+        return cls(parent, edge_lengths, labels)
+
+    @classmethod
+    def read(cls, tree_file):
+        """Read first tree in a Newick file.
+
+        Underscores in labels are always preserved.
+
+        Parameters
+        ----------
+        tree_file : str
+            File containing tree in Newick format.
+
+        Returns
+        -------
+        ArrayTree
+            Parsed tree.
+        """
+
+        with open(tree_file) as f:
+            return cls.parse(f)
+
+    @classmethod
+    def from_string(cls, newick_str):
+        """Parse first tree in a Newick string."""
+
+        return cls.parse(io.StringIO(newick_str))
+
+    def _format_node(self, node):
+        """Format label and edge length of node."""
+
+        label = self.labels[node]
+        if label is None:
+            label = ''
+        elif self.quote_re.search(label):
+            label = "'%s'" % label.replace("'", "''")
+
+        edge_length = self.edge_lengths[node]
+        if not np.isnan(edge_length):
+            label += ':%s' % repr(float(edge_length))
+
+        return label
+
+    def newick_tokens(self):
+        """Generate tree in Newick format as a sequence of strings."""
+
+        open_nodes = []
+        first_child = True
+        for node in range(len(self.parent)):
+            while open_nodes and self.subtree_end[open_nodes[-1]] <= node:
+                yield ')' + self._format_node(open_nodes.pop())
+
+            if not first_child:
+                yield ','
+
+            if self.is_leaf[node]:
+                yield self._format_node(node)
+                first_child = False
+            else:
+                yield '('
+                open_nodes.append(node)
+                first_child = True
+
+        while open_nodes:
+            yield ')' + self._format_node(open_nodes.pop())
+
+        yield ';'
+
+    def as_string(self):
+        """Get tree in Newick format."""
+
+        return ''.join(self.newick_tokens())
+
+    def write(self, output_file):
+        """Write tree in Newick format.
+
+        Output matches trees written by dendropy with
+        suppress_rooting=True and unquoted_underscores=True.
+        """
+
+        fout = open(output_file, 'w')
+        buf = []
+        for token in self.newick_tokens():
+            buf.append(token)
+            if len(buf) >= 10000:
+                fout.write(''.join(buf))
+                buf = []
+        buf.append('\n')
+        fout.write(''.join(buf))
+        fout.close()
+
+    @classmethod
+    def relabel_leaves(cls, tree_file, output_file, relabel):
+        """Rewrite leaf labels of a Newick file without building a tree.
+
+        Tokens are streamed from the input file and written
+        directly to the output file, so edge lengths and internal
+        labels are retained exactly as written. Comments are removed.
+
+        Parameters
+        ----------
+        tree_file : str
+            File containing trees in Newick format.
+        output_file : str
+            Output file for relabelled trees.
+        relabel : function
+            Function returning the new label for a leaf label.
+        """
+
+        fout = open(output_file, 'w')
+        buf = []
+        prev_token = None
+        with open(tree_file) as f:
+            for token, label in cls._tokens(f):
+                if token == 'label':
+                    if prev_token in (None, '(', ',', ';'):
+                        label = relabel(label)
+
+                    if prev_token != ':' and cls.quote_re.search(label):
+                        label = "'%s'" % label.replace("'", "''")
+                    buf.append(label)
+                else:
+                    buf.append(token)
+                    if token == ';':
+                        buf.append('\n')
+
+                prev_token = token
+
+                if len(buf) >= 10000:
+                    fout.write(''.join(buf))
+                    buf = []
+
+        fout.write(''.join(buf))
+        fout.close()
+
+    def leaves(self):
+        """Get index of leaf nodes in preorder."""
+
+        return np.nonzero(self.is_leaf)[0]
+
+    def internal_nodes(self):
+        """Get index of internal nodes in preorder."""
+
+        return np.nonzero(~self.is_leaf)[0]
+
+    def leaf_index(self):
+        """Get index of each leaf node keyed by label."""
+
+        return dict((self.labels[leaf], leaf) for leaf in self.leaves().tolist())
+
+    def child_nodes(self, node):
+        """Get children of a node."""
+
+        return self.children[self.child_offsets[node]:self.child_offsets[node + 1]]
+
+    def leaves_below(self, node):
+        """Get leaf nodes in subtree of a node."""
+
+        subtree_nodes = np.arange(node, self.subtree_end[node])
+        return subtree_nodes[self.is_leaf[node:self.subtree_end[node]]]
+
+    def leaf_counts(self, leaf_values=None):
+        """Sum values assigned to nodes over the subtree of each node.
+
+        Parameters
+        ----------
+        leaf_values : np.array
+            Value of each node, or None to count leaves.
+
+        Returns
+        -------
+        np.array
+            Sum of values in subtree of each node.
+        """
+
+        if leaf_values is None:
+            leaf_values = self.is_leaf.astype(np.int64)
+
+        cumulative = np.concatenate(([0], np.cumsum(leaf_values)))
+        return cumulative[self.subtree_end] - cumulative[:-1]
+
+    def mrca(self, nodes):
+        """Get most recent common ancestor of a set of nodes.
+
+        Parameters
+        ----------
+        nodes : iterable
+            Index of nodes.
+
+        Returns
+        -------
+        int
+            Index of most recent common ancestor.
+        """
+
+        nodes = np.fromiter(nodes, dtype=np.int64)
+        first_node = nodes.min()
+        last_node = nodes.max()
+        if first_node == last_node:
+            return int(first_node)
+
+        # the MRCA is the deepest node whose subtree range spans all nodes
+        ancestors = np.nonzero(self.subtree_end[0:first_node + 1] > last_node)[0]
+        return int(ancestors.max())
+
+    def ancestors(self, node):
+        """Get ancestors of node ordered from parent to root."""
+
+        ancestors = []
+        node = self.parent[node]
+        while node != -1:
+            ancestors.append(int(node))
+            node = self.parent[node]
+
+        return ancestors
+
+    def retain_leaves(self, leaves):
+        """Create tree spanning a subset of leaves.
+
+        Unifurcations are suppressed by merging edges so
+        the edge lengths between retained nodes are preserved,
+        as done by dendropy when pruning taxa.
+
+        Parameters
+        ----------
+        leaves : iterable
+            Index of leaf nodes to retain.
+
+        Returns
+        -------
+        ArrayTree
+            Pruned tree.
+        """
+
+        leaf_mask = np.zeros(len(self.parent), dtype=np.int64)
+        leaf_mask[np.asarray(list(leaves), dtype=np.int64)] = 1
+        leaf_mask &= self.is_leaf
+
+        # retain leaves and internal nodes with 2 or more retained children
+        retained = self.leaf_counts(leaf_mask) > 0
+        retained_children = np.bincount(self.parent[1:][retained[1:]], minlength=len(self.parent))
+        keep = retained & ((leaf_mask == 1) | (retained_children >= 2))
+
+        # reassign nodes to nearest retained ancestor and merge edge lengths
+        keep_list = keep.tolist()
+        parent_list = self.parent.tolist()
+        length_list = self.edge_lengths.tolist()
+        anchor = [-1] * len(parent_list)
+        merged_length = list(length_list)
+        for node in range(1, len(parent_list)):
+            p = parent_list[node]
+            if keep_list[p]:
+                anchor[node] = p
+            else:
+                anchor[node] = anchor[p]
+                merged_length[node] = np.nansum([length_list[node], merged_length[p]])
+
+        kept_nodes = np.nonzero(keep)[0]
+        new_index = np.cumsum(keep) - 1
+
+        new_parent = []
+        new_lengths = []
+        new_labels = []
+        for node in kept_nodes.tolist():
+            if anchor[node] == -1:
+                new_parent.append(-1)
+            else:
+                new_parent.append(int(new_index[anchor[node]]))
+            new_lengths.append(merged_length[node])
+            new_labels.append(self.labels[node])
+
+        return ArrayTree(new_parent, new_lengths, new_labels)
+
+    def to_dendropy(self, rooting='force-rooted'):
+        """Convert to a dendropy tree.
+
+        This should only be used where dendropy features are required.
+        """
+
+        import dendropy
+
+        return dendropy.Tree.get_from_string(self.as_string(),
+                                                schema='newick',
+                                                rooting=rooting,
+                                                preserve_underscores=True)
+
+
+class LCAIndex(object):
+    """Lowest common ancestor queries over an ArrayTree.
+
+    The index is an Euler tour of the tree with a sparse table
+    over node depths, so the LCA of any two nodes is a range
+    minimum query requiring two array lookups. Since nodes are
+    numbered in preorder, the LCA of a set of nodes is the LCA
+    of the nodes with the smallest and largest index.
+    """
+
+    def __init__(self, tree):
+        """Initialize.
+
+        Parameters
+        ----------
+        tree : ArrayTree
+            Tree to index.
+        """
+
+        self.tree = tree
+
+        num_nodes = len(tree)
+
+        # depth of each node, which is set in preorder
+        parent = tree.parent.tolist()
+        depth = [0] * num_nodes
+        for node in range(1, num_nodes):
+            depth[node] = depth[parent[node]] + 1
+        self.depth = np.array(depth, dtype=np.int64)
+
+        # Euler tour recording a node when it is entered and
+        # again after returning from each of its children
+        child_offsets = tree.child_offsets.tolist()
+        children = tree.children.tolist()
+        euler = []
+        first_visit = [0] * num_nodes
+        stack = [(0, child_offsets[0])]
+        while stack:
+            node, next_child = stack.pop()
+            if next_child == child_offsets[node]:
+                first_visit[node] = len(euler)
+            euler.append(node)
+
+            if next_child < child_offsets[node + 1]:
+                stack.append((node, next_child + 1))
+                stack.append((children[next_child], child_offsets[children[next_child]]))
+
+        self.euler = np.array(euler, dtype=np.int64)
+        self.first_visit = np.array(first_visit, dtype=np.int64)
+
+        # sparse table with position of minimum depth node over
+        # each range of the Euler tour with a length of 2^k
+        euler_depth = self.depth[self.euler]
+        self.sparse_table = [np.arange(len(self.euler), dtype=np.int64)]
+        span = 1
+        while 2 * span <= len(self.euler):
+            prev = self.sparse_table[-1]
+            left = prev[0:len(prev) - span]
+            right = prev[span:]
+            self.sparse_table.append(np.where(euler_depth[left] <= euler_depth[right], left, right))
+            span *= 2
+
+        self.euler_depth = euler_depth
+
+        self.leaf_counts = tree.leaf_counts()
+        self.leaf_nodes = tree.leaves()
+
+    def lca(self, node1, node2):
+        """Get lowest common ancestor of two nodes."""
+
+        start = self.first_visit[node1]
+        end = self.first_visit[node2]
+        if start > end:
+            start, end = end, start
+
+        level = int(end - start + 1).bit_length() - 1
+        table = self.sparse_table[level]
+        left = table[start]
+        right = table[end - (1 << level) + 1]
+        if self.euler_depth[left] <= self.euler_depth[right]:
+            return int(self.euler[left])
+
+        return int(self.euler[right])
+
+    def mrca(self, nodes):
+        """Get most recent common ancestor of a set of nodes."""
+
+        nodes = np.fromiter(nodes, dtype=np.int64)
+
+        return self.lca(nodes.min(), nodes.max())
+
+    def leaves_below(self, node):
+        """Get leaf nodes in subtree of a node."""
+
+        start = np.searchsorted(self.leaf_nodes, node)
+        end = np.searchsorted(self.leaf_nodes, self.tree.subtree_end[node])
+
+        return self.leaf_nodes[start:end]
+
+    def is_monophyletic(self, leaves):
+        """Check if a set of leaves forms a clade."""
+
+        leaves = set(leaves)
+
+        return self.leaf_counts[self.mrca(leaves)] == len(leaves)
+
+    def intruders(self, member_nodes):
+        """Get leaves below the MRCA of a group that are not members of the group.
+
+        Parameters
+        ----------
+        member_nodes : iterable
+            Leaf or internal nodes whose descendants are all members of the group.
+
+        Returns
+        -------
+        np.array
+            Leaf nodes intruding into the group.
+        """
+
+        member_nodes = list(member_nodes)
+        mrca = self.mrca(member_nodes)
+        below_mrca = self.leaves_below(mrca)
+
+        members = np.zeros(len(self.tree) + 1, dtype=np.int64)
+        for node in member_nodes:
+            members[node] += 1
+            members[self.tree.subtree_end[node]] -= 1
+        in_member_subtree = np.cumsum(members)[below_mrca] > 0
+
+        return below_mrca[~in_member_subtree]
@@ -0,0 +1,422 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+
+def taxa_bitmask(namespace, labels):
+    """Create packed bit array indicating a set of taxa.
+
+    Parameters
+    ----------
+    namespace : d[label] -> bit index
+        Bit assigned to each taxon.
+    labels : iterable
+        Labels of taxa to set.
+
+    Returns
+    -------
+    np.array
+        Bit array with one uint64 word for every 64 taxa.
+    """
+
+    num_words = (len(namespace) + 63) // 64
+    bits = np.array([namespace[label] for label in labels if label in namespace], dtype=np.int64)
+
+    mask = np.zeros(num_words, dtype=np.uint64)
+    np.bitwise_or.at(mask, bits >> 6, np.left_shift(np.uint64(1), (bits & 63).astype(np.uint64)))
+
+    return mask
+
+
+class SplitTable(object):
+    """Bipartitions of a tree stored as packed bit arrays.
+
+    Each row is the set of taxa below an edge of the tree, with
+    taxa assigned to bits by a namespace shared between trees.
+    Tables can be projected onto a subset of taxa by masking,
+    which gives the bipartitions of the tree pruned to those
+    taxa without modifying or copying the tree.
+    """
+
+    def __init__(self, bitsets, edge_lengths, num_taxa):
+        """Initialize.
+
+        Parameters
+        ----------
+        bitsets : np.array
+            Taxa on one side of each bipartition, one row per bipartition.
+        edge_lengths : np.array
+            Length of edge defining each bipartition.
+        num_taxa : int
+            Number of taxa in namespace.
+        """
+
+        self.bitsets = bitsets
+        self.edge_lengths = edge_lengths
+        self.num_taxa = num_taxa
+
+    def __len__(self):
+        """Number of bipartitions in table."""
+
+        return len(self.bitsets)
+
+    @classmethod
+    def from_tree(cls, tree, namespace):
+        """Create table with the bipartition of every edge in a tree.
+
+        Parameters
+        ----------
+        tree : ArrayTree
+            Tree to obtain bipartitions from.
+        namespace : d[label] -> bit index
+            Bit assigned to each taxon.
+
+        Returns
+        -------
+        SplitTable
+            Bipartition of each node in preorder.
+        """
+
+        num_words = (len(namespace) + 63) // 64
+        bitsets = np.zeros((len(tree), num_words), dtype=np.uint64)
+
+        leaves = tree.leaves()
+        leaf_bits = np.array([namespace.get(tree.labels[leaf], -1) for leaf in leaves], dtype=np.int64)
+        in_namespace = leaf_bits >= 0
+        leaves = leaves[in_namespace]
+        leaf_bits = leaf_bits[in_namespace]
+        bitsets[leaves, leaf_bits >> 6] = np.left_shift(np.uint64(1), (leaf_bits & 63).astype(np.uint64))
+
+        # propagate taxa to ancestors one depth level at a time,
+        # starting with the deepest nodes
+        depth = np.zeros(len(tree), dtype=np.int64)
+        parent = tree.parent
+        for node in range(1, len(tree)):
+            depth[node] = depth[parent[node]] + 1
+
+        order = np.argsort(-depth, kind='stable')
+        level_starts = np.flatnonzero(np.diff(depth[order])) + 1
+        for level_nodes in np.split(order, level_starts):
+            level_nodes = level_nodes[level_nodes != 0]
+            if len(level_nodes):
+                np.bitwise_or.at(bitsets, parent[level_nodes], bitsets[level_nodes])
+
+        return cls(bitsets, np.nan_to_num(tree.edge_lengths), len(namespace))
+
+    def subset(self, rows):
+        """Create table containing a subset of bipartitions."""
+
+        return SplitTable(self.bitsets[rows], self.edge_lengths[rows], self.num_taxa)
+
+    def project(self, taxa_mask, merge=True):
+        """Project bipartitions onto a subset of taxa.
+
+        Bipartitions are normalized so the lowest bit in the
+        mask is always on the second side of the bipartition,
+        making identical bipartitions have identical rows. Edges
+        above all retained taxa become the empty bipartition, which
+        corresponds to the root edge of a pruned tree.
+
+        Parameters
+        ----------
+        taxa_mask : np.array
+            Bit array indicating taxa to retain.
+        merge : bool
+            Remove edges without any retained taxa and merge edges
+            defining the same bipartition, summing their lengths,
+            as happens when pruning a tree to the taxa.
+
+        Returns
+        -------
+        SplitTable
+            Projected bipartitions.
+        """
+
+        bitsets = self.bitsets & taxa_mask
+        has_taxa = bitsets.any(axis=1)
+
+        # normalize bipartitions relative to lowest retained taxon
+        lowest_word = np.flatnonzero(taxa_mask)[0]
+        lowest_bit = taxa_mask[lowest_word] & (~taxa_mask[lowest_word] + np.uint64(1))
+        has_lowest = (bitsets[:, lowest_word] & lowest_bit) != 0
+        bitsets[has_lowest] = ~bitsets[has_lowest] & taxa_mask
+
+        if not merge:
+            return SplitTable(bitsets, self.edge_lengths, self.num_taxa)
+
+        bitsets = bitsets[has_taxa]
+        edge_lengths = self.edge_lengths[has_taxa]
+
+        keys = self._row_keys(bitsets)
+        unique_keys, first_row, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        merged_lengths = np.bincount(inverse.ravel(), weights=edge_lengths, minlength=len(unique_keys))
+
+        return SplitTable(bitsets[first_row], merged_lengths, self.num_taxa)
+
+    def _row_keys(self, bitsets):
+        """Represent each row as a single hashable value."""
+
+        bitsets = np.ascontiguousarray(bitsets)
+        return bitsets.view(np.dtype((np.void, bitsets.dtype.itemsize * bitsets.shape[1]))).ravel()
+
+    def total_length(self):
+        """Total length of edges defining bipartitions."""
+
+        return self.edge_lengths.sum()
+
+    def recovered(self, other):
+        """Determine which bipartitions are present in another table.
+
+        Both tables must be projected onto the same taxa.
+
+        Parameters
+        ----------
+        other : SplitTable
+            Table to search for bipartitions.
+
+        Returns
+        -------
+        np.array
+            Boolean array indicating if each bipartition was recovered.
+        """
+
+        return np.isin(self._row_keys(self.bitsets), self._row_keys(other.bitsets))
+
+    def compatible(self, other, taxa_mask, max_cells=2**22):
+        """Determine which bipartitions are compatible with all bipartitions in another table.
+
+        Two bipartitions A|A' and B|B' are compatible unless all of
+        the intersections AB, AB', A'B and A'B' are non-empty. Both
+        tables must be projected onto the same taxa.
+
+        Parameters
+        ----------
+        other : SplitTable
+            Table of bipartitions to test against.
+        taxa_mask : np.array
+            Bit array indicating taxa tables were projected onto.
+        max_cells : int
+            Maximum number of words compared at once.
+
+        Returns
+        -------
+        np.array
+            Boolean array indicating if each bipartition is compatible.
+        """
+
+        other_bitsets = other.bitsets[np.newaxis, :, :]
+        other_complement = ~other_bitsets & taxa_mask
+
+        compatible = np.ones(len(self.bitsets), dtype=bool)
+        chunk_size = max(1, max_cells // max(1, other.bitsets.size))
+        for start in range(0, len(self.bitsets), chunk_size):
+            bitsets = self.bitsets[start:start + chunk_size, np.newaxis, :]
+            complement = ~bitsets & taxa_mask
+
+            conflict = ((bitsets & other_bitsets).any(axis=2)
+                        & (bitsets & other_complement).any(axis=2)
+                        & (complement & other_bitsets).any(axis=2)
+                        & (complement & other_complement).any(axis=2))
+
+            compatible[start:start + chunk_size] = ~conflict.any(axis=1)
+
+        return compatible
+
+    def edge_length_distances(self, other):
+        """Calculate weighted Robinson-Foulds and Euclidean distances between tables.
+
+        Both tables must be projected and merged onto the same taxa.
+        Bipartitions absent from a table are given an edge length of zero.
+
+        Parameters
+        ----------
+        other : SplitTable
+            Table to compare against.
+
+        Returns
+        -------
+        float
+            Weighted Robinson-Foulds (Manhattan) distance.
+        float
+            Felsenstein's Euclidean distance.
+        """
+
+        keys = np.concatenate((self._row_keys(self.bitsets), self._row_keys(other.bitsets)))
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+
+        lengths1 = np.bincount(inverse[0:len(self)], weights=self.edge_lengths, minlength=len(unique_keys))
+        lengths2 = np.bincount(inverse[len(self):], weights=other.edge_lengths, minlength=len(unique_keys))
+
+        diff = lengths1 - lengths2
+        return np.abs(diff).sum(), np.sqrt((diff * diff).sum())
+
+    def scale(self, factor):
+        """Create table with edge lengths multiplied by a factor."""
+
+        return SplitTable(self.bitsets, self.edge_lengths * factor, self.num_taxa)
+
+
+class HashedSplits(object):
+    """Bipartitions of a tree represented by 64-bit hashes.
+
+    Each taxon is assigned a random 64-bit key and a bipartition
+    is hashed as the XOR of the keys of taxa on one side. Since
+    nodes are in preorder, the taxa below a node are a contiguous
+    range of leaves, so the hash of every bipartition for any
+    subset of taxa is obtained from a prefix XOR over the leaves
+    in linear time. This requires far less memory than bit arrays
+    when comparing many large trees.
+    """
+
+    def __init__(self, tree, namespace):
+        """Initialize.
+
+        Parameters
+        ----------
+        tree : ArrayTree
+            Tree to obtain bipartitions from.
+        namespace : d[label] -> taxon index
+            Index assigned to each taxon.
+        """
+
+        leaves = tree.leaves()
+        self.leaf_taxa = np.array([namespace[tree.labels[leaf]] for leaf in leaves], dtype=np.int64)
+        self.taxa = np.sort(self.leaf_taxa)
+
+        # range of leaves below each node
+        leaves_before = np.concatenate(([0], np.cumsum(tree.is_leaf)))
+        self.leaf_start = leaves_before[0:len(tree)].astype(np.int32)
+        self.leaf_end = leaves_before[tree.subtree_end].astype(np.int32)
+
+        self.edge_lengths = np.nan_to_num(tree.edge_lengths)
+
+        self.full_projection = None
+
+    def project(self, taxon_keys, shared_taxa=None):
+        """Get hash and length of bipartitions over a subset of taxa.
+
+        Bipartitions are normalized to the side without the lowest
+        indexed retained taxon. Edges with all or none of the retained
+        taxa below them are removed and edges defining the same
+        bipartition are merged, as happens when pruning the tree to
+        the retained taxa.
+
+        Parameters
+        ----------
+        taxon_keys : np.array
+            Random 64-bit key of each taxon in namespace.
+        shared_taxa : np.array
+            Sorted indices of taxa to retain, or None to retain all taxa.
+
+        Returns
+        -------
+        np.array
+            Sorted hash of each bipartition.
+        np.array
+            Total edge length of each bipartition.
+        np.array
+            Number of retained taxa on the smaller side of each bipartition.
+        """
+
+        if shared_taxa is None or len(shared_taxa) == len(self.taxa):
+            if self.full_projection is None:
+                self.full_projection = self._project(taxon_keys, self.taxa)
+            return self.full_projection
+
+        return self._project(taxon_keys, shared_taxa)
+
+    def _project(self, taxon_keys, shared_taxa):
+        """Get hash and length of bipartitions over a subset of taxa."""
+
+        is_shared = np.isin(self.leaf_taxa, shared_taxa)
+        leaf_keys = np.where(is_shared, taxon_keys[self.leaf_taxa], np.uint64(0))
+        prefix_xor = np.concatenate(([np.uint64(0)], np.bitwise_xor.accumulate(leaf_keys)))
+        prefix_count = np.concatenate(([0], np.cumsum(is_shared)))
+
+        is_lowest = self.leaf_taxa == shared_taxa[0]
+        prefix_lowest = np.concatenate(([0], np.cumsum(is_lowest)))
+
+        hashes = prefix_xor[self.leaf_end] ^ prefix_xor[self.leaf_start]
+        counts = prefix_count[self.leaf_end] - prefix_count[self.leaf_start]
+        has_lowest = (prefix_lowest[self.leaf_end] - prefix_lowest[self.leaf_start]) > 0
+
+        total_hash = prefix_xor[-1]
+        num_taxa = prefix_count[-1]
+        hashes = np.where(has_lowest, hashes ^ total_hash, hashes)
+        counts = np.minimum(counts, num_taxa - counts)
+
+        # edges with no retained taxa on one side, either because
+        # none are below the edge or all are, do not define a
+        # bipartition once the tree is pruned
+        is_split = counts > 0
+        hashes = hashes[is_split]
+        counts = counts[is_split]
+        edge_lengths = self.edge_lengths[is_split]
+
+        unique_hashes, first_index, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        merged_lengths = np.bincount(inverse.ravel(), weights=edge_lengths, minlength=len(unique_hashes))
+
+        return unique_hashes, merged_lengths, counts[first_index]
+
+
+def split_distances(splits1, splits2, scale=True):
+    """Calculate distances between two trees from their projected bipartitions.
+
+    Parameters
+    ----------
+    splits1 : (np.array, np.array, np.array)
+        Hash, edge length and size of bipartitions in first tree.
+    splits2 : (np.array, np.array, np.array)
+        Hash, edge length and size of bipartitions in second tree.
+    scale : bool
+        Scale edge lengths of each tree to sum to 1.
+
+    Returns
+    -------
+    int
+        Robinson-Foulds distance over non-trivial bipartitions.
+    float
+        Weighted Robinson-Foulds (Manhattan) distance.
+    float
+        Felsenstein's Euclidean distance.
+    """
+
+    hashes1, lengths1, sizes1 = splits1
+    hashes2, lengths2, sizes2 = splits2
+
+    if scale:
+        lengths1 = lengths1 / max(lengths1.sum(), 1e-12)
+        lengths2 = lengths2 / max(lengths2.sum(), 1e-12)
+
+    # Robinson-Foulds distance ignores trivial bipartitions
+    nontrivial1 = hashes1[sizes1 >= 2]
+    nontrivial2 = hashes2[sizes2 >= 2]
+    common = np.intersect1d(nontrivial1, nontrivial2, assume_unique=True)
+    rf = len(nontrivial1) + len(nontrivial2) - 2 * len(common)
+
+    # edge length distances over all bipartitions
+    all_hashes = np.union1d(hashes1, hashes2)
+    all_lengths1 = np.zeros(len(all_hashes))
+    all_lengths1[np.searchsorted(all_hashes, hashes1)] = lengths1
+    all_lengths2 = np.zeros(len(all_hashes))
+    all_lengths2[np.searchsorted(all_hashes, hashes2)] = lengths2
+
+    diff = all_lengths1 - all_lengths2
+
+    return rf, np.abs(diff).sum(), np.sqrt((diff * diff).sum())
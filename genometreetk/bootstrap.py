@@ -20,10 +20,12 @@ import logging
 
 import biolib.seq_io as seq_io
 from biolib.external.fasttree import FastTree
-from biolib.parallel import Parallel
 from biolib.bootstrap import bootstrap_alignment, bootstrap_support
 from biolib.common import remove_extension, make_sure_path_exists
 
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler
+
 
 class Bootstrap(object):
     """Assess robustness of genome tree by bootstrapping multiple sequence alignment."""
@@ -97,12 +99,16 @@ class Bootstrap(object):
         make_sure_path_exists(self.replicate_dir)
 
         # read full multiple sequence alignment
-        self.msa = seq_io.read(msa_file)
+        with profiler.stage('read_msa'):
+            self.msa = seq_io.read(msa_file)
+            profiler.count('sequences', len(self.msa))
 
         # calculate replicates
         self.logger.info('Calculating bootstrap replicates:')
-        parallel = Parallel(self.cpus)
-        parallel.run(self._producer, None, range(num_replicates), self._progress)
+        with profiler.stage('replicates'):
+            parallel = Parallel(self.cpus)
+            parallel.run(self._producer, None, range(num_replicates), self._progress)
+            profiler.count('replicates', num_replicates)
 
         # calculate support values
         rep_tree_files = []
@@ -110,6 +116,7 @@ class Bootstrap(object):
             rep_tree_files.append(os.path.join(self.replicate_dir, 'bootstrap_tree.r_' + str(rep_index) + '.tree'))
 
         output_tree = os.path.join(output_dir, remove_extension(input_tree) + '.bootstrap.tree')
-        bootstrap_support(input_tree, rep_tree_files, output_tree)
+        with profiler.stage('support'):
+            bootstrap_support(input_tree, rep_tree_files, output_tree)
 
         return output_tree
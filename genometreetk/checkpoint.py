@@ -0,0 +1,200 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import time
+import json
+import pickle
+import hashlib
+import logging
+
+from biolib.common import make_sure_path_exists
+
+from genometreetk.profiler import profiler
+
+
+class Checkpoint(object):
+    """Skip workflow stages whose inputs, parameters and outputs are unchanged.
+
+    After a stage completes, a manifest is written containing the
+    hash of each input and output file (or of all files within a
+    directory) along with the stage parameters, and the value
+    returned by the stage is saved. On rerun, a stage is skipped
+    and its saved value returned if its manifest still matches.
+    Since inputs are compared by content, stages downstream of a
+    recomputed stage are only recomputed if its outputs changed.
+    """
+
+    def __init__(self, checkpoint_dir):
+        """Initialization.
+
+        Parameters
+        ----------
+        checkpoint_dir : str
+            Directory to store stage manifests.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.checkpoint_dir = checkpoint_dir
+        make_sure_path_exists(self.checkpoint_dir)
+
+        # name, status, and time of each stage in the order processed
+        self.stages = []
+
+    def _hash_path(self, path):
+        """Calculate hash of a file, or of all files within a directory."""
+
+        if not os.path.exists(path):
+            return None
+
+        sha1 = hashlib.sha1()
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    file_path = os.path.join(root, f)
+                    sha1.update(os.path.relpath(file_path, path).encode('utf-8'))
+                    sha1.update(self._hash_path(file_path).encode('utf-8'))
+        else:
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    sha1.update(block)
+
+        return sha1.hexdigest()
+
+    def _normalize(self, value):
+        """Convert parameter to a JSON value with a deterministic order."""
+
+        if isinstance(value, (set, frozenset)):
+            return sorted(self._normalize(v) for v in value)
+        elif isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        elif isinstance(value, dict):
+            return dict((str(k), self._normalize(v)) for k, v in value.items())
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            return value
+
+        return repr(value)
+
+    def _manifest_file(self, stage):
+        """Get file containing manifest of stage."""
+
+        return os.path.join(self.checkpoint_dir, stage + '.manifest.json')
+
+    def _result_file(self, stage):
+        """Get file containing value returned by stage."""
+
+        return os.path.join(self.checkpoint_dir, stage + '.result.pkl')
+
+    def _is_current(self, stage, inputs, params):
+        """Check if manifest of stage matches its current inputs, parameters, and outputs."""
+
+        manifest_file = self._manifest_file(stage)
+        if not os.path.exists(manifest_file) or not os.path.exists(self._result_file(stage)):
+            return False
+
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+        if manifest['params'] != params:
+            return False
+
+        if sorted(manifest['inputs']) != sorted(inputs):
+            return False
+
+        for path, h in list(manifest['inputs'].items()) + list(manifest['outputs'].items()):
+            if self._hash_path(path) != h:
+                return False
+
+        return True
+
+    def run(self, stage, func, args=(), inputs=(), params=None, outputs=()):
+        """Run stage unless its manifest indicates it is up to date.
+
+        Parameters
+        ----------
+        stage : str
+            Unique name of stage.
+        func : function
+            Function performing stage.
+        args : iterable
+            Arguments passed to function.
+        inputs : iterable
+            Files or directories read by stage.
+        params : dict
+            Parameters which influence the outputs of the stage.
+        outputs : iterable
+            Files or directories written by stage.
+
+        Returns
+        -------
+        object
+            Value returned by function.
+        """
+
+        params = self._normalize(params or {})
+
+        if self._is_current(stage, inputs, params):
+            self.logger.info('Stage %s is up to date, using previous results.' % stage)
+            with open(self._result_file(stage), 'rb') as f:
+                result = pickle.load(f)
+            self.stages.append((stage, 'cached', 0.0))
+            profiler.event('cached_stage', name=stage)
+            return result
+
+        # remove manifest so an interrupted stage is never considered complete
+        manifest_file = self._manifest_file(stage)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+
+        start = time.time()
+        with profiler.stage(stage):
+            result = func(*args)
+        elapsed = time.time() - start
+
+        manifest = {'stage': stage,
+                    'params': params,
+                    'inputs': dict((path, self._hash_path(path)) for path in inputs),
+                    'outputs': dict((path, self._hash_path(path)) for path in outputs),
+                    'elapsed': elapsed}
+
+        with open(self._result_file(stage), 'wb') as f:
+            pickle.dump(result, f)
+
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        self.stages.append((stage, 'computed', elapsed))
+
+        return result
+
+    def write_summary(self, fout):
+        """Write time taken by each stage and whether previous results were used.
+
+        Parameters
+        ----------
+        fout : file
+            Open file to write summary to.
+        """
+
+        fout.write('Stages:\n')
+        for stage, status, elapsed in self.stages:
+            fout.write('  %s: %s (%.1f s)\n' % (stage, status, elapsed))
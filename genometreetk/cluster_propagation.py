@@ -0,0 +1,289 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import csv
+import logging
+from array import array
+
+from biolib.taxonomy import Taxonomy
+
+from genometreetk.exceptions import GenomeTreeTkError
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler
+
+
+class ClusterPropagation(object):
+    """Propagate taxonomy of representatives to all genomes in their cluster.
+
+    Clusters are read from the GTDB metadata into a compact index,
+    with each genome ID assigned an integer and the members of all
+    clusters stored in a single array. Congruence between the
+    taxonomy of a representative and the genomes in its cluster is
+    determined for chunks of clusters in parallel, and the expanded
+    taxonomy is then written one genome at a time.
+
+    A genome in several clusters is assigned the taxonomy of the
+    last representative in the input taxonomy file whose cluster
+    contains it. Genomes not in any cluster retain their taxonomy.
+    """
+
+    def __init__(self, cpus=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
+
+        # number of clusters checked by a worker at a time
+        self.clusters_per_job = 500
+
+    def _index_id(self, genome_id):
+        """Get integer index of genome ID, adding it to the index if necessary."""
+
+        idx = self.genome_index.get(genome_id)
+        if idx is None:
+            idx = len(self.genome_ids)
+            self.genome_index[genome_id] = idx
+            self.genome_ids.append(genome_id)
+            self.in_metadata.append(0)
+
+        return idx
+
+    def _read_clusters(self, metadata_file):
+        """Build index of genomes and clusters from GTDB metadata."""
+
+        self.genome_index = {}
+        self.genome_ids = []
+        self.in_metadata = bytearray()
+        self.members = array('l')
+        self.cluster_span = {}
+
+        with open(metadata_file, 'rt') as f:
+            csv_reader = csv.reader(f)
+            headers = next(csv_reader)
+            try:
+                genome_col = headers.index('genome')
+                cluster_col = headers.index('gtdb_clustered_genomes')
+            except ValueError:
+                raise GenomeTreeTkError('Metadata file must contain genome and gtdb_clustered_genomes columns.')
+
+            for row in csv_reader:
+                idx = self._index_id(row[genome_col])
+                self.in_metadata[idx] = 1
+
+                clustered_genomes = row[cluster_col]
+                if not clustered_genomes:
+                    continue
+
+                start = len(self.members)
+                for cluster_genome_id in clustered_genomes.split(';'):
+                    self.members.append(self._index_id(cluster_genome_id))
+                self.cluster_span[idx] = (start, len(self.members))
+
+        self.logger.info('Indexed %d clusters spanning %d genomes.' % (len(self.cluster_span),
+                                                                        len(self.members)))
+
+    def _cluster_members(self, rep_idx):
+        """Get indices of genomes in cluster."""
+
+        start, end = self.cluster_span[rep_idx]
+        return self.members[start:end]
+
+    def _cluster_taxonomy(self, rep_taxa, clustered_taxa):
+        """Determine taxonomy of cluster from taxonomy of representative and clustered genomes.
+
+        Parameters
+        ----------
+        rep_taxa : list
+            Taxonomy of representative.
+        clustered_taxa : list
+            Genome ID and taxonomy of clustered genomes with a specified taxonomy.
+
+        Returns
+        -------
+        list
+            Taxonomy of cluster.
+        tuple
+            Clustered genome ID, its taxonomy, and rank at which it is
+            incongruent with the representative, or None if congruent.
+        """
+
+        working_cluster_taxonomy = list(rep_taxa)
+        for cluster_genome_id, cluster_tax in clustered_taxa:
+            for r in range(0, len(Taxonomy.rank_prefixes)):
+                if cluster_tax[r] == Taxonomy.rank_prefixes[r]:
+                    break  # no more taxonomy information to consider
+
+                if cluster_tax[r] != rep_taxa[r]:
+                    if rep_taxa[r] == Taxonomy.rank_prefixes[r]:
+                        # clustered genome has a more specific taxonomy string which
+                        # should be propagate to the representative if all clustered
+                        # genomes are in agreement
+                        if working_cluster_taxonomy[r] == Taxonomy.rank_prefixes[r]:
+                            # make taxonomy more specific based on genomes in cluster
+                            working_cluster_taxonomy[r] = cluster_tax[r]
+                        elif working_cluster_taxonomy[r] != cluster_tax[r]:
+                            # not all genomes agree on the assignment of this rank so leave it unspecified
+                            working_cluster_taxonomy[r] = Taxonomy.rank_prefixes[r]
+                            break
+                    else:
+                        # genomes in cluster have incongruent taxonomies so defer to representative
+                        return list(rep_taxa), (cluster_genome_id, cluster_tax, r)
+
+        return working_cluster_taxonomy, None
+
+    def _congruence_producer(self, rep_ids):
+        """Determine taxonomy of a chunk of clusters."""
+
+        results = []
+        for rep_id in rep_ids:
+            rep_idx = self.genome_index[rep_id]
+
+            # get taxonomy of all genomes in cluster with a specified taxonomy, ignoring
+            # genomes which are no longer in the GTDB
+            clustered_taxa = []
+            processed = set([rep_idx])
+            for cluster_idx in self._cluster_members(rep_idx):
+                if cluster_idx in processed or not self.in_metadata[cluster_idx]:
+                    continue
+                processed.add(cluster_idx)
+
+                cluster_genome_id = self.genome_ids[cluster_idx]
+                cluster_tax = self.explicit_tax.get(cluster_genome_id)
+                if cluster_tax:
+                    clustered_taxa.append((cluster_genome_id, cluster_tax))
+
+            cluster_taxonomy, incongruence = self._cluster_taxonomy(self.explicit_tax[rep_id],
+                                                                    clustered_taxa)
+            results.append((rep_id, ';'.join(cluster_taxonomy), incongruence))
+
+        return results
+
+    def _congruence_consumer(self, produced_data, consumer_data):
+        """Record taxonomy of clusters and report incongruent clusters."""
+
+        if consumer_data == None:
+            consumer_data = 0
+
+        for rep_id, cluster_taxonomy_str, incongruence in produced_data:
+            self.cluster_taxonomy[rep_id] = cluster_taxonomy_str
+
+            if incongruence:
+                cluster_genome_id, cluster_tax, rank_index = incongruence
+                self.fout_report.write('%s\t%s\t%s\t%s\t%s\n' % (rep_id,
+                                                                ';'.join(self.explicit_tax[rep_id]),
+                                                                cluster_genome_id,
+                                                                ';'.join(cluster_tax),
+                                                                Taxonomy.rank_labels[rank_index]))
+                consumer_data += 1
+
+        return consumer_data
+
+    def _congruence_progress(self, processed_items, total_items):
+        """Report progress of congruence tests."""
+
+        return '==> Processed %d of %d (%.2f%%) chunks of clusters.' % (processed_items,
+                                                                        total_items,
+                                                                        float(processed_items) * 100 / total_items)
+
+    def _write_taxonomy(self, output_taxonomy):
+        """Write expanded taxonomy of all genomes."""
+
+        # position in input taxonomy of representative assigning
+        # taxonomy to each genome, with -1 indicating no such
+        # representative and -2 that the genome has been written
+        owner = array('l', [-1]) * len(self.genome_ids)
+        for pos, genome_id in enumerate(self.explicit_tax):
+            if genome_id in self.cluster_taxonomy:
+                rep_idx = self.genome_index[genome_id]
+                owner[rep_idx] = pos
+                for cluster_idx in self._cluster_members(rep_idx):
+                    owner[cluster_idx] = pos
+
+        num_genomes = 0
+        with open(output_taxonomy, 'w') as fout:
+            for pos, (genome_id, taxon_list) in enumerate(self.explicit_tax.items()):
+                idx = self.genome_index.get(genome_id)
+
+                cluster_taxonomy_str = self.cluster_taxonomy.get(genome_id)
+                if cluster_taxonomy_str:
+                    for cluster_idx in [idx] + list(self._cluster_members(idx)):
+                        if owner[cluster_idx] == pos:
+                            fout.write('%s\t%s\n' % (self.genome_ids[cluster_idx], cluster_taxonomy_str))
+                            owner[cluster_idx] = -2
+                            num_genomes += 1
+                elif idx is None or owner[idx] == -1:
+                    # genome is a singleton
+                    fout.write('%s\t%s\n' % (genome_id, ';'.join(taxon_list)))
+                    num_genomes += 1
+
+        return num_genomes
+
+    def run(self, input_taxonomy, metadata_file, output_taxonomy, incongruence_file):
+        """Propagate taxonomy of representatives to all genomes in their cluster.
+
+        Parameters
+        ----------
+        input_taxonomy : str
+            Taxonomy of representatives and any other genomes.
+        metadata_file : str
+            GTDB metadata indicating genomes clustered with each representative.
+        output_taxonomy : str
+            Output file for taxonomy of all genomes.
+        incongruence_file : str
+            Output file reporting clusters with incongruent taxonomies.
+        """
+
+        with profiler.stage('index_clusters'):
+            self._read_clusters(metadata_file)
+            self.explicit_tax = Taxonomy().read(input_taxonomy)
+
+        rep_ids = [genome_id for genome_id in self.explicit_tax
+                    if self.genome_index.get(genome_id) in self.cluster_span]
+        profiler.count('genomes', len(self.explicit_tax))
+        profiler.count('clusters', len(rep_ids))
+
+        jobs = [rep_ids[i:i + self.clusters_per_job]
+                for i in range(0, len(rep_ids), self.clusters_per_job)]
+
+        self.cluster_taxonomy = {}
+        self.fout_report = open(incongruence_file, 'w')
+        self.fout_report.write('Representative\tRepresentative taxonomy')
+        self.fout_report.write('\tClustered genome\tClustered genome taxonomy\tIncongruent rank\n')
+        try:
+            with profiler.stage('check_congruence'):
+                parallel = Parallel(self.cpus)
+                incongruent_count = parallel.run(self._congruence_producer,
+                                                    self._congruence_consumer,
+                                                    jobs,
+                                                    self._congruence_progress)
+        finally:
+            self.fout_report.close()
+
+        self.logger.info('Identified %d clusters with incongruent taxonomies; deferred to taxonomy of representative.' % (incongruent_count or 0))
+        self.logger.info('Incongruent clusters written to: %s' % incongruence_file)
+
+        with profiler.stage('write_taxonomy'):
+            num_genomes = self._write_taxonomy(output_taxonomy)
+
+        self.logger.info('Wrote taxonomy for %d genomes.' % num_genomes)
@@ -17,7 +17,7 @@
 
 import logging
 
-import dendropy
+from genometreetk.array_tree import ArrayTree
 
 
 class CombineSupport(object):
@@ -33,16 +33,11 @@ class CombineSupport(object):
 
         Parameters
         ----------
-        tree : dendropy.Tree
+        tree : ArrayTree
           Tree to obtain support values from.
         """
 
-        preorder_support = []
-        for node in tree.preorder_node_iter():
-            if node.is_internal():
-                preorder_support.append(node.label)
-
-        return preorder_support
+        return [tree.labels[node] for node in tree.internal_nodes()]
 
     def run(self, support_type, bootstrap_tree, jk_marker_tree, jk_taxa_tree, output_tree):
         """Create new tree indicating combined support values.
@@ -66,24 +61,21 @@ class CombineSupport(object):
 
         assert(support_type in ['average', 'minimum'])
 
-        tree = dendropy.Tree.get_from_path(bootstrap_tree, schema='newick', rooting='force-rooted', preserve_underscores=True)
+        tree = ArrayTree.read(bootstrap_tree)
         bootstrap_support = self._collect_support_values(tree)
 
-        tree = dendropy.Tree.get_from_path(jk_marker_tree, schema='newick', rooting='force-rooted', preserve_underscores=True)
+        tree = ArrayTree.read(jk_marker_tree)
         jk_marker_support = self._collect_support_values(tree)
 
-        tree = dendropy.Tree.get_from_path(jk_taxa_tree, schema='newick', rooting='force-rooted', preserve_underscores=True)
+        tree = ArrayTree.read(jk_taxa_tree)
         jk_taxa_support = self._collect_support_values(tree)
 
-        internalNodeNum = 0
-        for node in tree.preorder_node_iter():
-            if node.is_internal():
-                if support_type == 'average':
-                    support = (int(bootstrap_support[internalNodeNum]) + int(jk_marker_support[internalNodeNum]) + int(jk_taxa_support[internalNodeNum])) / 3.0
-                elif support_type == 'minimum':
-                    support = min(int(bootstrap_support[internalNodeNum]), int(jk_marker_support[internalNodeNum]), int(jk_taxa_support[internalNodeNum]))
+        for internalNodeNum, node in enumerate(tree.internal_nodes()):
+            if support_type == 'average':
+                support = (int(bootstrap_support[internalNodeNum]) + int(jk_marker_support[internalNodeNum]) + int(jk_taxa_support[internalNodeNum])) / 3.0
+            elif support_type == 'minimum':
+                support = min(int(bootstrap_support[internalNodeNum]), int(jk_marker_support[internalNodeNum]), int(jk_taxa_support[internalNodeNum]))
 
-                node.label = '%s' % str(int(support + 0.5))
-                internalNodeNum += 1
+            tree.labels[node] = '%s' % str(int(support + 0.5))
 
-        tree.write_to_path(output_tree, schema='newick', suppress_rooting=True, unquoted_underscores=True)
+        tree.write(output_tree)
@@ -43,7 +43,7 @@ def filter_genomes(metadata_file,
     
     genome_ids = set()
 
-    csv_reader = csv.reader(open(metadata_file, 'rb'))
+    csv_reader = csv.reader(open(metadata_file, 'rt'))
     bHeader = True
     for row in csv_reader:
         if bHeader:
@@ -324,7 +324,7 @@ def read_gtdb_metadata(metadata_file, fields):
     gtdb_metadata = namedtuple('gtdb_metadata', ' '.join(fields))
     m = {}
 
-    csv_reader = csv.reader(open(metadata_file, 'rb'))
+    csv_reader = csv.reader(open(metadata_file, 'rt'))
     bHeader = True
     for row in csv_reader:
         if bHeader:
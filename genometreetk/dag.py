@@ -0,0 +1,252 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import time
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from genometreetk.exceptions import GenomeTreeTkError
+from genometreetk.profiler import profiler
+
+
+class Step(object):
+    """A step in a workflow along with the files it reads and writes."""
+
+    def __init__(self, name, action, inputs=(), outputs=(), cpus=1, after=(), condition=None):
+        """Initialize.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of step.
+        action : str or function
+            Shell command to execute, or function to call without arguments.
+        inputs : iterable
+            Files read by step.
+        outputs : iterable
+            Files written by step.
+        cpus : int
+            Number of cpus used by step.
+        after : iterable
+            Names of steps which must complete before this step, in
+            addition to steps producing its inputs.
+        condition : function
+            Function indicating if step should be run, evaluated once
+            the steps it depends on have completed.
+        """
+
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpus = cpus
+        self.after = list(after)
+        self.condition = condition
+
+
+class StepRunner(object):
+    """Execute workflow steps concurrently in dependency order.
+
+    A step depends on any previously added step which produces one
+    of its inputs. Independent steps are run concurrently provided
+    the total number of cpus used by running steps does not exceed
+    the available cpus. A step is not rerun if all of its outputs
+    exist and are newer than its inputs. If a step fails, no further
+    steps are started and an exception is raised once running steps
+    have finished.
+    """
+
+    def __init__(self, cpus):
+        """Initialize.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus available to all running steps.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
+        self.steps = []
+
+    def add(self, name, action, inputs=(), outputs=(), cpus=1, after=(), condition=None):
+        """Add step to workflow. See Step for a description of parameters."""
+
+        step = Step(name, action, inputs, outputs, min(cpus, self.cpus), after, condition)
+        self.steps.append(step)
+
+        return step
+
+    def _dependencies(self):
+        """Determine steps each step depends on."""
+
+        producers = {}
+        step_names = set()
+        deps = {}
+        for step in self.steps:
+            if step.name in step_names:
+                raise GenomeTreeTkError('Workflow step %s is defined multiple times.' % step.name)
+            step_names.add(step.name)
+
+            deps[step.name] = set(step.after)
+            for input_file in step.inputs:
+                if input_file in producers:
+                    deps[step.name].add(producers[input_file])
+
+            for output_file in step.outputs:
+                producers[output_file] = step.name
+
+        for step_name, step_deps in deps.items():
+            unknown = step_deps - step_names
+            if unknown:
+                raise GenomeTreeTkError('Workflow step %s depends on unknown step(s): %s' % (step_name, ', '.join(sorted(unknown))))
+
+        return deps
+
+    def _is_current(self, step):
+        """Check if outputs of step are newer than its inputs."""
+
+        if not step.outputs:
+            return False
+
+        for output_file in step.outputs:
+            if not os.path.exists(output_file):
+                return False
+
+        oldest_output = min([os.path.getmtime(f) for f in step.outputs])
+        for input_file in step.inputs:
+            if os.path.getmtime(input_file) > oldest_output:
+                return False
+
+        return True
+
+    def _execute(self, step):
+        """Execute a single step."""
+
+        start = time.time()
+        if callable(step.action):
+            step.action()
+        else:
+            env = dict(os.environ)
+            env['OMP_NUM_THREADS'] = str(step.cpus)
+            rtn = subprocess.call('set -o pipefail; ' + step.action,
+                                    shell=True,
+                                    executable='/bin/bash',
+                                    env=env)
+            if rtn != 0:
+                raise GenomeTreeTkError('Command failed with exit code %d: %s' % (rtn, step.action))
+
+        for output_file in step.outputs:
+            if not os.path.exists(output_file):
+                raise GenomeTreeTkError('Workflow step %s did not produce: %s' % (step.name, output_file))
+
+        return time.time() - start
+
+    def run(self):
+        """Execute all steps in the workflow."""
+
+        deps = self._dependencies()
+        steps = dict((step.name, step) for step in self.steps)
+
+        status = {}
+        pending = [step.name for step in self.steps]
+        running = {}
+        cpus_in_use = 0
+        failure = None
+
+        with ThreadPoolExecutor(max_workers=max(len(self.steps), 1)) as executor:
+            while pending or running:
+                # start steps whose dependencies are satisfied
+                progress = False
+                for step_name in list(pending):
+                    if failure:
+                        break
+
+                    step_deps = deps[step_name]
+                    if any(d not in status for d in step_deps):
+                        continue
+
+                    step = steps[step_name]
+                    if any(status[d] == 'skipped' for d in step_deps):
+                        self.logger.info('Skipping step %s as a required step was skipped.' % step_name)
+                        status[step_name] = 'skipped'
+                        pending.remove(step_name)
+                        progress = True
+                        continue
+
+                    if step.condition and not step.condition():
+                        self.logger.info('Skipping step %s as it is not required.' % step_name)
+                        status[step_name] = 'skipped'
+                        pending.remove(step_name)
+                        progress = True
+                        continue
+
+                    missing = [f for f in step.inputs if not os.path.exists(f)]
+                    if missing:
+                        failure = GenomeTreeTkError('Workflow step %s is missing input: %s' % (step_name, missing[0]))
+                        break
+
+                    if self._is_current(step):
+                        self.logger.info('Outputs of step %s are up to date.' % step_name)
+                        status[step_name] = 'current'
+                        pending.remove(step_name)
+                        progress = True
+                        continue
+
+                    if cpus_in_use + step.cpus > self.cpus and running:
+                        continue
+
+                    self.logger.info('Starting step %s.' % step_name)
+                    running[executor.submit(self._execute, step)] = step_name
+                    cpus_in_use += step.cpus
+                    pending.remove(step_name)
+                    progress = True
+
+                if failure and not running:
+                    break
+
+                if not running:
+                    if pending and progress:
+                        # steps may have become ready as skipped or current steps were recorded
+                        continue
+                    elif pending:
+                        raise GenomeTreeTkError('Workflow steps have cyclic dependencies: %s' % ', '.join(pending))
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step_name = running.pop(future)
+                    cpus_in_use -= steps[step_name].cpus
+                    try:
+                        elapsed = future.result()
+                        status[step_name] = 'done'
+                        self.logger.info('Finished step %s in %.1f seconds.' % (step_name, elapsed))
+                        profiler.event('step', name=step_name, cpus=steps[step_name].cpus, wall_time=elapsed)
+                    except Exception as e:
+                        self.logger.error('Step %s failed: %s' % (step_name, e))
+                        if failure is None:
+                            failure = e
+
+        if failure:
+            raise failure
+
+        profiler.count('steps_run', sum(1 for s in status.values() if s == 'done'))
+
+        return status
@@ -18,52 +18,118 @@
 import os
 import sys
 import math
+import heapq
 import logging
+import itertools
 
 from genometreetk.common import read_gtdb_metadata
 
-from biolib.seq_io import read_seq
-from biolib.newick import parse_label
+from genometreetk.array_tree import ArrayTree
+from genometreetk.fasta_index import FastaIndex
+from genometreetk.parallel import Parallel
 
-import dendropy
+from biolib.common import make_sure_path_exists
+from biolib.newick import parse_label
 
 
 class DereplicateTree(object):
     """Dereplicate tree."""
 
-    def __init__(self):
-        """Initialization."""
+    def __init__(self, cpus=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of lineages to dereplicate in parallel.
+        """
 
         self.logger = logging.getLogger()
+
+        self.cpus = cpus
         
     def _derep_msa(self, msa_file, selected_taxa, output_msa):
         """Dereplicate multiple sequence alignment."""
         
-        selected_taxa_labels = set()
-        for taxon in selected_taxa:
-            selected_taxa_labels.add(taxon.label)
-        
-        fout = open(output_msa, 'w')
-        for seq_id, seq, annotation in read_seq(msa_file, keep_annotation=True):
-            if seq_id in selected_taxa_labels:
-                fout.write('>%s %s\n' % (seq_id, annotation))
-                fout.write('%s\n' % seq)
-        fout.close()
+        msa_index = FastaIndex(msa_file)
+        msa_index.write_subset(selected_taxa, output_msa)
         
-    def _derep_lineage(self, node, num_taxa_to_retain, genome_metadata):
+    def _rank_key(self, taxon, genome_metadata):
+        """Key ranking GTDB representatives first, followed by genomes of decreasing quality.
+
+        Genomes without metadata are ranked last.
+        """
+
+        if taxon not in genome_metadata:
+            return (False, float('-inf'), taxon)
+
+        comp, cont, rep = genome_metadata[taxon]
+        qual = float(comp) - 5*float(cont)
+        is_rep = rep == 't' or rep == 'True' or rep == 'true'
+
+        return (is_rep, qual, taxon)
+
+    def _ranked_leaves(self, tree, num_taxa_to_retain, genome_metadata):
+        """Rank leaves below each child of a named lineage.
+
+        The highest ranked leaves below each node are found
+        bottom-up by merging the ranked leaves of its children,
+        keeping at most num_taxa_to_retain leaves per node. Lists
+        are only retained for children of named lineages, which are
+        the nodes that may be dereplicated.
+
+        Returns
+        -------
+        dict : d[node] -> list
+            Leaf labels below node, from highest to lowest rank.
+        """
+
+        required = set()
+        for node in tree.internal_nodes().tolist():
+            _support, taxon, _auxiliary_info = parse_label(tree.labels[node])
+            if taxon:
+                required.update(tree.child_nodes(node).tolist())
+
+        parent = tree.parent.tolist()
+        is_leaf = tree.is_leaf.tolist()
+
+        # lists of children whose parent has not yet been processed;
+        # nodes are in preorder so children always follow their parent
+        pending = {}
+        ranked_leaves = {}
+        for node in range(len(parent) - 1, -1, -1):
+            if is_leaf[node]:
+                top = [self._rank_key(tree.labels[node], genome_metadata)]
+            else:
+                child_lists = pending.pop(node)
+                top = list(itertools.islice(heapq.merge(*child_lists, reverse=True), num_taxa_to_retain))
+
+            if node in required:
+                ranked_leaves[node] = [key[2] for key in top]
+
+            if parent[node] != -1:
+                pending.setdefault(parent[node], []).append(top)
+
+        return ranked_leaves
+
+    def _derep_lineage(self, tree, node, num_taxa_to_retain, genome_metadata, ranked_leaves=None):
         """Select genomes from lineage."""
         
+        if ranked_leaves is not None:
+            return ranked_leaves[node][0:num_taxa_to_retain]
+
         # rank all genomes in lineage with GTDB representatives first,
         # followed by genomes of decreasing quality
         rep_list = []
         taxa_list = []
-        for leaf in node.leaf_iter():
-            comp, cont, rep = genome_metadata[leaf.taxon.label]
+        for leaf in tree.leaves_below(node):
+            taxon = tree.labels[leaf]
+            comp, cont, rep = genome_metadata[taxon]
             qual = float(comp) - 5*float(cont)
             if rep == 't' or rep == 'True' or rep == 'true':
-                rep_list.append((qual, leaf.taxon))
+                rep_list.append((qual, taxon))
             else:
-                taxa_list.append((qual, leaf.taxon))
+                taxa_list.append((qual, taxon))
                 
         sorted_list = sorted(rep_list, reverse=True) + sorted(taxa_list, reverse=True)
         
@@ -78,22 +144,21 @@ class DereplicateTree(object):
                             outgroup_node, 
                             num_taxa_to_retain,
                             keep_unclassified,                            
-                            genome_metadata):
+                            genome_metadata,
+                            ranked_leaves=None):
         """Select genomes in named lineages on path from ingroup to outgroup."""
         
         # get most recent common ancestor of outgroup and lineage of interest
-        outgroup_leaf_taxon = outgroup_node.leaf_iter().next().taxon
-        lineage_of_interest_taxon = node_of_interest.leaf_iter().next().taxon
-        mrca = tree.mrca(taxa=[outgroup_leaf_taxon, lineage_of_interest_taxon])
+        mrca = tree.mrca([outgroup_node, node_of_interest])
         
         # get taxon of lineage of interest
         taxa_of_interest = []
         parent = node_of_interest
         while parent != mrca:
-            _support, taxon, _auxiliary_info = parse_label(parent.label)
+            _support, taxon, _auxiliary_info = parse_label(tree.labels[parent])
             if taxon:
                 taxa_of_interest.append(taxon)
-            parent = parent.parent_node
+            parent = tree.parent[parent]
             
         self.logger.info('Taxonomy for lineage of interest: %s' % ';'.join(taxa_of_interest))
 
@@ -103,36 +168,38 @@ class DereplicateTree(object):
         selected_taxa = []
         
         stack = []
-        for c in mrca.child_node_iter():
+        for c in tree.child_nodes(mrca):
             stack.append(c)
             
         while stack:
             cur_node = stack.pop()
             
-            if cur_node.is_leaf() and keep_unclassified:
-                selected_taxa.append(cur_node.taxon)
-            
-            _support, taxon, _auxiliary_info = parse_label(cur_node.label)
+            taxon = None
+            if tree.is_leaf[cur_node]:
+                if keep_unclassified:
+                    selected_taxa.append(tree.labels[cur_node])
+            else:
+                _support, taxon, _auxiliary_info = parse_label(tree.labels[cur_node])
             
             if taxon and taxon not in taxa_of_interest:
                 # select roughly equal taxa from each child lineage to
                 # enure we retain the correct depth (and the named node)
                 # for this lineage
                 derep_taxa = []
-                num_children = sum([1 for c in cur_node.child_node_iter()])
+                num_children = tree.num_children[cur_node]
                 child_taxa_to_sample = int(math.ceil((1.0/num_children)*num_taxa_to_retain))
-                for i, c in enumerate(cur_node.child_node_iter()):
+                for i, c in enumerate(tree.child_nodes(cur_node)):
                     taxa_to_sample = min(child_taxa_to_sample, num_taxa_to_retain - len(derep_taxa))
-                    derep_taxa += self._derep_lineage(c, taxa_to_sample, genome_metadata)
+                    derep_taxa += self._derep_lineage(tree, c, taxa_to_sample, genome_metadata, ranked_leaves)
  
                 selected_taxa += derep_taxa
                 self.logger.info('Selecting %d taxa from %s.' % (len(derep_taxa), taxon))
             elif cur_node == node_of_interest:
                 self.logger.info('Retaining all taxa in lineage of interest.')
-                for leaf in node_of_interest.leaf_iter():
-                    selected_taxa.append(leaf.taxon) 
+                for leaf in tree.leaves_below(node_of_interest):
+                    selected_taxa.append(tree.labels[leaf]) 
             else:
-                for c in cur_node.child_node_iter():
+                for c in tree.child_nodes(cur_node):
                     stack.append(c)
                 
         return selected_taxa
@@ -176,17 +243,14 @@ class DereplicateTree(object):
         
         # read tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = ArrayTree.read(input_tree)
 
         # locate node of interest and outgroup node
         self.logger.info('Identifying lineage of interest and outgroup.')
         node_of_interest = None
         outgroup_node = None
-        for node in tree.preorder_node_iter():
-            _support, taxon_str, _auxiliary_info = parse_label(node.label)
+        for node in tree.internal_nodes():
+            _support, taxon_str, _auxiliary_info = parse_label(tree.labels[node])
             
             if not taxon_str:
                 continue
@@ -197,11 +261,11 @@ class DereplicateTree(object):
                 elif taxon == outgroup:
                     outgroup_node = node
                 
-        if not node_of_interest:
+        if node_of_interest is None:
             self.logger.error('Could not find specified lineage of interest: %s' % lineage_of_interest)
             sys.exit()
             
-        if not outgroup_node:
+        if outgroup_node is None:
             self.logger.error('Could not find outgroup: %s' % outgroup)
             sys.exit()
                        
@@ -218,7 +282,8 @@ class DereplicateTree(object):
         
         # prune tree
         self.logger.info('Pruning tree.')
-        tree.retain_taxa(selected_taxa)
+        leaf_index = tree.leaf_index()
+        tree = tree.retain_leaves([leaf_index[taxon] for taxon in selected_taxa])
         
         # dereplicate MSA if requested
         if msa_file:
@@ -230,7 +295,168 @@ class DereplicateTree(object):
         # write out results
         tree_name, tree_ext = os.path.splitext(os.path.basename(input_tree))
         output_tree = os.path.join(output_dir, tree_name + '.derep' + tree_ext)
-        tree.write_to_path(output_tree, 
-                            schema='newick', 
-                            suppress_rooting=True, 
-                            unquoted_underscores=True)
+        tree.write(output_tree)
+
+    def _locate_lineages(self, tree, taxa):
+        """Locate node of each named lineage in tree."""
+
+        taxon_nodes = {}
+        for node in tree.internal_nodes().tolist():
+            _support, taxon_str, _auxiliary_info = parse_label(tree.labels[node])
+            
+            if not taxon_str:
+                continue
+                
+            for taxon in [t.strip() for t in taxon_str.split(';')]:
+                if taxon in taxa:
+                    taxon_nodes[taxon] = node
+
+        return taxon_nodes
+
+    def _derep_pair_producer(self, job):
+        """Dereplicate tree and MSA for a lineage of interest and outgroup."""
+
+        lineage_of_interest, outgroup, pair_dir = job
+
+        selected_taxa = self._select_taxa(self.tree,
+                                            self.taxon_nodes[lineage_of_interest],
+                                            self.taxon_nodes[outgroup],
+                                            self.num_taxa_to_retain,
+                                            self.keep_unclassified,
+                                            self.genome_metadata,
+                                            self.ranked_leaves)
+
+        make_sure_path_exists(pair_dir)
+
+        tree = self.tree.retain_leaves([self.leaf_index[taxon] for taxon in selected_taxa])
+        tree_name, tree_ext = os.path.splitext(os.path.basename(self.input_tree))
+        output_tree = os.path.join(pair_dir, tree_name + '.derep' + tree_ext)
+        tree.write(output_tree)
+
+        if self.msa_index is not None:
+            msa_name, msa_ext = os.path.splitext(os.path.basename(self.msa_index.fasta_file))
+            output_msa = os.path.join(pair_dir, msa_name + '.derep' + msa_ext)
+            self.msa_index.write_subset(selected_taxa, output_msa)
+
+        return lineage_of_interest, outgroup, len(selected_taxa), output_tree
+
+    def _derep_pair_consumer(self, produced_data, consumer_data):
+        """Summarize dereplicated trees."""
+
+        if consumer_data == None:
+            consumer_data = 0
+
+        self.fout_summary.write('%s\t%s\t%d\t%s\n' % produced_data)
+        consumer_data += 1
+
+        return consumer_data
+
+    def _derep_pair_progress(self, processed_items, total_items):
+        """Report progress of dereplicated lineages."""
+
+        return '==> Dereplicated %d of %d lineages.' % (processed_items, total_items)
+
+    def run_batch(self,
+                    input_tree,
+                    lineage_file,
+                    gtdb_metadata,
+                    num_taxa_to_retain,
+                    msa_file,
+                    keep_unclassified,
+                    output_dir):
+        """Dereplicate tree for multiple lineages of interest.
+
+        The tree, metadata, and MSA index are read once, and the
+        ranked leaves of each lineage are determined in a single
+        traversal of the tree. The results for each lineage are
+        written to a subdirectory of the output directory.
+
+        Parameters
+        ----------
+        input_tree : str
+            Tree to dereplicate
+        lineage_file : str
+            File with a lineage of interest and outgroup on each line, separated by a tab.
+        gtdb_metadata : str
+            File containing metadata for taxa in tree.
+        num_taxa_to_retain: int
+            Taxa to retain in dereplicated lineages.
+        msa_file : str
+            Multiple sequence alignment to dereplicate along with tree.
+        keep_unclassified : boolean
+            Keep all taxa in unclassified lineages.
+        output_dir:
+            Output dir.
+        """
+
+        pairs = []
+        for line in open(lineage_file):
+            if not line.strip() or line[0] == '#':
+                continue
+
+            line_split = [t.strip() for t in line.split('\t')]
+            if len(line_split) < 2:
+                self.logger.error('Expected lineage of interest and outgroup on line: %s' % line.strip())
+                sys.exit(-1)
+            pairs.append((line_split[0], line_split[1]))
+
+        self.logger.info('Read %d lineages of interest.' % len(pairs))
+
+        # read GTDB metadata
+        self.logger.info('Reading metadata.')
+        self.genome_metadata = read_gtdb_metadata(gtdb_metadata, ['checkm_completeness',
+                                                                    'checkm_contamination',
+                                                                    'gtdb_representative'])
+        
+        # read tree
+        self.logger.info('Reading tree.')
+        self.tree = ArrayTree.read(input_tree)
+        self.leaf_index = self.tree.leaf_index()
+
+        # locate all lineages of interest and outgroups
+        self.logger.info('Identifying lineages of interest and outgroups.')
+        taxa = set([t for pair in pairs for t in pair])
+        self.taxon_nodes = self._locate_lineages(self.tree, taxa)
+
+        missing_taxa = taxa - set(self.taxon_nodes)
+        if missing_taxa:
+            self.logger.error('Could not find specified lineages: %s' % ', '.join(sorted(missing_taxa)))
+            sys.exit(-1)
+
+        self.logger.info('Ranking taxa within each named lineage.')
+        self.ranked_leaves = self._ranked_leaves(self.tree, num_taxa_to_retain, self.genome_metadata)
+
+        self.msa_index = None
+        if msa_file:
+            self.msa_index = FastaIndex(msa_file)
+
+        self.input_tree = input_tree
+        self.num_taxa_to_retain = num_taxa_to_retain
+        self.keep_unclassified = keep_unclassified
+
+        # results for a lineage are placed in a directory named after
+        # the lineage, or the lineage and outgroup if it is repeated
+        lineage_count = {}
+        for lineage_of_interest, _outgroup in pairs:
+            lineage_count[lineage_of_interest] = lineage_count.get(lineage_of_interest, 0) + 1
+
+        jobs = []
+        for lineage_of_interest, outgroup in pairs:
+            dir_name = lineage_of_interest
+            if lineage_count[lineage_of_interest] > 1:
+                dir_name += '_' + outgroup
+            jobs.append((lineage_of_interest, outgroup, os.path.join(output_dir, dir_name.replace(' ', '_'))))
+
+        summary_file = os.path.join(output_dir, 'derep_summary.tsv')
+        self.fout_summary = open(summary_file, 'w')
+        self.fout_summary.write('Lineage of interest\tOutgroup\tRetained taxa\tDereplicated tree\n')
+        try:
+            parallel = Parallel(self.cpus, ordered=True)
+            parallel.run(self._derep_pair_producer,
+                            self._derep_pair_consumer,
+                            jobs,
+                            self._derep_pair_progress)
+        finally:
+            self.fout_summary.close()
+
+        self.logger.info('Summary of dereplicated lineages written to: %s' % summary_file)
@@ -30,6 +30,7 @@ from genometreetk.common import (read_gtdb_metadata,
                                  read_gtdb_representative,
                                  read_gtdb_ncbi_type_strain,
                                  species_label)
+from genometreetk.profiler import profiler, profiled
 import genometreetk.ncbi as ncbi
 
 
@@ -51,6 +52,7 @@ class DereplicationWorkflow(object):
 
         self.logger = logging.getLogger()
 
+    @profiled('dereplicate_species')
     def _dereplicate(self, assemble_accessions,
                             max_species,
                             species_labels,
@@ -273,22 +275,23 @@ class DereplicationWorkflow(object):
         
         # get genome quality
         genomes_to_consider = list(accession_to_taxid.keys())
-        genome_stats = read_gtdb_metadata(metadata_file, ['checkm_completeness',
-                                                            'checkm_contamination',
-                                                            'contig_count',
-                                                            'n50_scaffolds',
-                                                            'ambiguous_bases',
-                                                            'total_gap_length',
-                                                            'scaffold_count',
-                                                            'ssu_count',
-                                                            'ncbi_molecule_count',
-                                                            'ncbi_unspanned_gaps',
-                                                            'ncbi_genome_representation',
-                                                            'ncbi_spanned_gaps',
-                                                            'ncbi_assembly_level',
-                                                            'ncbi_taxonomy',
-                                                            'ncbi_organism_name',
-                                                            'lpsn_strain'])
+        with profiler.stage('read_metadata'):
+            genome_stats = read_gtdb_metadata(metadata_file, ['checkm_completeness',
+                                                                'checkm_contamination',
+                                                                'contig_count',
+                                                                'n50_scaffolds',
+                                                                'ambiguous_bases',
+                                                                'total_gap_length',
+                                                                'scaffold_count',
+                                                                'ssu_count',
+                                                                'ncbi_molecule_count',
+                                                                'ncbi_unspanned_gaps',
+                                                                'ncbi_genome_representation',
+                                                                'ncbi_spanned_gaps',
+                                                                'ncbi_assembly_level',
+                                                                'ncbi_taxonomy',
+                                                                'ncbi_organism_name',
+                                                                'lpsn_strain'])
         missing_quality = set(accession_to_taxid.keys()) - set(genome_stats.keys())
         if missing_quality:
             self.logger.error('There are %d genomes without metadata information.' % len(missing_quality))
@@ -404,6 +407,8 @@ class DereplicationWorkflow(object):
                                                 genome_quality)
 
         self.logger.info('Retained %d genomes.' % len(genomes_to_retain))
+        profiler.count('genomes', len(genomes_to_consider))
+        profiler.count('retained_genomes', len(genomes_to_retain))
 
         if not trusted_genomes_file:
             trusted_genomes_file = ''
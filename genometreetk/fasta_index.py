@@ -0,0 +1,281 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import mmap
+import logging
+
+from genometreetk.exceptions import GenomeTreeTkError
+
+
+class FastaIndex(object):
+    """Random access to sequences in a FASTA file through an offset index.
+
+    The index gives the byte offset of each record, the length of its
+    header line and of the entire record, and the annotation following
+    the sequence ID in its header. It is held in memory unless an index
+    file is given, in which case it is written to this file and reused
+    until the FASTA file changes. Subsets of sequences are
+    copied directly from the FASTA file with os.sendfile (or mmap where
+    sendfile is unavailable) without parsing the sequences.
+
+    As with biolib's seq_io.read_fasta, the last record of a sequence
+    ID occurring multiple times is used.
+    """
+
+    INDEX_MAGIC = '#genometreetk_fasta_index'
+
+    def __init__(self, fasta_file, index_file=None):
+        """Initialization.
+
+        Parameters
+        ----------
+        fasta_file : str
+            Uncompressed FASTA file.
+        index_file : str
+            File to store index for reuse, or None to keep index in memory only.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        if fasta_file.endswith('.gz'):
+            raise GenomeTreeTkError('Compressed FASTA files can not be indexed: %s' % fasta_file)
+
+        if not os.path.exists(fasta_file):
+            raise GenomeTreeTkError('Input file %s does not exist.' % fasta_file)
+
+        self.fasta_file = fasta_file
+        self.index_file = index_file
+
+        self._fd = None
+        self._mm = None
+
+        stat = os.stat(fasta_file)
+        self.signature = '%d\t%d' % (stat.st_size, stat.st_mtime_ns)
+
+        # d[seq_id] -> (offset, header length, record length, annotation)
+        self.entries = None
+        if self.index_file:
+            self.entries = self._read_index()
+
+        if self.entries is None:
+            self.entries = self._build_index()
+            if self.index_file:
+                self._write_index()
+
+    def __contains__(self, seq_id):
+        return seq_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close FASTA file."""
+
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open(self):
+        """Open FASTA file for random access."""
+
+        if self._fd is None:
+            self._fd = os.open(self.fasta_file, os.O_RDONLY)
+            if os.fstat(self._fd).st_size > 0:
+                self._mm = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+
+        return self._mm
+
+    def _read_index(self):
+        """Read index if it exists and matches the FASTA file."""
+
+        if not os.path.exists(self.index_file):
+            return None
+
+        entries = {}
+        with open(self.index_file) as f:
+            if f.readline().rstrip('\n') != '%s\t%s' % (self.INDEX_MAGIC, self.signature):
+                return None
+
+            for line in f:
+                seq_id, offset, header_len, record_len, annotation = line.rstrip('\n').split('\t', 4)
+                entries[seq_id] = (int(offset), int(header_len), int(record_len), annotation)
+
+        return entries
+
+    def _build_index(self):
+        """Determine offset of each record in FASTA file."""
+
+        entries = {}
+
+        mm = self._open()
+        if mm is None:
+            return entries
+
+        size = len(mm)
+        pos = mm.find(b'>')
+        while pos != -1 and pos < size:
+            header_end = mm.find(b'\n', pos)
+            if header_end == -1:
+                header_end = size - 1
+
+            next_pos = mm.find(b'\n>', header_end)
+            record_end = next_pos + 1 if next_pos != -1 else size
+
+            header = mm[pos + 1:header_end + 1].decode('utf-8').strip()
+            header_split = header.split(None, 1)
+            if not header_split:
+                raise GenomeTreeTkError('Missing sequence ID at byte %d of %s.' % (pos, self.fasta_file))
+
+            seq_id = header_split[0]
+            annotation = header_split[1] if len(header_split) > 1 else ''
+            entries[seq_id] = (pos, header_end + 1 - pos, record_end - pos, annotation.replace('\t', ' '))
+
+            pos = record_end if next_pos != -1 else -1
+
+        self.logger.info('Indexed %d sequences in %s.' % (len(entries), self.fasta_file))
+
+        return entries
+
+    def _write_index(self):
+        """Write index, if possible, so it can be reused."""
+
+        tmp_index = self.index_file + '.tmp.%d' % os.getpid()
+        try:
+            with open(tmp_index, 'w') as fout:
+                fout.write('%s\t%s\n' % (self.INDEX_MAGIC, self.signature))
+                for seq_id, (offset, header_len, record_len, annotation) in self.entries.items():
+                    fout.write('%s\t%d\t%d\t%d\t%s\n' % (seq_id, offset, header_len, record_len, annotation))
+            os.replace(tmp_index, self.index_file)
+        except (IOError, OSError):
+            # index is still usable from memory
+            self.logger.warning('Unable to write FASTA index: %s' % self.index_file)
+            if os.path.exists(tmp_index):
+                os.remove(tmp_index)
+
+    def ids(self):
+        """Get sequence IDs in order of their records."""
+
+        return [seq_id for seq_id, _ in sorted(self.entries.items(), key=lambda x: x[1][0])]
+
+    def annotation(self, seq_id):
+        """Get annotation of sequence."""
+
+        return self.entries[seq_id][3]
+
+    def sequence(self, seq_id):
+        """Get sequence.
+
+        Parameters
+        ----------
+        seq_id : str
+            Sequence ID.
+
+        Returns
+        -------
+        str
+            Sequence with line breaks and spaces removed.
+        """
+
+        offset, header_len, record_len, _annotation = self.entries[seq_id]
+
+        mm = self._open()
+        seq = mm[offset + header_len:offset + record_len].decode('utf-8')
+
+        return ''.join([line.strip() for line in seq.splitlines()]).replace(' ', '')
+
+    def _copy(self, out_fd, offset, length):
+        """Copy bytes from FASTA file to output file."""
+
+        mm = self._open()
+        while length > 0:
+            try:
+                sent = os.sendfile(out_fd, self._fd, offset, length)
+            except (AttributeError, OSError):
+                # sendfile is unavailable for this platform or file type
+                sent = os.write(out_fd, mm[offset:offset + length])
+
+            if sent == 0:
+                raise GenomeTreeTkError('Unexpected end of file while reading: %s' % self.fasta_file)
+
+            offset += sent
+            length -= sent
+
+    def write_subset(self, seq_ids, output_file, keep_annotation=True):
+        """Write subset of sequences to FASTA file.
+
+        Records are copied unaltered from the indexed FASTA file
+        in the order they appear in this file, with consecutive
+        records copied together.
+
+        Parameters
+        ----------
+        seq_ids : iterable
+            IDs of sequences to write, ignoring IDs not in the index.
+        output_file : str
+            Output FASTA file.
+        keep_annotation : boolean
+            Write annotation of each sequence in header.
+
+        Returns
+        -------
+        int
+            Number of sequences written.
+        """
+
+        records = sorted(set([self.entries[seq_id] for seq_id in seq_ids if seq_id in self.entries]))
+
+        self._open()
+        out_fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            run_start = run_end = None
+            for offset, header_len, record_len, _annotation in records:
+                if not keep_annotation:
+                    # write header with sequence ID only, followed by sequence
+                    seq_id = self._mm[offset + 1:offset + header_len].split(None, 1)[0]
+                    os.write(out_fd, b'>' + seq_id + b'\n')
+                    self._copy(out_fd, offset + header_len, record_len - header_len)
+                    run_end = offset + record_len
+                    continue
+
+                if run_end == offset:
+                    # extend run of consecutive records
+                    run_end = offset + record_len
+                    continue
+
+                if run_start is not None:
+                    self._copy(out_fd, run_start, run_end - run_start)
+                run_start = offset
+                run_end = offset + record_len
+
+            if run_start is not None:
+                self._copy(out_fd, run_start, run_end - run_start)
+
+            # ensure file ends with a newline if final record did not
+            if records and self._mm[run_end - 1:run_end] != b'\n':
+                os.write(out_fd, b'\n')
+        finally:
+            os.close(out_fd)
+
+        return len(records)
@@ -28,6 +28,8 @@ from genometreetk.common import (read_genome_id_file,
                                     read_marker_id_file,
                                     create_concatenated_alignment)
 from genometreetk.markers.align_markers import AlignMarkers
+from genometreetk.checkpoint import Checkpoint
+from genometreetk.profiler import profiler
 
 
 class InferWorkflow(object):
@@ -148,22 +150,46 @@ class InferWorkflow(object):
         self.logger.info('Reading marker genes.')
         marker_genes = read_marker_id_file(marker_id_file)
         self.logger.info('Read %d marker genes.' % len(marker_genes))
+        profiler.count('genomes', len(genome_ids))
+        profiler.count('markers', len(marker_genes))
+
+        # stages are skipped on rerun if their inputs, parameters and outputs are unchanged
+        checkpoint = Checkpoint(os.path.join(output_dir, 'checkpoints'))
 
         # gather all single-copy HMMs into a single model file
         hmm_model_out = os.path.join(output_dir, 'phylo.hmm')
         hmm_info_out = os.path.join(output_dir, 'phylo.tsv')
         self.logger.info('Generating marker gene HMM model files.')
-        self._fetch_marker_models(marker_genes, hmm_model_out, hmm_info_out, output_model_dir)
+        model_files = [self.pfam_model_file]
+        for marker_id in marker_genes:
+            if 'PF' not in marker_id:
+                model_files.append(os.path.join(self.tigrfams_model_dir, marker_id + '.HMM'))
+        checkpoint.run('fetch_models',
+                        self._fetch_marker_models,
+                        args=(marker_genes, hmm_model_out, hmm_info_out, output_model_dir),
+                        inputs=model_files,
+                        params={'marker_genes': marker_genes},
+                        outputs=[hmm_model_out, hmm_info_out, output_model_dir])
 
         # align gene sequences
         align_markers = AlignMarkers(self.cpus)
-        align_markers.run(genome_ids, genome_dirs, marker_genes, True, output_alignment_dir, output_model_dir)
+        checkpoint.run('align',
+                        align_markers.run,
+                        args=(genome_ids, genome_dirs, marker_genes, True, output_alignment_dir, output_model_dir),
+                        inputs=[self.genome_dir_file, output_model_dir],
+                        params={'genome_ids': genome_ids, 'marker_genes': marker_genes},
+                        outputs=[output_alignment_dir])
 
         # create concatenated alignment file
         self.logger.info('Concatenating alignments.')
         concatenated_alignment_file = os.path.join(output_dir, 'concatenated_alignment.faa')
         marker_file = os.path.join(output_dir, 'concatenated_markers.tsv')
-        create_concatenated_alignment(genome_ids, marker_genes, output_alignment_dir, concatenated_alignment_file, marker_file)
+        checkpoint.run('concatenate',
+                        create_concatenated_alignment,
+                        args=(genome_ids, marker_genes, output_alignment_dir, concatenated_alignment_file, marker_file),
+                        inputs=[output_alignment_dir],
+                        params={'genome_ids': genome_ids, 'marker_genes': marker_genes},
+                        outputs=[concatenated_alignment_file, marker_file])
 
         # create concatenated genome tree
         self.logger.info('Inferring concatenated genome tree.')
@@ -171,7 +197,12 @@ class InferWorkflow(object):
         concatenated_tree_log = os.path.join(output_dir, 'concatenated.tree.log')
         log_file = os.path.join(output_dir, 'fasttree.log')
         fast_tree = FastTree(multithreaded=True)
-        fast_tree.run(concatenated_alignment_file, 'prot', model, concatenated_tree, concatenated_tree_log, log_file)
+        checkpoint.run('infer_tree',
+                        fast_tree.run,
+                        args=(concatenated_alignment_file, 'prot', model, concatenated_tree, concatenated_tree_log, log_file),
+                        inputs=[concatenated_alignment_file],
+                        params={'model': model},
+                        outputs=[concatenated_tree, concatenated_tree_log])
 
         # generate summary report
         report_out = os.path.join(output_dir, 'infer_workflow.log')
@@ -180,5 +211,6 @@ class InferWorkflow(object):
         fout.write('Genome Id file: %s\n' % genome_id_file)
         fout.write('Marker Id file: %s\n' % marker_id_file)
         fout.write('Model of evolution: %s\n' % model)
+        checkpoint.write_summary(fout)
         fout.write(time_keeper.get_time_stamp())
         fout.close()
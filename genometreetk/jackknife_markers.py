@@ -22,10 +22,12 @@ from math import floor
 
 import biolib.seq_io as seq_io
 from biolib.external.fasttree import FastTree
-from biolib.parallel import Parallel
 from biolib.common import remove_extension, make_sure_path_exists
 from biolib.bootstrap import bootstrap_support
 
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler
+
 
 class JackknifeMarkers(object):
     """Assess robustness by jackkifing genes in alignment."""
@@ -172,7 +174,9 @@ class JackknifeMarkers(object):
         self.logger.info('Concatenated length of filtered MSA: %d' % total_mask_len)
 
         # read full multiple sequence alignment
-        self.msa = seq_io.read(msa_file)
+        with profiler.stage('read_msa'):
+            self.msa = seq_io.read(msa_file)
+            profiler.count('sequences', len(self.msa))
         
         if len(list(self.msa.values())[0]) != total_mask_len:
             self.logger.error('Length of MSA does not meet length of mask.')
@@ -180,8 +184,10 @@ class JackknifeMarkers(object):
 
         # calculate replicates
         self.logger.info('Calculating jackknife marker replicates:')
-        parallel = Parallel(self.cpus)
-        parallel.run(self._producer, None, range(num_replicates), self._progress)
+        with profiler.stage('replicates'):
+            parallel = Parallel(self.cpus)
+            parallel.run(self._producer, None, range(num_replicates), self._progress)
+            profiler.count('replicates', num_replicates)
 
         # calculate support
         self.logger.info('Calculating support for %d replicates.' % num_replicates)
@@ -190,6 +196,7 @@ class JackknifeMarkers(object):
             rep_tree_files.append(os.path.join(self.replicate_dir, 'jk_markers.tree.' + str(rep_index) + '.tre'))
 
         output_tree = os.path.join(output_dir, remove_extension(input_tree) + '.jk_markers.tree')
-        bootstrap_support(input_tree, rep_tree_files, output_tree)
+        with profiler.stage('support'):
+            bootstrap_support(input_tree, rep_tree_files, output_tree)
 
         return output_tree
@@ -20,13 +20,13 @@ import logging
 import random
 from math import floor
 
-import biolib.seq_io as seq_io
 from biolib.external.fasttree import FastTree
-from biolib.parallel import Parallel
 from biolib.bootstrap import bootstrap_support
 from biolib.common import remove_extension, make_sure_path_exists
 
 from genometreetk.tree_support import TreeSupport
+from genometreetk.fasta_index import FastaIndex
+from genometreetk.profiler import profiler
 
 
 class JackknifeTaxa(object):
@@ -74,8 +74,8 @@ class JackknifeTaxa(object):
 
         Parameters
         ----------
-        msa : d[seq_id] -> seq
-          Full multiple sequence alignment.
+        msa : FastaIndex
+          Index of full multiple sequence alignment.
         perc_taxa_to_keep : float
           Percentage of marker genes to keep in each replicate.
         outgroup_ids : set
@@ -85,17 +85,12 @@ class JackknifeTaxa(object):
         """
 
         # randomly select ingroup taxa
-        ingroup_taxa = set(msa.keys()) - outgroup_ids
+        ingroup_taxa = [seq_id for seq_id in msa.ids() if seq_id not in outgroup_ids]
         taxa_to_keep = random.sample(ingroup_taxa, int(floor(len(ingroup_taxa) * perc_taxa_to_keep)))
 
         taxa_to_keep = set(taxa_to_keep).union(outgroup_ids)
 
-        fout = open(output_file, 'w')
-        for seq_id, seq in msa.items():
-            if seq_id in taxa_to_keep:
-                fout.write('>' + seq_id + '\n')
-                fout.write(seq + '\n')
-        fout.close()
+        msa.write_subset(taxa_to_keep, output_file, keep_annotation=False)
 
     def run(self, input_tree, msa_file, outgroup_file, perc_taxa_to_keep, num_replicates, model, output_dir):
         """Jackknife taxa.
@@ -130,8 +125,10 @@ class JackknifeTaxa(object):
             for line in open(outgroup_file):
                 self.outgroup_ids.add(line.strip())
 
-        # read full multiple sequence alignment
-        self.msa = seq_io.read(msa_file)
+        # index full multiple sequence alignment
+        with profiler.stage('index_msa'):
+            self.msa = FastaIndex(msa_file)
+            profiler.count('sequences', len(self.msa))
 
         # calculate replicates
         #***self.logger.info('Calculating jackknife taxa replicates:')
@@ -145,6 +142,7 @@ class JackknifeTaxa(object):
 
         tree_support = TreeSupport()
         output_tree = os.path.join(output_dir, remove_extension(input_tree) + '.jk_taxa.tree')
-        tree_support.subset_taxa(input_tree, rep_tree_files, output_tree)
+        with profiler.stage('support'):
+            tree_support.subset_taxa(input_tree, rep_tree_files, output_tree)
 
         return output_tree
\ No newline at end of file
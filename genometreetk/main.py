@@ -18,31 +18,14 @@
 import os
 import sys
 import logging
-
-import dendropy
+from collections import defaultdict
 
 from biolib.common import check_file_exists, make_sure_path_exists, is_float
 from biolib.external.execute import check_dependencies
 from biolib.taxonomy import Taxonomy
-from biolib.newick import parse_label
 
 from genometreetk.exceptions import GenomeTreeTkError
-from genometreetk.trusted_genome_workflow import TrustedGenomeWorkflow
-from genometreetk.dereplication_workflow import DereplicationWorkflow
-from genometreetk.marker_workflow import MarkerWorkflow
-from genometreetk.infer_workflow import InferWorkflow
-from genometreetk.rna_workflow import RNA_Workflow
-from genometreetk.bootstrap import Bootstrap
-from genometreetk.jackknife_markers import JackknifeMarkers
-from genometreetk.jackknife_taxa import JackknifeTaxa
-from genometreetk.combine_support import CombineSupport
-from genometreetk.reroot_tree import RerootTree
-from genometreetk.representatives import Representatives
-from genometreetk.common import read_gtdb_metadata
-from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
-from genometreetk.arb import Arb
-from genometreetk.derep_tree import DereplicateTree
-from genometreetk.ani import ANI
+from genometreetk.profiler import profiler
 
 
 class OptionsParser():
@@ -65,6 +48,8 @@ class OptionsParser():
     def trusted(self, options):
         """Determine trusted genomes."""
 
+        from genometreetk.trusted_genome_workflow import TrustedGenomeWorkflow
+
         check_file_exists(options.metadata_file)
 
         trusted_genome_workflow = TrustedGenomeWorkflow()
@@ -79,9 +64,44 @@ class OptionsParser():
 
         self.logger.info('Trusted genome list written to: %s' % options.trusted_genomes_file)
 
+    def outgroup_batch(self, options):
+        """Reroot set of trees with outgroup."""
+
+        from genometreetk.reroot_tree import RerootTree
+
+        check_file_exists(options.taxonomy_file)
+        make_sure_path_exists(options.output_dir)
+
+        if os.path.isdir(options.input_trees):
+            input_trees = []
+            for f in os.listdir(options.input_trees):
+                if f.endswith(options.tree_ext):
+                    input_trees.append(os.path.join(options.input_trees, f))
+        else:
+            check_file_exists(options.input_trees)
+            input_trees = [line.strip() for line in open(options.input_trees) if line.strip()]
+
+        if not input_trees:
+            self.logger.warning('No trees identified in: %s' % options.input_trees)
+            sys.exit(0)
+
+        self.logger.info('Identifying genomes from the specified outgroup.')
+        outgroup = set()
+        for genome_id, taxa in Taxonomy().read(options.taxonomy_file).items():
+            if options.outgroup_taxon in taxa:
+                outgroup.add(genome_id)
+        self.logger.info('Identifying %d genomes in the outgroup.' % len(outgroup))
+
+        reroot = RerootTree(options.cpus)
+        reroot.root_with_outgroup_batch(sorted(input_trees), options.output_dir, outgroup)
+
+        self.logger.info('Rerooted trees written to: %s' % options.output_dir)
+
     def dereplicate(self, options):
         """Dereplicate genomes based on taxonomy."""
 
+        from genometreetk.dereplication_workflow import DereplicationWorkflow
+
         if options.trusted_genomes_file:
             check_file_exists(options.trusted_genomes_file)
 
@@ -102,6 +122,10 @@ class OptionsParser():
     def markers(self, options):
         """Determine marker genes."""
 
+        from genometreetk.marker_workflow import MarkerWorkflow
+
+        check_dependencies(['FastTree', 'hmmsearch'])
+
         make_sure_path_exists(options.output_dir)
 
         config_data = self._read_config_file()
@@ -129,6 +153,10 @@ class OptionsParser():
     def infer(self, options):
         """Infer genome tree."""
 
+        from genometreetk.infer_workflow import InferWorkflow
+
+        check_dependencies(['FastTree', 'hmmsearch'])
+
         check_file_exists(options.genome_id_file)
         check_file_exists(options.marker_id_file)
         make_sure_path_exists(options.output_dir)
@@ -152,6 +180,8 @@ class OptionsParser():
     def ssu_tree(self, options):
         """Infer 16S tree spanning GTDB genomes."""
 
+        from genometreetk.rna_workflow import RNA_Workflow
+
         check_dependencies(['ssu-align', 'ssu-mask', 'FastTreeMP', 'blastn'])
 
         check_file_exists(options.gtdb_metadata_file)
@@ -178,6 +208,8 @@ class OptionsParser():
     def lsu_tree(self, options):
         """Infer 23S tree spanning GTDB genomes."""
 
+        from genometreetk.rna_workflow import RNA_Workflow
+
         check_dependencies(['esl-sfetch', 'cmsearch', 'cmalign', 'esl-alimask', 'FastTreeMP', 'blastn'])
 
         check_file_exists(options.gtdb_metadata_file)
@@ -204,6 +236,8 @@ class OptionsParser():
     def rna_tree(self, options):
         """Infer 16S + 23S tree spanning GTDB genomes."""
 
+        from genometreetk.rna_workflow import RNA_Workflow
+
         check_dependencies(['FastTreeMP'])
 
         check_file_exists(options.ssu_msa)
@@ -223,7 +257,9 @@ class OptionsParser():
         
     def derep_tree(self, options):
         """Dereplicate tree."""
-        
+
+        from genometreetk.derep_tree import DereplicateTree
+
         check_file_exists(options.input_tree)
         check_file_exists(options.gtdb_metadata)
         make_sure_path_exists(options.output_dir)
@@ -238,9 +274,32 @@ class OptionsParser():
                         options.keep_unclassified,
                         options.output_dir)
 
+    def derep_tree_batch(self, options):
+        """Dereplicate tree for multiple lineages of interest."""
+
+        from genometreetk.derep_tree import DereplicateTree
+
+        check_file_exists(options.input_tree)
+        check_file_exists(options.lineage_file)
+        check_file_exists(options.gtdb_metadata)
+        make_sure_path_exists(options.output_dir)
+
+        derep_tree = DereplicateTree(options.cpus)
+        derep_tree.run_batch(options.input_tree,
+                                options.lineage_file,
+                                options.gtdb_metadata,
+                                options.taxa_to_retain,
+                                options.msa_file,
+                                options.keep_unclassified,
+                                options.output_dir)
+
     def bootstrap(self, options):
         """Bootstrap multiple sequence alignment."""
 
+        from genometreetk.bootstrap import Bootstrap
+
+        check_dependencies(['FastTree'])
+
         check_file_exists(options.input_tree)
         check_file_exists(options.msa_file)
         make_sure_path_exists(options.output_dir)
@@ -259,6 +318,10 @@ class OptionsParser():
     def jk_markers(self, options):
         """Jackknife marker genes."""
 
+        from genometreetk.jackknife_markers import JackknifeMarkers
+
+        check_dependencies(['FastTree'])
+
         check_file_exists(options.input_tree)
         check_file_exists(options.msa_file)
         make_sure_path_exists(options.output_dir)
@@ -278,6 +341,10 @@ class OptionsParser():
     def jk_taxa(self, options):
         """Jackknife taxa."""
 
+        from genometreetk.jackknife_taxa import JackknifeTaxa
+
+        check_dependencies(['FastTree'])
+
         check_file_exists(options.input_tree)
         check_file_exists(options.msa_file)
         make_sure_path_exists(options.output_dir)
@@ -296,6 +363,8 @@ class OptionsParser():
     def combine(self, options):
         """Combine support values into a single tree."""
 
+        from genometreetk.combine_support import CombineSupport
+
         combineSupport = CombineSupport()
         combineSupport.run(options.support_type,
                             options.bootstrap_tree,
@@ -303,6 +372,21 @@ class OptionsParser():
                             options.jk_taxa_tree,
                             options.output_tree)
 
+    def gene_tree_dist(self, options):
+        """Calculate distances between all pairs of gene trees."""
+
+        from genometreetk.markers.gene_tree_distances import GeneTreeDistances
+
+        if not os.path.isdir(options.gene_tree_dir):
+            self.logger.error('Gene tree directory does not exist: %s' % options.gene_tree_dir)
+            sys.exit(-1)
+
+        gene_tree_dist = GeneTreeDistances(options.cpus)
+        gene_tree_dist.run(options.gene_tree_dir,
+                            options.output_dir,
+                            options.extension,
+                            not options.unscaled)
+
     def support_wf(self, options):
         """"Perform entire tree support workflow."""
 
@@ -314,12 +398,16 @@ class OptionsParser():
     def midpoint(self, options):
         """"Midpoint root tree."""
 
+        from genometreetk.reroot_tree import RerootTree
+
         reroot = RerootTree()
         reroot.midpoint(options.input_tree, options.output_tree)
 
     def outgroup(self, options):
         """Reroot tree with outgroup."""
 
+        from genometreetk.reroot_tree import RerootTree
+
         check_file_exists(options.taxonomy_file)
 
         self.logger.info('Identifying genomes from the specified outgroup.')
@@ -335,6 +423,8 @@ class OptionsParser():
     def dereplicate(self, options):
         """Select representative genomes for named species."""
 
+        from genometreetk.representatives import Representatives
+
         check_file_exists(options.metadata_file)
         check_file_exists(options.prev_rep_file)
         check_file_exists(options.trusted_user_file)
@@ -364,6 +454,8 @@ class OptionsParser():
     def representatives(self, options):
         """Determine additional representatives genomes."""
 
+        from genometreetk.representatives import Representatives
+
         check_file_exists(options.species_derep_file)
         check_file_exists(options.metadata_file)
         check_file_exists(options.prev_rep_file)
@@ -371,7 +463,7 @@ class OptionsParser():
         check_file_exists(options.mash_pairwise_file)
 
         try:
-            rep = Representatives()
+            rep = Representatives(options.cpus)
             rep.representatives(options.species_derep_file,
                                 options.metadata_file,
                                 options.prev_rep_file,
@@ -395,12 +487,14 @@ class OptionsParser():
     def cluster(self, options):
         """Cluster remaining genomes based on Mash distances."""
 
+        from genometreetk.representatives import Representatives
+
         check_file_exists(options.rep_genome_file)
         check_file_exists(options.metadata_file)
         check_file_exists(options.mash_pairwise_file)
 
         try:
-            rep = Representatives()
+            rep = Representatives(options.cpus)
             rep.cluster(options.rep_genome_file,
                         options.metadata_file,
                         options.mash_pairwise_file,
@@ -412,6 +506,28 @@ class OptionsParser():
             print(e.message)
             raise SystemExit
             
+    def sketch(self, options):
+        """Create MinHash sketches of genomes."""
+
+        from genometreetk.minhash import MinHashSketch
+
+        check_file_exists(options.genome_path_file)
+
+        minhash = MinHashSketch(options.cpus, options.kmer_size, options.num_bins)
+        minhash.sketch(options.genome_path_file, options.sketch_dir)
+
+    def sketch_dist(self, options):
+        """Calculate Mash distances between similar genomes from sketches."""
+
+        from genometreetk.minhash import MinHashSketch
+
+        if not os.path.isdir(options.sketch_dir):
+            self.logger.error('Sketch directory does not exist: %s' % options.sketch_dir)
+            sys.exit(-1)
+
+        minhash = MinHashSketch(options.cpus)
+        minhash.write_dists(options.sketch_dir, options.max_dist, options.output_file)
+
     def validate(self, options):
         """Check taxonomy file is formatted as expected."""
 
@@ -433,7 +549,10 @@ class OptionsParser():
         
     def check_tree(self, options):
         """Validate taxonomy of decorated tree and check for polyphyletic groups."""
-        
+
+        from biolib.newick import parse_label
+        from genometreetk.array_tree import ArrayTree, LCAIndex
+
         check_file_exists(options.decorated_tree)
 
         # validate taxonomy
@@ -453,81 +572,98 @@ class OptionsParser():
                           report_errors=True)
                           
         # check for polyphyletic groups
-        polyphyletic_groups = set()
-        tree = dendropy.Tree.get_from_path(options.decorated_tree, 
-                                                schema='newick', 
-                                                rooting="force-rooted", 
-                                                preserve_underscores=True)
+        polyphyletic_groups = {}
+        tree = ArrayTree.read(options.decorated_tree)
+        lca_index = LCAIndex(tree)
+        leaf_index = tree.leaf_index()
                                                 
         if options.taxonomy_file:
-            # reduce taxonomy to taxa in tree and map taxon labels to Taxon objects
+            # reduce taxonomy to taxa in tree
             reduced_taxonomy = {}
-            taxon_map = {}
-            for leaf in tree.leaf_node_iter():
-                reduced_taxonomy[leaf.taxon.label] = t[leaf.taxon.label]
-                taxon_map[leaf.taxon.label] = leaf.taxon
+            for taxon_id in leaf_index:
+                reduced_taxonomy[taxon_id] = t[taxon_id]
  
             # find taxa with an MRCA spanning additional taxa
             for rank_label in Taxonomy.rank_labels[1:]:
                 extant_taxa = taxonomy.extant_taxa_for_rank(rank_label, reduced_taxonomy)
                 for taxon, taxa_ids in extant_taxa.items():
-                    mrca = tree.mrca(taxa=[taxon_map[t] for t in taxa_ids])
-                    mrca_leaf_count = sum([1 for leaf in mrca.leaf_iter()])
-                    if mrca_leaf_count != len(taxa_ids):
-                        polyphyletic_groups.add(taxon)
+                    leaves = [leaf_index[taxon_id] for taxon_id in taxa_ids]
+                    if not lca_index.is_monophyletic(leaves):
+                        polyphyletic_groups[taxon] = lca_index.intruders(leaves)
         else:
             # find duplicate taxon labels in tree
-            taxa = set()
+            taxon_nodes = defaultdict(list)
             
-            for node in tree.preorder_node_iter(lambda n: not n.is_leaf()):
-                _support, taxon_label, _aux_info = parse_label(node.label)
+            for node in tree.internal_nodes():
+                _support, taxon_label, _aux_info = parse_label(tree.labels[node])
                 if taxon_label:
                     for taxon in [t.strip() for t in taxon_label.split(';')]:
-                        if taxon in taxa:
-                            polyphyletic_groups.add(taxon)
+                        taxon_nodes[taxon].append(node)
                         
-                        taxa.add(taxon)
+            for taxon, nodes in taxon_nodes.items():
+                if len(nodes) > 1:
+                    polyphyletic_groups[taxon] = lca_index.intruders(nodes)
+            
+            reduced_taxonomy = t
 
         if len(polyphyletic_groups):
             print('')
             print('Tree contains polyphyletic groups:')
-            for taxon in polyphyletic_groups:
-                print('%s' % (taxon))
+            for taxon, intruders in polyphyletic_groups.items():
+                # summarize taxa intruding into group at the rank of the group
+                rank_index = None
+                if taxon[0:3] in Taxonomy.rank_prefixes:
+                    rank_index = Taxonomy.rank_prefixes.index(taxon[0:3])
+                    
+                intruding_taxa = defaultdict(int)
+                for leaf in intruders:
+                    taxon_id = tree.labels[leaf]
+                    intruding_taxon = 'unclassified'
+                    if rank_index is not None and taxon_id in reduced_taxonomy:
+                        intruding_taxon = reduced_taxonomy[taxon_id][rank_index]
+                    intruding_taxa[intruding_taxon] += 1
+                    
+                intruding_str = ', '.join(['%s (%d)' % (intruding_taxon, count) 
+                                            for intruding_taxon, count in sorted(intruding_taxa.items(), 
+                                                                                    key=lambda x: -x[1])])
+                print('%s\tintruding taxa: %s' % (taxon, intruding_str if intruding_str else 'None'))
                           
         self.logger.info('Finished performing validation tests.')
 
     def fill_ranks(self, options):
         """Ensure taxonomy strings contain all 7 canonical ranks."""
 
+        from genometreetk.taxonomy_stream import TaxonomyStream
+
         check_file_exists(options.input_taxonomy)
 
-        fout = open(options.output_taxonomy, 'w')
         taxonomy = Taxonomy()
-        t = taxonomy.read(options.input_taxonomy)
 
-        for genome_id, taxon_list in t.items():
+        def fill(genome_id, taxon_list):
             full_taxon_list = taxonomy.fill_missing_ranks(taxon_list)
 
             taxonomy_str = ';'.join(full_taxon_list)
             if not taxonomy.check_full(taxonomy_str):
                 sys.exit(-1)
 
-            fout.write('%s\t%s\n' % (genome_id, taxonomy_str))
+            return full_taxon_list
 
-        fout.close()
+        TaxonomyStream().transform(options.input_taxonomy,
+                                    options.output_taxonomy,
+                                    fill)
 
         self.logger.info('Revised taxonomy written to: %s' % options.output_taxonomy)
 
     def binomial(self, options):
         """Ensure species are designated using binomial nomenclature."""
 
+        from genometreetk.taxonomy_stream import TaxonomyStream
+
         check_file_exists(options.input_taxonomy)
 
-        fout = open(options.output_taxonomy, 'w')
         taxonomy = Taxonomy()
-        t = taxonomy.read(options.input_taxonomy)
 
-        for genome_id, taxon_list in t.items():
+        def binomial(genome_id, taxon_list):
             taxonomy_str = ';'.join(taxon_list)
             if not taxonomy.check_full(taxonomy_str):
                 sys.exit(-1)
@@ -536,132 +672,52 @@ class OptionsParser():
             species = taxon_list[6][3:]
             if species and genus not in species:
                 taxon_list[6] = 's__' + genus + ' ' + species
-                taxonomy_str = ';'.join(taxon_list)
 
-            fout.write('%s\t%s\n' % (genome_id, taxonomy_str))
-
-        fout.close()
+            return taxon_list
 
+        TaxonomyStream().transform(options.input_taxonomy,
+                                    options.output_taxonomy,
+                                    binomial)
 
         self.logger.info('Revised taxonomy written to: %s' % options.output_taxonomy)
 
     def propagate(self, options):
         """Propagate labels to all genomes in a cluster."""
 
+        from genometreetk.cluster_propagation import ClusterPropagation
+
         check_file_exists(options.input_taxonomy)
         check_file_exists(options.metadata_file)
 
-        # get representative genome information
-        rep_metadata = read_gtdb_metadata(options.metadata_file, ['gtdb_representative',
-                                                                  'gtdb_clustered_genomes'])
-                                                                  
-        taxonomy = Taxonomy()
-        explict_tax = taxonomy.read(options.input_taxonomy)
-        expanded_taxonomy = {}
-        incongruent_count = 0
-        for genome_id, taxon_list in explict_tax.items():
-            taxonomy_str = ';'.join(taxon_list)
-
-            # Propagate taxonomy strings if genome is a representatives. Also, determine
-            # if genomes clustered together have compatible taxonomies. Note that a genome
-            # may not have metadata as it is possible a User has removed a genome that is
-            # in the provided taxonomy file.
-            _rep_genome, clustered_genomes = rep_metadata.get(genome_id, (None, None))
-            if clustered_genomes:  # genome is a representative
-                clustered_genome_ids = clustered_genomes.split(';')
-
-                # get taxonomy of all genomes in cluster with a specified taxonomy
-                clustered_genome_tax = {}
-                for cluster_genome_id in clustered_genome_ids:
-                    if cluster_genome_id == genome_id:
-                        continue
-
-                    if cluster_genome_id not in rep_metadata:
-                        continue  # genome is no longer in the GTDB so ignore it
-
-                    if cluster_genome_id in explict_tax:
-                        clustered_genome_tax[cluster_genome_id] = explict_tax[cluster_genome_id]
-
-                # determine if representative and clustered genome taxonomy strings are congruent
-                working_cluster_taxonomy = list(taxon_list)
-                incongruent_with_rep = False
-                for cluster_genome_id, cluster_tax in clustered_genome_tax.items():
-                    if incongruent_with_rep:
-                        working_cluster_taxonomy = list(taxon_list)  # default to rep taxonomy
-                        break
-
-                    for r in range(0, len(Taxonomy.rank_prefixes)):
-                        if cluster_tax[r] == Taxonomy.rank_prefixes[r]:
-                            break  # no more taxonomy information to consider
-
-                        if cluster_tax[r] != taxon_list[r]:
-                            if taxon_list[r] == Taxonomy.rank_prefixes[r]:
-                                # clustered genome has a more specific taxonomy string which
-                                # should be propagate to the representative if all clustered
-                                # genomes are in agreement
-                                if working_cluster_taxonomy[r] == Taxonomy.rank_prefixes[r]:
-                                    # make taxonomy more specific based on genomes in cluster
-                                    working_cluster_taxonomy[r] = cluster_tax[r]
-                                elif working_cluster_taxonomy[r] != cluster_tax[r]:
-                                    # not all genomes agree on the assignment of this rank so leave it unspecified
-                                    working_cluster_taxonomy[r] = Taxonomy.rank_prefixes[r]
-                                    break
-                            else:
-                                # genomes in cluster have incongruent taxonomies so defer to representative
-                                self.logger.warning("Genomes in cluster have incongruent taxonomies.")
-                                self.logger.warning("Representative %s: %s" % (genome_id, taxonomy_str))
-                                self.logger.warning("Clustered genome %s: %s" % (cluster_genome_id, ';'.join(cluster_tax)))
-                                self.logger.warning("Deferring to taxonomy specified for representative.")
-
-                                incongruent_count += 1
-                                incongruent_with_rep = True
-                                break
-
-                cluster_taxonomy_str = ';'.join(working_cluster_taxonomy)
-
-                # assign taxonomy to representative and all genomes in the cluster
-                expanded_taxonomy[genome_id] = cluster_taxonomy_str
-                for cluster_genome_id in clustered_genome_ids:
-                    expanded_taxonomy[cluster_genome_id] = cluster_taxonomy_str
-            else:
-                if genome_id in expanded_taxonomy:
-                    # genome has already been assigned a taxonomy based on its representative
-                    pass
-                else:
-                    # genome is a singleton
-                    expanded_taxonomy[genome_id] = taxonomy_str
-
+        incongruence_file = options.incongruence_file
+        if not incongruence_file:
+            incongruence_file = options.output_taxonomy + '.incongruent.tsv'
 
-        self.logger.info('Identified %d clusters with incongruent taxonomies.' % incongruent_count)
-
-        fout = open(options.output_taxonomy, 'w')
-        for genome_id, taxonomy_str in expanded_taxonomy.items():
-            fout.write('%s\t%s\n' % (genome_id, taxonomy_str))
-        fout.close()
+        cluster_propagation = ClusterPropagation(options.cpus)
+        cluster_propagation.run(options.input_taxonomy,
+                                options.metadata_file,
+                                options.output_taxonomy,
+                                incongruence_file)
 
         self.logger.info('Taxonomy written to: %s' % options.output_taxonomy)
 
     def strip(self, options):
         """Remove taxonomic labels from tree."""
 
+        from genometreetk.array_tree import ArrayTree
+
         check_file_exists(options.input_tree)
 
-        outgroup_in_tree = set()
-        tree = dendropy.Tree.get_from_path(options.input_tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree = ArrayTree.read(options.input_tree)
 
         for node in tree.internal_nodes():
-            if node.label:
-                if ':' in node.label:
-                    support, _taxa = node.label.split(':')
-                    node.label = support
+            label = tree.labels[node]
+            if label:
+                if ':' in label:
+                    support, _taxa = label.split(':')
+                    tree.labels[node] = support
 
-        tree.write_to_path(options.output_tree,
-                            schema='newick',
-                            suppress_rooting=True,
-                            unquoted_underscores=True)
+        tree.write(options.output_tree)
 
         self.logger.info('Stripped tree written to: %s' % options.output_tree)
         
@@ -678,25 +734,25 @@ class OptionsParser():
     def diff(self, options):
         """Compare two taxonomy files."""
 
+        from genometreetk.taxonomy_stream import TaxonomyStream
+
         check_file_exists(options.input_taxonomy1)
         check_file_exists(options.input_taxonomy2)
 
-        taxonomy1 = Taxonomy().read(options.input_taxonomy1)
-        taxonomy2 = Taxonomy().read(options.input_taxonomy2)
-
-        all_taxon_ids = set(taxonomy1.keys()).union(list(taxonomy2.keys()))
+        taxonomy_stream = TaxonomyStream(tmp_dir=options.tmp_dir)
 
         rank_index = Taxonomy.rank_labels.index(options.rank)
-        for taxon_id in all_taxon_ids:
+        for taxon_id, taxa1, taxa2 in taxonomy_stream.join(options.input_taxonomy1,
+                                                            options.input_taxonomy2):
             if options.report_missing_taxa:
-                if taxon_id not in taxonomy1:
+                if taxa1 is None:
                     print('Missing in taxonomy 1: %s' % taxon_id)
-                elif taxon_id not in taxonomy2:
+                elif taxa2 is None:
                     print('Missing in taxonomy 2: %s' % taxon_id)
 
-            if taxon_id in taxonomy1 and taxon_id in taxonomy2:
-                taxon1 = taxonomy1[taxon_id][rank_index]
-                taxon2 = taxonomy2[taxon_id][rank_index]
+            if taxa1 is not None and taxa2 is not None:
+                taxon1 = taxa1[rank_index]
+                taxon2 = taxa2[rank_index]
 
                 if taxon1 != taxon2:
                     if options.report_missing_ranks or (taxon1[3:] and taxon2[3:]):
@@ -706,7 +762,9 @@ class OptionsParser():
         
     def phylogenetic_diversity(self, options):
         """Calculate phylogenetic diversity of extant taxa."""
-        
+
+        from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
         check_file_exists(options.tree)
         check_file_exists(options.taxa_list)
         
@@ -742,9 +800,60 @@ class OptionsParser():
                                             in_pg, 
                                             in_pg * 100 / total_pd))
               
+    def phylogenetic_diversity_batch(self, options):
+        """Calculate phylogenetic diversity for many taxa lists."""
+
+        from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
+        check_file_exists(options.tree)
+        check_file_exists(options.manifest_file)
+        make_sure_path_exists(options.output_dir)
+        
+        pd = PhylogeneticDiversity(options.cpus)
+        pd_file, pd_clade_file = pd.pd_batch(options.tree, options.manifest_file, options.output_dir)
+        
+        self.logger.info('PD of each taxa list written to: %s' % pd_file)
+        if pd_clade_file:
+            self.logger.info('PD of named clades for each taxa list written to: %s' % pd_clade_file)
+              
+    def phylogenetic_diversity_rarefaction(self, options):
+        """Calculate expected phylogenetic diversity of random subsamples of taxa."""
+
+        from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
+        check_file_exists(options.tree)
+        if options.taxa_list:
+            check_file_exists(options.taxa_list)
+            
+        if options.confidence <= 0 or options.confidence >= 100:
+            self.logger.error('Confidence must be between 0 and 100.')
+            sys.exit(-1)
+
+        if options.num_sizes < 1:
+            self.logger.error('At least 1 subsample size must be evaluated.')
+            sys.exit(-1)
+
+        if options.replicates < 1:
+            self.logger.error('At least 1 replicate must be drawn at each subsample size.')
+            sys.exit(-1)
+        
+        pd = PhylogeneticDiversity(options.cpus)
+        total_pd, num_taxa = pd.pd_rarefaction(options.tree, 
+                                                options.output_file, 
+                                                options.taxa_list,
+                                                options.clade,
+                                                options.num_sizes,
+                                                options.replicates,
+                                                options.confidence,
+                                                options.seed)
+        
+        self.logger.info('Rarefied PD for %d taxa with a total PD of %.2f written to: %s' % (num_taxa, total_pd, options.output_file))
+              
     def ani(self, options):
         """Calculate the ANI value of named species."""
 
+        from genometreetk.ani import ANI
+
         check_file_exists(options.input_taxonomy)
         check_file_exists(options.metadata_file)
         make_sure_path_exists(options.output_dir)
@@ -761,11 +870,14 @@ class OptionsParser():
                 options.min_N50, 
                 options.max_ambiguous, 
                 options.max_gap_length, 
-                options.output_dir)
+                options.output_dir,
+                options.cache_file)
     
     def phylogenetic_diversity_clade(self, options):
         """Calculate phylogenetic diversity of named groups."""
 
+        from genometreetk.phylogenetic_diversity import PhylogeneticDiversity
+
         check_file_exists(options.decorated_tree)
         
         pd = PhylogeneticDiversity()
@@ -775,70 +887,95 @@ class OptionsParser():
     def arb_records(self, options):
         """Create an ARB records file from GTDB metadata."""
 
+        from genometreetk.arb import Arb
+
         check_file_exists(options.metadata_file)
         
         arb = Arb()
-        arb.create_records(options.metadata_file, options.msa_file, options.genome_list, options.output_file)
+        output_files = arb.create_records(options.metadata_file,
+                                            options.msa_file,
+                                            options.genome_list,
+                                            options.output_file,
+                                            options.shards,
+                                            options.cpus)
+
+        self.logger.info('ARB records written to: %s' % ', '.join(output_files))
 
     def parse_options(self, options):
         """Parse user options and call the correct pipeline(s)"""
 
         logging.basicConfig(format='', level=logging.INFO)
 
-        check_dependencies(('FastTree', 'hmmsearch'))
-
-        if options.subparser_name == 'ssu_tree':
-            self.ssu_tree(options)
-        elif options.subparser_name == 'lsu_tree':
-            self.lsu_tree(options)
-        elif options.subparser_name == 'rna_tree':
-            self.rna_tree(options)
-        elif options.subparser_name == 'derep_tree':
-            self.derep_tree(options)
-        elif options.subparser_name == 'bootstrap':
-            self.bootstrap(options)
-        elif options.subparser_name == 'jk_markers':
-            self.jk_markers(options)
-        elif options.subparser_name == 'jk_taxa':
-            self.jk_taxa(options)
-        elif options.subparser_name == 'combine':
-            self.combine(options)
-        elif options.subparser_name == 'midpoint':
-            self.midpoint(options)
-        elif options.subparser_name == 'outgroup':
-            self.outgroup(options)
-        elif options.subparser_name == 'dereplicate':
-            self.dereplicate(options)
-        elif options.subparser_name == 'reps':
-            self.representatives(options)
-        elif options.subparser_name == 'cluster':
-            self.cluster(options)
-        elif options.subparser_name == 'validate':
-            self.validate(options)
-        elif(options.subparser_name == 'check_tree'):
-            self.check_tree(options)
-        elif options.subparser_name == 'binomial':
-            self.binomial(options)
-        elif options.subparser_name == 'propagate':
-            self.propagate(options)
-        elif options.subparser_name == 'fill_ranks':
-            self.fill_ranks(options)
-        elif options.subparser_name == 'strip':
-            self.strip(options)
-        elif options.subparser_name == 'pull':
-            self.pull(options)
-        elif options.subparser_name == 'diff':
-            self.diff(options)
-        elif options.subparser_name == 'ani':
-            self.ani(options)
-        elif options.subparser_name == 'pd':
-            self.phylogenetic_diversity(options)
-        elif options.subparser_name == 'pd_clade':
-            self.phylogenetic_diversity_clade(options)
-        elif options.subparser_name == 'arb_records':
-            self.arb_records(options)
-        else:
-            self.logger.error('  [Error] Unknown GenomeTreeTk command: ' + options.subparser_name + '\n')
-            sys.exit()
+        if getattr(options, 'profile', None):
+            profiler.open(options.profile)
+
+        with profiler.stage(options.subparser_name):
+            if options.subparser_name == 'ssu_tree':
+                self.ssu_tree(options)
+            elif options.subparser_name == 'lsu_tree':
+                self.lsu_tree(options)
+            elif options.subparser_name == 'rna_tree':
+                self.rna_tree(options)
+            elif options.subparser_name == 'derep_tree':
+                self.derep_tree(options)
+            elif options.subparser_name == 'derep_tree_batch':
+                self.derep_tree_batch(options)
+            elif options.subparser_name == 'bootstrap':
+                self.bootstrap(options)
+            elif options.subparser_name == 'jk_markers':
+                self.jk_markers(options)
+            elif options.subparser_name == 'jk_taxa':
+                self.jk_taxa(options)
+            elif options.subparser_name == 'combine':
+                self.combine(options)
+            elif options.subparser_name == 'gene_tree_dist':
+                self.gene_tree_dist(options)
+            elif options.subparser_name == 'midpoint':
+                self.midpoint(options)
+            elif options.subparser_name == 'outgroup':
+                self.outgroup(options)
+            elif options.subparser_name == 'outgroup_batch':
+                self.outgroup_batch(options)
+            elif options.subparser_name == 'dereplicate':
+                self.dereplicate(options)
+            elif options.subparser_name == 'reps':
+                self.representatives(options)
+            elif options.subparser_name == 'cluster':
+                self.cluster(options)
+            elif options.subparser_name == 'sketch':
+                self.sketch(options)
+            elif options.subparser_name == 'sketch_dist':
+                self.sketch_dist(options)
+            elif options.subparser_name == 'validate':
+                self.validate(options)
+            elif(options.subparser_name == 'check_tree'):
+                self.check_tree(options)
+            elif options.subparser_name == 'binomial':
+                self.binomial(options)
+            elif options.subparser_name == 'propagate':
+                self.propagate(options)
+            elif options.subparser_name == 'fill_ranks':
+                self.fill_ranks(options)
+            elif options.subparser_name == 'strip':
+                self.strip(options)
+            elif options.subparser_name == 'pull':
+                self.pull(options)
+            elif options.subparser_name == 'diff':
+                self.diff(options)
+            elif options.subparser_name == 'ani':
+                self.ani(options)
+            elif options.subparser_name == 'pd':
+                self.phylogenetic_diversity(options)
+            elif options.subparser_name == 'pd_clade':
+                self.phylogenetic_diversity_clade(options)
+            elif options.subparser_name == 'pd_batch':
+                self.phylogenetic_diversity_batch(options)
+            elif options.subparser_name == 'pd_rarefaction':
+                self.phylogenetic_diversity_rarefaction(options)
+            elif options.subparser_name == 'arb_records':
+                self.arb_records(options)
+            else:
+                self.logger.error('  [Error] Unknown GenomeTreeTk command: ' + options.subparser_name + '\n')
+                sys.exit()
 
         return 0
@@ -23,6 +23,8 @@ from biolib.external.hmmer import HmmModelParser
 
 from genometreetk.markers.infer_markers import InferMarkers
 from genometreetk.markers.lgt_test import LgtTest
+from genometreetk.checkpoint import Checkpoint
+from genometreetk.profiler import profiler
 
 
 class MarkerWorkflow(object):
@@ -143,18 +145,31 @@ class MarkerWorkflow(object):
                 marker = line_split[0]
                 valid_marker_genes.add(marker)
 
+        # stages are skipped on rerun if their inputs, parameters and outputs are unchanged
+        checkpoint = Checkpoint(os.path.join(output_dir, 'checkpoints'))
+
         # identify genes suitable for phylogenetic inference
         self.logger.info('Identifying genes suitable for phylogenetic inference.')
         infer_markers = InferMarkers(self.genome_dir_file,
                                     self.pfam_model_file,
                                     self.tigrfams_model_dir,
                                     self.cpus)
-        results = infer_markers.identify_marker_genes(ingroup_file,
-                                                        ubiquity, single_copy, redundancy,
-                                                        valid_marker_genes,
-                                                        alignment_dir, model_dir)
+        results = checkpoint.run('identify_markers',
+                                    infer_markers.identify_marker_genes,
+                                    args=(ingroup_file,
+                                            ubiquity, single_copy, redundancy,
+                                            valid_marker_genes,
+                                            alignment_dir, model_dir),
+                                    inputs=[ingroup_file, self.genome_dir_file, self.pfam_model_file],
+                                    params={'tigrfams_model_dir': self.tigrfams_model_dir,
+                                            'ubiquity': ubiquity,
+                                            'single_copy': single_copy,
+                                            'redundancy': redundancy,
+                                            'valid_marker_genes': valid_marker_genes},
+                                    outputs=[alignment_dir, model_dir])
         num_ingroup_genomes, num_ncbi_genome, num_user_genomes, trusted_genome_ids, marker_gene_stats, marker_genes = results
         self.logger.info('Identified %s ubiquitous, single-copy marker genes.' % len(marker_genes))
+        profiler.count('markers', len(marker_genes))
 
         # gather all ubiquitous, single-copy HMMs into a single model file
         hmm_model_out = os.path.join(output_dir, 'marker_putative.hmm')
@@ -163,20 +178,33 @@ class MarkerWorkflow(object):
 
         # infer gene trees
         self.logger.info('Inferring gene trees.')
-        infer_markers.infer_gene_trees(alignment_dir, gene_tree_dir, '.aln.masked.faa')
+        checkpoint.run('gene_trees',
+                        infer_markers.infer_gene_trees,
+                        args=(alignment_dir, gene_tree_dir, '.aln.masked.faa'),
+                        inputs=[alignment_dir],
+                        outputs=[gene_tree_dir])
 
         # identify gene trees which fail to reproduce the majority
         # of well-supported splits in a jackknifed genome tree
         lgt_test = LgtTest(self.cpus)
-        results = lgt_test.run(trusted_genome_ids,
-                               marker_genes,
-                               hmm_model_out,
-                               min_support,
-                               min_per_taxa,
-                               perc_markers_to_jackknife,
-                               gene_tree_dir,
-                               alignment_dir,
-                               output_dir)
+        results = checkpoint.run('lgt_test',
+                                    lgt_test.run,
+                                    args=(trusted_genome_ids,
+                                           marker_genes,
+                                           hmm_model_out,
+                                           min_support,
+                                           min_per_taxa,
+                                           perc_markers_to_jackknife,
+                                           gene_tree_dir,
+                                           alignment_dir,
+                                           output_dir),
+                                    inputs=[hmm_model_out, gene_tree_dir, alignment_dir],
+                                    params={'trusted_genome_ids': trusted_genome_ids,
+                                            'marker_genes': marker_genes,
+                                            'min_support': min_support,
+                                            'min_per_taxa': min_per_taxa,
+                                            'perc_markers_to_jackknife': perc_markers_to_jackknife},
+                                    outputs=[os.path.join(output_dir, 'jackknife_markers')])
         distances, num_internal_nodes, well_supported_nodes, well_supported_internal_nodes = results
 
         # write out metadata regarding putative marker genes
@@ -227,6 +255,7 @@ class MarkerWorkflow(object):
         fout.write('Number of well-supported, internal nodes: %d\n' % well_supported_internal_nodes)
         fout.write('')
         fout.write('Putative marker genes: %d\n' % len(marker_genes))
+        checkpoint.write_summary(fout)
         fout.close()
 
         return hmm_model_out
@@ -16,8 +16,6 @@
 ###############################################################################
 
 import os
-import sys
-import multiprocessing as mp
 import logging
 from collections import defaultdict
 
@@ -25,6 +23,7 @@ import biolib.seq_io as seq_io
 from biolib.external.hmmer import HMMER
 
 from genometreetk.default_values import DefaultValues
+from genometreetk.parallel import Parallel
 
 
 class AlignMarkers(object):
@@ -98,94 +97,52 @@ class AlignMarkers(object):
 
         return genes_in_genome
 
-    def _run_hmm_align(self, genome_ids,
-                                genome_dirs,
-                                genes_in_genomes,
-                                ignore_multi_copy,
-                                output_msa_dir,
-                                output_model_dir,
-                                queue_in,
-                                queue_out):
-        """Run each marker gene in a separate thread.
+    def _hmm_align_producer(self, marker_id):
+        """Align genes for a single marker with HMMER.
 
         Only the gene with the highest bitscore is used for genomes with
         multiple hits to a given protein family.
 
         Parameters
         ----------
-        genome_ids : iterable
-            Genomes of interest.
-        genome_dirs : d[assembly_accession] -> directory
-            Path to files for individual genomes.
-        genes_in_genomes : d[genome_id][family_id] -> [(gene_id_1, bitscore), ..., (gene_id_N, bitscore)]
-            Genes within each genome.
-        ignore_multi_copy : bool
-            Flag indicating if genes with multiple hits should be ignored (True) or the gene with the highest bitscore taken (False).
-        output_msa_dir : str
-            Output directory for multiple sequence alignment.
-        output_model_dir : str
-            Output directory for HMMs.
-        queue_in : Queue
-            Input queue for parallel processing.
-        queue_out : Queue
-            Output queue for parallel processing.
+        marker_id : str
+            Unique id of marker gene.
         """
 
-        while True:
-            marker_id = queue_in.get(block=True, timeout=None)
-            if marker_id == None:
-                break
-
-            marker_seq_file = os.path.join(output_msa_dir, marker_id + '.faa')
-            fout = open(marker_seq_file, 'w')
-            for genome_id in genome_ids:
-                genome_dir = genome_dirs[genome_id]
-
-                assembly = genome_dir[genome_dir.rfind('/') + 1:]
-                genes_file = os.path.join(genome_dir, assembly + self.protein_file_ext)
-                seqs = seq_io.read_fasta(genes_file)
-
-                hits = genes_in_genomes[genome_id].get(marker_id, None)
-                if not hits or (ignore_multi_copy and len(hits) > 1):
-                    continue
-
-                # get gene with highest bitscore
-                hits.sort(key=lambda x: x[1], reverse=True)
-                gene_id, _bitscore = hits[0]
+        marker_seq_file = os.path.join(self.output_msa_dir, marker_id + '.faa')
+        fout = open(marker_seq_file, 'w')
+        for genome_id in self.genome_ids:
+            genome_dir = self.genome_dirs[genome_id]
 
-                fout.write('>' + genome_id + DefaultValues.SEQ_CONCAT_CHAR + gene_id + '\n')
-                fout.write(seqs[gene_id] + '\n')
-            fout.close()
+            assembly = genome_dir[genome_dir.rfind('/') + 1:]
+            genes_file = os.path.join(genome_dir, assembly + self.protein_file_ext)
+            seqs = seq_io.read_fasta(genes_file)
 
-            hmmer = HMMER('align')
-            hmmer.align(os.path.join(output_model_dir, marker_id + '.hmm'), marker_seq_file, os.path.join(output_msa_dir, marker_id + '.aln.faa'), trim=False, outputFormat='Pfam')
-            self._mask_alignment(os.path.join(output_msa_dir, marker_id + '.aln.faa'), os.path.join(output_msa_dir, marker_id + '.aln.masked.faa'))
+            hits = self.genes_in_genomes[genome_id].get(marker_id, None)
+            if not hits or (self.ignore_multi_copy and len(hits) > 1):
+                continue
 
-            queue_out.put(marker_id)
+            # get gene with highest bitscore
+            hits.sort(key=lambda x: x[1], reverse=True)
+            gene_id, _bitscore = hits[0]
 
-    def _report_threads(self, num_genes, writer_queue):
-        """Report progress of parallel processing.
+            # remove trailing stop codon so alignments can be used directly by FastTree
+            fout.write('>' + genome_id + DefaultValues.SEQ_CONCAT_CHAR + gene_id + '\n')
+            fout.write(seqs[gene_id].rstrip('*') + '\n')
+        fout.close()
 
-        Parameters
-        ----------
-        num_genes : int
-            Number of genes being processed.
-        writer_queue : Queue
-            Output queue for parallel processing.
-        """
+        hmmer = HMMER('align')
+        hmmer.align(os.path.join(self.output_model_dir, marker_id + '.hmm'), marker_seq_file, os.path.join(self.output_msa_dir, marker_id + '.aln.faa'), trim=False, outputFormat='Pfam')
+        self._mask_alignment(os.path.join(self.output_msa_dir, marker_id + '.aln.faa'), os.path.join(self.output_msa_dir, marker_id + '.aln.masked.faa'))
 
-        num_processed_genes = 0
-        while True:
-            marker_id = writer_queue.get(block=True, timeout=None)
-            if marker_id == None:
-                break
+        return marker_id
 
-            num_processed_genes += 1
-            statusStr = '==> Finished processing %d of %d (%.2f%%) marker genes.' % (num_processed_genes, num_genes, float(num_processed_genes) * 100 / num_genes)
-            sys.stdout.write('%s\r' % statusStr)
-            sys.stdout.flush()
+    def _hmm_align_progress(self, processed_items, total_items):
+        """Report progress of marker gene alignment."""
 
-        sys.stdout.write('\n')
+        return '==> Finished processing %d of %d (%.2f%%) marker genes.' % (processed_items,
+                                                                            total_items,
+                                                                            float(processed_items) * 100 / total_items)
 
     def _mask_alignment(self, input_file, output_file):
         """Read HMMER alignment in STOCKHOLM format and output masked alignment in FASTA format.
@@ -211,11 +168,12 @@ class AlignMarkers(object):
                 seqs[line_split[0]] = line_split[1].upper().replace('.', '-').strip()
 
         # output masked sequences in FASTA format
+        mask_cols = [i for i, ch in enumerate(mask) if ch == 'x']
         fout = open(output_file, 'w')
         for seq_id, seq in seqs.items():
             fout.write('>' + seq_id + '\n')
 
-            masked_seq = ''.join([seq[i] for i in range(0, len(seq)) if mask[i] == 'x'])
+            masked_seq = ''.join([seq[i] for i in mask_cols])
             fout.write(masked_seq + '\n')
         fout.close()
 
@@ -244,38 +202,12 @@ class AlignMarkers(object):
 
         # align marker genes
         self.logger.info('Aligning marker genes:')
-        worker_queue = mp.Queue()
-        writer_queue = mp.Queue()
-
-        for _, marker_id in enumerate(marker_genes):
-            worker_queue.put(marker_id)
-
-        for _ in range(self.cpus):
-            worker_queue.put(None)
-
-        try:
-            calc_proc = [mp.Process(target=self._run_hmm_align, args=(genome_ids,
-                                                                      genome_dirs,
-                                                                      genes_in_genomes,
-                                                                      ignore_multi_copy,
-                                                                      output_msa_dir,
-                                                                      output_model_dir,
-                                                                      worker_queue,
-                                                                      writer_queue)) for _ in range(self.cpus)]
-            write_proc = mp.Process(target=self._report_threads, args=(len(marker_genes), writer_queue))
-
-            write_proc.start()
-
-            for p in calc_proc:
-                p.start()
-
-            for p in calc_proc:
-                p.join()
-
-            writer_queue.put(None)
-            write_proc.join()
-        except:
-            for p in calc_proc:
-                p.terminate()
-
-            write_proc.terminate()
+        self.genome_ids = genome_ids
+        self.genome_dirs = genome_dirs
+        self.genes_in_genomes = genes_in_genomes
+        self.ignore_multi_copy = ignore_multi_copy
+        self.output_msa_dir = output_msa_dir
+        self.output_model_dir = output_model_dir
+
+        parallel = Parallel(self.cpus)
+        parallel.run(self._hmm_align_producer, None, marker_genes, self._hmm_align_progress)
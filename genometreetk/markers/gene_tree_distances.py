@@ -0,0 +1,221 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import logging
+
+import numpy as np
+
+from biolib.common import make_sure_path_exists
+
+from genometreetk.default_values import DefaultValues
+from genometreetk.exceptions import GenomeTreeTkError
+from genometreetk.array_tree import ArrayTree
+from genometreetk.bipartitions import HashedSplits, split_distances
+from genometreetk.profiler import profiler
+from genometreetk.parallel import Parallel
+
+
+class GeneTreeDistances(object):
+    """Calculate distances between all pairs of gene trees.
+
+    Gene trees are compared over the genomes they have in common.
+    Leaves are expected to be labelled as <genome_id>|<gene_id> as
+    produced when inferring gene trees, and only the first gene
+    from a genome is retained in each tree. The Robinson-Foulds,
+    weighted Robinson-Foulds, and Felsenstein's Euclidean distance
+    are reported for each pair of trees.
+    """
+
+    def __init__(self, cpus=1):
+        """Initialize.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.cpus = cpus
+
+    def _read_gene_tree(self, gene_tree_file, namespace):
+        """Read gene tree with a single leaf per genome.
+
+        Parameters
+        ----------
+        gene_tree_file : str
+            File containing gene tree in Newick format.
+        namespace : d[genome_id] -> taxon index
+            Index assigned to each genome, extended with new genomes.
+
+        Returns
+        -------
+        HashedSplits
+            Bipartitions of gene tree.
+        """
+
+        tree = ArrayTree.read(gene_tree_file)
+
+        genome_ids = set()
+        leaves_to_retain = []
+        for leaf in tree.leaves():
+            genome_id = tree.labels[leaf].split(DefaultValues.SEQ_CONCAT_CHAR)[0]
+            if genome_id not in genome_ids:
+                leaves_to_retain.append(leaf)
+                tree.labels[leaf] = genome_id
+                genome_ids.add(genome_id)
+
+                if genome_id not in namespace:
+                    namespace[genome_id] = len(namespace)
+
+        if len(leaves_to_retain) != len(tree.leaves()):
+            tree = tree.retain_leaves(leaves_to_retain)
+
+        return HashedSplits(tree, namespace)
+
+    def _distance_producer(self, tree_index):
+        """Calculate distances between a gene tree and all subsequent gene trees.
+
+        Gene trees and taxon keys are set on the instance before
+        processing so they are shared with each worker process.
+
+        Parameters
+        ----------
+        tree_index : int
+            Index of gene tree.
+        """
+
+        splits1 = self.gene_tree_splits[tree_index]
+
+        results = []
+        for j in range(tree_index + 1, len(self.gene_tree_splits)):
+            splits2 = self.gene_tree_splits[j]
+
+            shared_taxa = np.intersect1d(splits1.taxa, splits2.taxa, assume_unique=True)
+            num_shared = len(shared_taxa)
+            if num_shared < 4:
+                # distances are not informative for fewer than 4 taxa
+                results.append((j, num_shared, np.nan, np.nan, np.nan))
+                continue
+
+            rf, weighted_rf, euclidean = split_distances(splits1.project(self.taxon_keys, shared_taxa),
+                                                            splits2.project(self.taxon_keys, shared_taxa),
+                                                            self.scale)
+            results.append((j, num_shared, rf, weighted_rf, euclidean))
+
+        return (tree_index, results)
+
+    def _distance_consumer(self, produced_data, consumer_data):
+        """Collect distances between pairs of gene trees."""
+
+        if consumer_data == None:
+            num_trees = len(self.gene_tree_splits)
+            consumer_data = {'shared_taxa': np.zeros((num_trees, num_trees), dtype=np.int32),
+                                'rf': np.zeros((num_trees, num_trees)),
+                                'weighted_rf': np.zeros((num_trees, num_trees)),
+                                'euclidean': np.zeros((num_trees, num_trees))}
+            for i, splits in enumerate(self.gene_tree_splits):
+                consumer_data['shared_taxa'][i, i] = len(splits.taxa)
+
+        i, results = produced_data
+        for j, num_shared, rf, weighted_rf, euclidean in results:
+            for key, value in (('shared_taxa', num_shared),
+                                ('rf', rf),
+                                ('weighted_rf', weighted_rf),
+                                ('euclidean', euclidean)):
+                consumer_data[key][i, j] = value
+                consumer_data[key][j, i] = value
+
+        return consumer_data
+
+    def _distance_progress(self, processed_items, total_items):
+        """Report progress of distance calculations."""
+
+        return '==> Processed %d of %d (%.2f%%) gene trees.' % (processed_items, total_items, processed_items * 100.0 / total_items)
+
+    def run(self, gene_tree_dir, output_dir, extension='.tree', scale=True):
+        """Calculate distances between all pairs of gene trees.
+
+        Parameters
+        ----------
+        gene_tree_dir : str
+            Directory containing gene trees.
+        output_dir : str
+            Output directory.
+        extension : str
+            Extension of files containing gene trees.
+        scale : bool
+            Scale edge lengths of each tree to sum to 1.
+        """
+
+        gene_tree_files = []
+        for f in sorted(os.listdir(gene_tree_dir)):
+            if f.endswith(extension) and not f.endswith('.genome_ids' + extension):
+                gene_tree_files.append(f)
+
+        if len(gene_tree_files) < 2:
+            raise GenomeTreeTkError('At least two gene trees with the extension %s are required.' % extension)
+
+        self.logger.info('Reading %d gene trees.' % len(gene_tree_files))
+        namespace = {}
+        self.gene_tree_splits = []
+        names = []
+        for f in gene_tree_files:
+            self.gene_tree_splits.append(self._read_gene_tree(os.path.join(gene_tree_dir, f), namespace))
+            names.append(f[0:-len(extension)])
+
+        # fixed seed so bipartition hashes are reproducible
+        rs = np.random.RandomState(1)
+        self.taxon_keys = np.frombuffer(rs.bytes(8 * len(namespace)), dtype=np.uint64)
+        self.scale = scale
+
+        self.logger.info('Calculating distances between %d pairs of gene trees.' % (len(names) * (len(names) - 1) / 2))
+        profiler.count('gene_trees', len(names))
+        profiler.count('pairs', len(names) * (len(names) - 1) // 2)
+        parallel = Parallel(self.cpus)
+        distances = parallel.run(self._distance_producer,
+                                    self._distance_consumer,
+                                    range(len(names) - 1),
+                                    self._distance_progress)
+
+        # write out results
+        make_sure_path_exists(output_dir)
+
+        matrix_file = os.path.join(output_dir, 'gene_tree_distances.npz')
+        np.savez_compressed(matrix_file, names=np.array(names), **distances)
+
+        table_file = os.path.join(output_dir, 'gene_tree_distances.tsv')
+        fout = open(table_file, 'w')
+        fout.write('Tree 1\tTree 2\tShared taxa\tRF\tNormalized RF\tWeighted RF\tEuclidean\n')
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                num_shared = distances['shared_taxa'][i, j]
+                rf = distances['rf'][i, j]
+                if num_shared >= 4:
+                    norm_rf = rf / (2.0 * (num_shared - 3))
+                    fout.write('%s\t%s\t%d\t%d\t%.4f\t%.6g\t%.6g\n' % (names[i], names[j], num_shared,
+                                                                    rf, norm_rf,
+                                                                    distances['weighted_rf'][i, j],
+                                                                    distances['euclidean'][i, j]))
+                else:
+                    fout.write('%s\t%s\t%d\tNA\tNA\tNA\tNA\n' % (names[i], names[j], num_shared))
+        fout.close()
+
+        self.logger.info('Distance matrices written to: %s' % matrix_file)
+        self.logger.info('Pairwise distances written to: %s' % table_file)
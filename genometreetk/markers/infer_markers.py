@@ -17,7 +17,6 @@
 
 import os
 import sys
-import shutil
 import logging
 import ntpath
 from collections import defaultdict
@@ -25,11 +24,11 @@ from collections import defaultdict
 from genometreetk.default_values import DefaultValues
 from genometreetk.markers.align_markers import AlignMarkers
 from genometreetk.common import read_genome_id_file, read_genome_dir_file
+from genometreetk.array_tree import ArrayTree
+from genometreetk.parallel import Parallel
 
 from biolib.external.fasttree import FastTree
 
-import dendropy
-
 import pickle  # ***
 
 
@@ -384,9 +383,47 @@ class InferMarkers(object):
 
         return len(genome_ids), len(ncbi_genome_ids), len(user_genome_ids), genome_ids, marker_gene_stats, marker_genes
 
+    def _gene_tree_producer(self, msa_file):
+        """Infer gene tree and create copy labelled with genome ids.
+
+        Parameters
+        ----------
+        msa_file : str
+            File containing multiple sequence alignment of marker gene.
+        """
+
+        msa_filename = ntpath.basename(msa_file)
+        tree_prefix = msa_filename[0:msa_filename.find('.')]
+        if tree_prefix.startswith('PF'):
+            # retain version number of Pfam families
+            tree_prefix = '.'.join(msa_filename.split('.')[0:2])
+
+        gene_tree_file = os.path.join(self.gene_tree_dir, tree_prefix + '.tree')
+        gene_tree_log = os.path.join(self.gene_tree_dir, tree_prefix + '.tree.log')
+        fasttree_log = os.path.join(self.gene_tree_dir, tree_prefix + '.fasttree.log')
+
+        fasttree = FastTree(multithreaded=False)
+        fasttree.run(msa_file, 'prot', 'wag', gene_tree_file, gene_tree_log, fasttree_log)
+
+        # create gene tree without gene ids for visualization in ARB
+        output_tree_file = os.path.join(self.gene_tree_dir, tree_prefix + '.genome_ids.tree')
+        ArrayTree.relabel_leaves(gene_tree_file,
+                                    output_tree_file,
+                                    lambda label: label.split(DefaultValues.SEQ_CONCAT_CHAR)[0])
+
+        return tree_prefix
+
+    def _gene_tree_progress(self, processed_items, total_items):
+        """Report progress of gene tree inference."""
+
+        return '==> Inferred %d of %d (%.2f%%) gene trees.' % (processed_items, total_items, processed_items * 100.0 / total_items)
+
     def infer_gene_trees(self, msa_dir, output_dir, extension):
         """Infer gene trees.
 
+        Alignments are expected to be free of trailing stop
+        codons as produced by AlignMarkers.
+
         Parameters
         ----------
         msa_dir : str
@@ -397,48 +434,12 @@ class InferMarkers(object):
             Extension of multiple sequence alignment files.
         """
 
-        files = os.listdir(msa_dir)
         msa_files = []
-        for f in files:
+        for f in os.listdir(msa_dir):
             if f.endswith(extension):
-                msa_file = os.path.join(msa_dir, f)
-                msa_files.append(msa_file)
-
-                fin = open(msa_file)
-                data = fin.readlines()
-                fin.close()
-
-                fout = open(msa_file, 'w')
-                for line in data:
-                    if line[0] != '>':
-                        # remove trailing star
-                        if line[-1] == '*':
-                            line = line[0:-1]
-                    fout.write(line)
-                fout.close()
+                msa_files.append(os.path.join(msa_dir, f))
 
-        fasttree = FastTree(multithreaded=False)
-        fasttree.parallel_run(msa_files, 'prot', 'wag', output_dir, self.cpus)
+        self.gene_tree_dir = output_dir
 
-        # create gene tree without gene ids for visualization in ARB
-        for msa_file in msa_files:
-            tree_filename = ntpath.basename(msa_file)
-            tree_prefix = tree_filename[0:tree_filename.find('.')]
-
-            if tree_prefix.startswith('PF'):
-                # patch up output file for Pfam trees
-                old_tree_prefix = tree_prefix
-                tree_prefix = '.'.join(tree_filename.split('.')[0:2])
-                shutil.move(os.path.join(output_dir, old_tree_prefix + '.tree'),
-                                os.path.join(output_dir, tree_prefix + '.tree'))
-
-            gene_tree_file = os.path.join(output_dir, tree_prefix + '.tree')
-            gene_tree = dendropy.Tree.get_from_path(gene_tree_file, schema='newick', rooting='force-unrooted', preserve_underscores=True)
-
-            # rename nodes to contain only genome id
-            for node in gene_tree.leaf_nodes():
-                genome_id = node.taxon.label.split(DefaultValues.SEQ_CONCAT_CHAR)[0]
-                node.taxon.label = genome_id
-
-            output_tree_file = os.path.join(output_dir, tree_prefix + '.genome_ids.tree')
-            gene_tree.write_to_path(output_tree_file, schema='newick', suppress_rooting=True, unquoted_underscores=True)
+        parallel = Parallel(self.cpus)
+        parallel.run(self._gene_tree_producer, None, msa_files, self._gene_tree_progress)
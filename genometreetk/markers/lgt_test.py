@@ -16,7 +16,6 @@
 ###############################################################################
 
 import os
-import sys
 import logging
 
 from biolib.external.fasttree import FastTree
@@ -25,8 +24,9 @@ from biolib.common import make_sure_path_exists
 from genometreetk.default_values import DefaultValues
 from genometreetk.common import create_concatenated_alignment
 from genometreetk.jackknife_markers import JackknifeMarkers
-
-import dendropy
+from genometreetk.array_tree import ArrayTree
+from genometreetk.bipartitions import SplitTable, taxa_bitmask
+from genometreetk.parallel import Parallel
 
 
 class LgtTest(object):
@@ -53,6 +53,80 @@ class LgtTest(object):
 
         self.cpus = cpus
 
+    def _gene_tree_producer(self, mg):
+        """Compare gene tree of a marker to the jackknifed genome tree.
+
+        The bipartitions of the genome tree and the well-supported,
+        internal splits are set on the instance before processing 
+        so they are shared with each worker process. Bipartitions 
+        are projected onto the taxa in the gene tree instead of
+        pruning a copy of the genome tree.
+
+        Parameters
+        ----------
+        mg : str
+            Unique id of marker gene.
+        """
+
+        # read gene tree
+        f = mg + '.tree'
+        gene_tree_file = os.path.join(self.gene_tree_dir, f)
+        gene_tree = ArrayTree.read(gene_tree_file)
+
+        # prune gene tree so each genome is present exactly once
+        # and rename nodes to contain only genome id
+        gene_tree_taxa_set = set()
+        leaves_to_retain = []
+        for leaf in gene_tree.leaves():
+            genome_id = gene_tree.labels[leaf].split(DefaultValues.SEQ_CONCAT_CHAR)[0]
+
+            if genome_id not in gene_tree_taxa_set and genome_id in self.genome_ids:
+                leaves_to_retain.append(leaf)
+                gene_tree.labels[leaf] = genome_id
+
+            gene_tree_taxa_set.add(genome_id)
+
+        gene_tree = gene_tree.retain_leaves(leaves_to_retain)
+        gene_tree_taxa_set = set(gene_tree.labels[leaf] for leaf in gene_tree.leaves())
+
+        # get bipartitions of gene tree and genome tree over taxa in gene tree
+        taxa_mask = taxa_bitmask(self.namespace, gene_tree_taxa_set)
+        gene_tree_splits = SplitTable.from_tree(gene_tree, self.namespace).project(taxa_mask)
+        genome_tree_splits = self.genome_tree_splits.project(taxa_mask)
+        supported_splits = self.supported_splits.project(taxa_mask, merge=False)
+
+        # determine number of splits recovered by or compatible with this gene tree
+        recovered = supported_splits.recovered(gene_tree_splits)
+        compatible = supported_splits.compatible(gene_tree_splits, taxa_mask)
+
+        perc_recovered_splits = recovered.sum() * 100.0 / len(supported_splits)
+        perc_comp_splits = compatible.sum() * 100.0 / len(supported_splits)
+        norm_comp_edge_length = float(supported_splits.edge_lengths[compatible].sum()) / supported_splits.total_length()
+
+        # calculate weighted Robinson-Foulds (Manhattan) and Felsenstein's Euclidean
+        # distances to the concatenated genome tree
+        genome_tree_splits = genome_tree_splits.scale(1.0 / genome_tree_splits.total_length())
+        gene_tree_splits = gene_tree_splits.scale(1.0 / gene_tree_splits.total_length())
+        manhattan, euclidean = genome_tree_splits.edge_length_distances(gene_tree_splits)
+
+        return (mg, perc_recovered_splits, perc_comp_splits, norm_comp_edge_length, manhattan, euclidean)
+
+    def _gene_tree_consumer(self, produced_data, consumer_data):
+        """Collect distances between each gene tree and the genome tree."""
+
+        if consumer_data == None:
+            consumer_data = {}
+
+        mg = produced_data[0]
+        consumer_data[mg] = produced_data[1:]
+
+        return consumer_data
+
+    def _gene_tree_progress(self, processed_items, total_items):
+        """Report progress of gene tree filtering."""
+
+        return '==> Processed %d of %d (%.2f) gene trees.' % (processed_items, total_items, processed_items * 100.0 / total_items)
+
     def run(self, genome_ids,
                     marker_genes,
                     hmm_model_file,
@@ -111,8 +185,9 @@ class LgtTest(object):
 
         # identify well-support, internal splits
         self.logger.info('Identifying well-support, internal splits.')
-        tree = dendropy.Tree.get_from_path(jackknife_tree, schema='newick', rooting='force-unrooted', preserve_underscores=True)
-        num_leaves = len(tree.leaf_nodes())
+        tree = ArrayTree.read(jackknife_tree)
+        leaf_counts = tree.leaf_counts()
+        num_leaves = leaf_counts[0]
 
         num_internal_nodes = 0
         num_major_splits = 0
@@ -122,14 +197,13 @@ class LgtTest(object):
         for node in tree.internal_nodes():
             num_internal_nodes += 1
 
-            num_node_leaves = len(node.leaf_nodes())
+            num_node_leaves = leaf_counts[node]
             if min(num_node_leaves, num_leaves - num_node_leaves) >= max(min_per_taxa * num_leaves, 2):
                 num_major_splits += 1
 
-                if int(node.label) > (min_support * 100.0):
+                if int(tree.labels[node]) > (min_support * 100.0):
                     well_supported_major_splits += 1
-                    split = set([x.taxon.label for x in node.leaf_nodes()])
-                    splits.append((split, node.edge_length))
+                    splits.append(node)
 
         self.logger.info('# internal nodes: %d' % num_internal_nodes)
         self.logger.info('# major splits: %d' % num_major_splits)
@@ -138,80 +212,16 @@ class LgtTest(object):
         # filter gene trees that do not recover well-support, internal splits
         self.logger.info('Filtering gene trees.')
 
-        distances = {}
-        for i, mg in enumerate(sorted(marker_genes)):
-            sys.stdout.write('==> Processed %d of %d (%.2f) gene trees.\r' % (i + 1, len(marker_genes), (i + 1) * 100.0 / len(marker_genes)))
-            sys.stdout.flush()
-
-            # read gene tree
-            f = mg + '.tree'
-            gene_tree_file = os.path.join(gene_tree_dir, f)
-            gene_tree = dendropy.Tree.get_from_path(gene_tree_file, schema='newick', rooting='force-unrooted', preserve_underscores=True)
-
-            # prune gene tree so each genome is present exactly once
-            processed_genome_ids = set()
-            taxa_to_prune = []
-            for node in gene_tree.leaf_nodes():
-                genome_id = node.taxon.label.split(DefaultValues.SEQ_CONCAT_CHAR)[0]
-
-                if genome_id in processed_genome_ids or genome_id not in genome_ids:
-                    taxa_to_prune.append(node.taxon)
-
-                processed_genome_ids.add(genome_id)
-
-            gene_tree.prune_taxa(taxa_to_prune)
-
-            # rename nodes to contain only genome id
-            gene_tree_taxa_set = set()
-            for node in gene_tree.leaf_nodes():
-                genome_id = node.taxon.label.split(DefaultValues.SEQ_CONCAT_CHAR)[0]
-                node.taxon.label = genome_id
-                gene_tree_taxa_set.add(genome_id)
-
-            # re-encode the split system over the new taxon namespace
-            gene_tree.migrate_taxon_namespace(dendropy.TaxonNamespace(gene_tree_taxa_set))
-            gene_tree.encode_bipartitions()
-            split_bitmasks = set(b.split_bitmask for b in gene_tree.bipartition_encoding)
-
-            # determine number of splits recovered by or compatible with this gene tree
-            recovered_splits = 0
-            compatible_splits = 0
-            compatible_edge_length = 0
-            for split, edge_length in splits:
-                common_taxa_labels = split.intersection(gene_tree_taxa_set)
-
-                common_split = gene_tree.taxon_namespace.taxa_bitmask(labels=common_taxa_labels)
-                normalized_split = dendropy.Bipartition.normalize_bitmask(
-                                    bitmask=common_split,
-                                    fill_bitmask=gene_tree.taxon_namespace.all_taxa_bitmask(),
-                                    lowest_relevant_bit=1)
-
-                if normalized_split in split_bitmasks:
-                    recovered_splits += 1
-
-                if gene_tree.is_compatible_with_bipartition(dendropy.Bipartition(bitmask=normalized_split, is_rooted=False)):
-                    compatible_splits += 1
-                    compatible_edge_length += edge_length
-
-            perc_recovered_splits = recovered_splits * 100.0 / len(splits)
-            perc_comp_splits = compatible_splits * 100.0 / len(splits)
-            norm_comp_edge_length = float(compatible_edge_length) / sum([s[1] for s in splits])
-
-            # calculate weighted Robinson-Foulds (Manhattan) and Felsenstein's Euclidean
-            # distances to the concatenated genome tree
-            pruned_tree = tree.clone(depth=2)
-            pruned_tree.retain_taxa_with_labels(gene_tree.taxon_namespace.labels())
-            pruned_tree.migrate_taxon_namespace(gene_tree.taxon_namespace)
-            pruned_tree.encode_bipartitions()
-
-            pruned_tree_edge_len = sum([e.length for e in pruned_tree.edges() if e.length])
-            gene_tree_edge_len = sum([e.length for e in gene_tree.edges() if e.length])
-            pruned_tree.scale_edges(1.0 / pruned_tree_edge_len)
-            gene_tree.scale_edges(1.0 / gene_tree_edge_len)
-
-            manhattan = dendropy.calculate.treecompare.weighted_robinson_foulds_distance(pruned_tree, gene_tree)
-            euclidean = dendropy.calculate.treecompare.euclidean_distance(pruned_tree, gene_tree)
-
-            distances[mg] = (perc_recovered_splits, perc_comp_splits, norm_comp_edge_length, manhattan, euclidean)
+        self.namespace = dict((tree.labels[leaf], i) for i, leaf in enumerate(tree.leaves()))
+        self.genome_tree_splits = SplitTable.from_tree(tree, self.namespace)
+        self.supported_splits = self.genome_tree_splits.subset(splits)
+        self.genome_ids = set(genome_ids)
+        self.gene_tree_dir = gene_tree_dir
+
+        parallel = Parallel(self.cpus)
+        distances = parallel.run(self._gene_tree_producer,
+                                    self._gene_tree_consumer,
+                                    sorted(marker_genes),
+                                    self._gene_tree_progress)
 
         return distances, num_internal_nodes, num_major_splits, well_supported_major_splits
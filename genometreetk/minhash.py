@@ -0,0 +1,564 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import math
+import logging
+
+import numpy as np
+
+import biolib.seq_io as seq_io
+from biolib.common import make_sure_path_exists
+
+from genometreetk.exceptions import GenomeTreeTkError
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler, profiled
+
+
+class MinHashSketch(object):
+    """Build MinHash sketches of genomes and find pairs of similar genomes.
+
+    Each genome is sketched by hashing its canonical k-mers and
+    retaining the minimum hash in each of a fixed number of bins
+    (one permutation MinHash). Sketches of all genomes are kept
+    in a single memory-mapped matrix so they can be shared by
+    worker processes and reused between runs. Distances follow
+    the Mash formulation, D = -1/k ln(2J / (1 + J)), where J is
+    the Jaccard index estimated from the fraction of matching bins.
+
+    Rather than comparing all pairs of genomes, candidate pairs
+    are identified by placing genomes with the same hash in a bin
+    into a common bucket (locality sensitive hashing). Enough bins
+    are used for bucketing that pairs within the distance threshold
+    are missed with a probability below 0.1%. Buckets with more
+    than max_bucket_size genomes are divided by the hashes of the
+    following bins, so pairs near the distance threshold in very
+    large buckets may be missed.
+    """
+
+    # value of bins without any k-mers
+    empty_bin = np.iinfo(np.uint64).max
+
+    # 2-bit encoding of nucleotides, with 4 for ambiguous bases
+    nt_codes = np.full(256, 4, dtype=np.uint8)
+    nt_codes[np.frombuffer(b'ACGTacgt', dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+
+    sketch_file = 'sketches.npy'
+    genome_file = 'genomes.tsv'
+
+    # number of bases processed at once when hashing k-mers
+    block_size = 1000000
+
+    # number of genome pairs compared at once
+    pairs_per_job = 20000
+
+    # maximum number of genomes in a bucket before it is divided
+    max_bucket_size = 5000
+
+    # number of candidate pairs collected before duplicates are removed
+    max_pending_pairs = 2**24
+
+    def __init__(self, cpus=1, kmer_size=21, num_bins=1024):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use.
+        kmer_size : int
+            Length of k-mers to hash (at most 32).
+        num_bins : int
+            Number of bins in each sketch.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
+
+        if kmer_size > 32:
+            raise GenomeTreeTkError('K-mer size must be at most 32.')
+
+        if num_bins & (num_bins - 1):
+            raise GenomeTreeTkError('Number of bins must be a power of 2.')
+
+        self.kmer_size = kmer_size
+        self.num_bins = num_bins
+
+    def _hash(self, kmers):
+        """Mix bits of k-mers to obtain uniformly distributed 64-bit hashes."""
+
+        h = kmers ^ (kmers >> np.uint64(30))
+        h *= np.uint64(0xbf58476d1ce4e5b9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94d049bb133111eb)
+        h ^= h >> np.uint64(31)
+
+        return h
+
+    def _kmer_hashes(self, seq):
+        """Get hash of each canonical k-mer in a sequence without ambiguous bases."""
+
+        k = self.kmer_size
+        codes = self.nt_codes[np.frombuffer(seq.encode('ascii'), dtype=np.uint8)]
+        num_kmers = len(codes) - k + 1
+        if num_kmers <= 0:
+            return np.zeros(0, dtype=np.uint64)
+
+        fwd = np.zeros(num_kmers, dtype=np.uint64)
+        rev = np.zeros(num_kmers, dtype=np.uint64)
+        for i in range(k):
+            c = codes[i:i + num_kmers].astype(np.uint64)
+            fwd = (fwd << np.uint64(2)) | (c & np.uint64(3))
+            rev |= (np.uint64(3) - (c & np.uint64(3))) << np.uint64(2 * i)
+
+        # remove k-mers spanning ambiguous bases
+        ambiguous = np.concatenate(([0], np.cumsum(codes == 4)))
+        valid = (ambiguous[k:] - ambiguous[0:num_kmers]) == 0
+
+        return self._hash(np.minimum(fwd, rev)[valid])
+
+    def sketch_genome(self, genome_file):
+        """Create sketch of a genome.
+
+        Parameters
+        ----------
+        genome_file : str
+            FASTA file with nucleotide sequences of genome.
+
+        Returns
+        -------
+        np.array
+            Minimum hash in each bin.
+        """
+
+        bin_shift = np.uint64(64 - int(math.log(self.num_bins, 2)))
+
+        sketch = np.full(self.num_bins, self.empty_bin, dtype=np.uint64)
+        for _seq_id, seq in seq_io.read_seq(genome_file):
+            # process long sequences in overlapping blocks to bound memory
+            for start in range(0, max(len(seq) - self.kmer_size + 1, 1), self.block_size):
+                hashes = self._kmer_hashes(seq[start:start + self.block_size + self.kmer_size - 1])
+                np.minimum.at(sketch, (hashes >> bin_shift).astype(np.int64), hashes)
+
+        return sketch
+
+    def _read_genome_paths(self, genome_path_file):
+        """Read path to nucleotide file of each genome."""
+
+        genome_paths = {}
+        for line in open(genome_path_file):
+            if not line.strip() or line[0] == '#':
+                continue
+
+            line_split = line.strip().split('\t')
+            genome_paths[line_split[0]] = line_split[1]
+
+        return genome_paths
+
+    def read_genomes(self, sketch_dir):
+        """Read genomes in a sketch store.
+
+        Parameters
+        ----------
+        sketch_dir : str
+            Directory containing sketches.
+
+        Returns
+        -------
+        d[parameter] -> value
+            K-mer size and number of bins used to create sketches.
+        list
+            Genome id, file, size and modification time of each sketched genome.
+        """
+
+        params = {}
+        genomes = []
+        genome_file = os.path.join(sketch_dir, self.genome_file)
+        if not os.path.exists(genome_file):
+            return params, genomes
+
+        for line in open(genome_file):
+            line_split = line.rstrip('\n').split('\t')
+            if line[0] == '#':
+                params[line_split[0][1:]] = int(line_split[1])
+                continue
+
+            genomes.append((line_split[0], line_split[1], int(line_split[2]), float(line_split[3])))
+
+        return params, genomes
+
+    def _sketch_producer(self, genome_info):
+        """Sketch genome into its row of the memory-mapped sketch store."""
+
+        row, genome_file = genome_info
+        self.sketches[row] = self.sketch_genome(genome_file)
+        self.sketches.flush()
+
+        return (row,)
+
+    def _sketch_progress(self, processed_items, total_items):
+        """Report progress of genome sketching."""
+
+        return '==> Sketched %d of %d (%.2f%%) genomes.' % (processed_items, total_items, processed_items * 100.0 / total_items)
+
+    def sketch(self, genome_path_file, sketch_dir):
+        """Sketch genomes.
+
+        Sketches of genomes in an existing sketch store are reused
+        if the nucleotide file of the genome has not changed.
+
+        Parameters
+        ----------
+        genome_path_file : str
+            File indicating nucleotide FASTA file of each genome.
+        sketch_dir : str
+            Directory to store sketches.
+        """
+
+        make_sure_path_exists(sketch_dir)
+
+        genome_paths = self._read_genome_paths(genome_path_file)
+        genome_ids = sorted(genome_paths)
+        self.logger.info('Read path to %d genomes.' % len(genome_ids))
+
+        # identify genomes with an up-to-date sketch
+        prev_rows = {}
+        prev_sketch_file = os.path.join(sketch_dir, self.sketch_file)
+        params, prev_genomes = self.read_genomes(sketch_dir)
+        if params != {'kmer_size': self.kmer_size, 'num_bins': self.num_bins}:
+            # sketches created with different parameters can not be reused
+            prev_genomes = []
+
+        for row, (genome_id, genome_file, size, mtime) in enumerate(prev_genomes):
+            if genome_paths.get(genome_id) == genome_file and os.path.exists(genome_file):
+                stat = os.stat(genome_file)
+                if stat.st_size == size and stat.st_mtime == mtime:
+                    prev_rows[genome_id] = row
+
+        # create new sketch store with previous sketches
+        tmp_sketch_file = os.path.join(sketch_dir, self.sketch_file + '.tmp')
+        self.sketches = np.lib.format.open_memmap(tmp_sketch_file,
+                                                    mode='w+',
+                                                    dtype=np.uint64,
+                                                    shape=(len(genome_ids), self.num_bins))
+        if prev_rows:
+            prev_sketches = np.load(prev_sketch_file, mmap_mode='r')
+            for row, genome_id in enumerate(genome_ids):
+                if genome_id in prev_rows:
+                    self.sketches[row] = prev_sketches[prev_rows[genome_id]]
+            del prev_sketches
+
+        genomes_to_sketch = [(row, genome_paths[genome_id])
+                                for row, genome_id in enumerate(genome_ids)
+                                if genome_id not in prev_rows]
+        self.logger.info('Reusing sketches of %d genomes and sketching %d genomes.' % (len(prev_rows), len(genomes_to_sketch)))
+        profiler.count('genomes', len(genome_ids))
+        profiler.count('genomes_sketched', len(genomes_to_sketch))
+
+        if genomes_to_sketch:
+            parallel = Parallel(self.cpus)
+            parallel.run(self._sketch_producer, None, genomes_to_sketch, self._sketch_progress)
+
+        self.sketches.flush()
+        del self.sketches
+        os.rename(tmp_sketch_file, prev_sketch_file)
+
+        fout = open(os.path.join(sketch_dir, self.genome_file), 'w')
+        fout.write('#kmer_size\t%d\n' % self.kmer_size)
+        fout.write('#num_bins\t%d\n' % self.num_bins)
+        for genome_id in genome_ids:
+            stat = os.stat(genome_paths[genome_id])
+            fout.write('%s\t%s\t%d\t%r\n' % (genome_id, genome_paths[genome_id], stat.st_size, stat.st_mtime))
+        fout.close()
+
+        self.logger.info('Sketches written to: %s' % sketch_dir)
+
+    def _jaccard_to_dist(self, jaccard):
+        """Convert Jaccard index to Mash distance."""
+
+        with np.errstate(divide='ignore'):
+            dist = np.log((1.0 + jaccard) / (2.0 * jaccard)) / self.kmer_size
+
+        return np.minimum(dist, 1.0)
+
+    def _dist_to_jaccard(self, dist):
+        """Convert Mash distance to Jaccard index."""
+
+        x = math.exp(-dist * self.kmer_size)
+
+        return x / (2.0 - x)
+
+    def _buckets(self, sketches, genomes, b):
+        """Group genomes with the same hash in a bin.
+
+        Parameters
+        ----------
+        sketches : np.array
+            Sketch of each genome.
+        genomes : np.array
+            Indices of genomes to group.
+        b : int
+            Bin to group genomes by.
+
+        Returns
+        -------
+        list
+            Sorted indices of genomes in each bucket of at least 2 genomes.
+        """
+
+        values = np.asarray(sketches[genomes, b])
+        genomes = genomes[values != self.empty_bin]
+        values = values[values != self.empty_bin]
+
+        order = np.argsort(values, kind='stable')
+        sorted_values = values[order]
+        sorted_genomes = genomes[order]
+
+        # runs of genomes with identical values form a bucket
+        run_starts = np.concatenate(([0], np.nonzero(np.diff(sorted_values))[0] + 1))
+        run_ends = np.concatenate((run_starts[1:], [len(order)]))
+
+        buckets = []
+        for start, end in zip(run_starts, run_ends):
+            if end - start > 1:
+                buckets.append(np.sort(sorted_genomes[start:end]))
+
+        return buckets
+
+    def _bucket_pairs(self, sketches, b):
+        """Get pairs of genomes in a common bucket for a bin.
+
+        Buckets with more than max_bucket_size genomes are divided
+        by the hash of each following bin in turn, so the number of
+        pairs grows with the size of the buckets rather than the
+        square of the number of genomes sharing a hash.
+
+        Parameters
+        ----------
+        sketches : np.array
+            Sketch of each genome.
+        b : int
+            Bin used for bucketing.
+
+        Returns
+        -------
+        list
+            Index of candidate pairs in each bucket, encoded as i*N + j with i < j.
+        """
+
+        num_genomes = sketches.shape[0]
+
+        pairs = []
+        buckets = self._buckets(sketches, np.arange(num_genomes), b)
+        for offset in range(1, self.num_bins + 1):
+            oversized = []
+            for bucket in buckets:
+                if len(bucket) > self.max_bucket_size and offset < self.num_bins:
+                    oversized.append(bucket)
+                else:
+                    i, j = np.triu_indices(len(bucket), 1)
+                    pairs.append(bucket[i] * num_genomes + bucket[j])
+
+            if not oversized:
+                break
+
+            split_bin = (b + offset) % self.num_bins
+            buckets = []
+            for bucket in oversized:
+                buckets.extend(self._buckets(sketches, bucket, split_bin))
+
+        return pairs
+
+    @profiled('candidate_pairs')
+    def candidate_pairs(self, sketches, max_dist):
+        """Identify pairs of genomes sharing a hash in any bucketing bin.
+
+        Parameters
+        ----------
+        sketches : np.array
+            Sketch of each genome.
+        max_dist : float
+            Maximum distance between genomes of interest.
+
+        Returns
+        -------
+        np.array
+            Unique index of each candidate pair, encoded as i*N + j with i < j.
+        """
+
+        num_genomes = sketches.shape[0]
+
+        # determine number of bins required to miss fewer than 0.1% of pairs at the threshold
+        jaccard = self._dist_to_jaccard(max_dist)
+        if jaccard >= 1.0:
+            num_lsh_bins = 1
+        elif jaccard <= 0:
+            num_lsh_bins = self.num_bins
+        else:
+            num_lsh_bins = int(math.ceil(math.log(1e-3) / math.log(1.0 - jaccard)))
+        num_lsh_bins = min(num_lsh_bins, self.num_bins)
+
+        # pairs are collected across bins and duplicates removed only
+        # once many pairs are pending, rather than after every bin
+        pairs = [np.zeros(0, dtype=np.int64)]
+        num_unique = num_pending = 0
+        for b in range(num_lsh_bins):
+            band_pairs = self._bucket_pairs(sketches, b)
+            pairs.extend(band_pairs)
+            num_pending += sum([len(p) for p in band_pairs])
+
+            if num_pending > max(num_unique, self.max_pending_pairs):
+                pairs = [np.unique(np.concatenate(pairs))]
+                num_unique = len(pairs[0])
+                num_pending = 0
+
+        return np.unique(np.concatenate(pairs))
+
+    def _dist_producer(self, pair_block):
+        """Calculate distance between a block of genome pairs."""
+
+        num_genomes = self.sketches.shape[0]
+        gi = pair_block // num_genomes
+        gj = pair_block % num_genomes
+
+        si = np.asarray(self.sketches[gi])
+        sj = np.asarray(self.sketches[gj])
+        shared = ((si == sj) & (si != self.empty_bin)).sum(axis=1)
+        union = ((si != self.empty_bin) | (sj != self.empty_bin)).sum(axis=1)
+        jaccard = shared / np.maximum(union, 1).astype(float)
+        dist = self._jaccard_to_dist(jaccard)
+
+        within = dist <= self.max_dist
+
+        return (gi[within], gj[within], dist[within], shared[within])
+
+    def _dist_consumer(self, produced_data, consumer_data):
+        """Collect distances between pairs of genomes."""
+
+        if consumer_data == None:
+            consumer_data = []
+
+        consumer_data.append(produced_data)
+
+        return consumer_data
+
+    def _dist_progress(self, processed_items, total_items):
+        """Report progress of distance calculations."""
+
+        return '==> Processed %d of %d (%.2f%%) blocks of genome pairs.' % (processed_items, total_items, processed_items * 100.0 / total_items)
+
+    def distances(self, sketch_dir, max_dist):
+        """Calculate distance between all pairs of genomes within a distance threshold.
+
+        Parameters
+        ----------
+        sketch_dir : str
+            Directory containing sketches.
+        max_dist : float
+            Maximum distance between genomes to report.
+
+        Returns
+        -------
+        list
+            Genome ids in the order of the sketch store.
+        list
+            Index of both genomes, distance, and number of shared bins for blocks of genome pairs.
+        """
+
+        params, genomes = self.read_genomes(sketch_dir)
+        if not genomes:
+            raise GenomeTreeTkError('No sketches found in: %s' % sketch_dir)
+        self.kmer_size = params['kmer_size']
+        self.num_bins = params['num_bins']
+
+        genome_ids = [g[0] for g in genomes]
+        self.sketches = np.load(os.path.join(sketch_dir, self.sketch_file), mmap_mode='r')
+        self.max_dist = max_dist
+
+        self.logger.info('Identifying candidate pairs among %d genomes.' % len(genome_ids))
+        pairs = self.candidate_pairs(self.sketches, max_dist)
+        self.logger.info('Calculating distance between %d candidate pairs.' % len(pairs))
+        profiler.count('genomes', len(genome_ids))
+        profiler.count('pairs', len(pairs))
+
+        pair_blocks = [pairs[i:i + self.pairs_per_job] for i in range(0, len(pairs), self.pairs_per_job)]
+        results = []
+        if pair_blocks:
+            parallel = Parallel(self.cpus)
+            results = parallel.run(self._dist_producer,
+                                    self._dist_consumer,
+                                    pair_blocks,
+                                    self._dist_progress)
+
+        return genome_ids, results
+
+    def read_dists(self, sketch_dir, max_dist):
+        """Get distances between genomes within a distance threshold.
+
+        Parameters
+        ----------
+        sketch_dir : str
+            Directory containing sketches.
+        max_dist : float
+            Maximum distance between genomes to report.
+
+        Returns
+        -------
+        d[query genome][reference genome] -> distance
+            Distance between pairs of genomes in both orientations.
+        """
+
+        genome_ids, results = self.distances(sketch_dir, max_dist)
+
+        dists = {}
+        for gi, gj, dist, _shared in results:
+            for i, j, d in zip(gi.tolist(), gj.tolist(), dist.tolist()):
+                dists.setdefault(genome_ids[i], {})[genome_ids[j]] = d
+                dists.setdefault(genome_ids[j], {})[genome_ids[i]] = d
+
+        return dists
+
+    def write_dists(self, sketch_dir, max_dist, output_file):
+        """Write distances between genomes within a distance threshold.
+
+        Pairs are written in both orientations using the
+        column order of Mash: reference, query, distance,
+        and number of shared bins.
+
+        Parameters
+        ----------
+        sketch_dir : str
+            Directory containing sketches.
+        max_dist : float
+            Maximum distance between genomes to report.
+        output_file : str
+            Output file.
+        """
+
+        genome_ids, results = self.distances(sketch_dir, max_dist)
+
+        num_pairs = 0
+        fout = open(output_file, 'w')
+        for gi, gj, dist, shared in results:
+            for i, j, d, s in zip(gi.tolist(), gj.tolist(), dist.tolist(), shared.tolist()):
+                fout.write('%s\t%s\t%.6g\t%d/%d\n' % (genome_ids[i], genome_ids[j], d, s, self.num_bins))
+                fout.write('%s\t%s\t%.6g\t%d/%d\n' % (genome_ids[j], genome_ids[i], d, s, self.num_bins))
+                num_pairs += 1
+        fout.close()
+
+        self.logger.info('Identified %d pairs of genomes within a distance of %.3f.' % (num_pairs, max_dist))
+        self.logger.info('Distances written to: %s' % output_file)
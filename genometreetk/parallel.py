@@ -0,0 +1,303 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import sys
+import queue
+import pickle
+import signal
+import logging
+import traceback
+import multiprocessing as mp
+
+from genometreetk.exceptions import GenomeTreeTkError
+from genometreetk.profiler import profiler
+
+
+class WorkerTraceback(Exception):
+    """Traceback of an exception raised within a worker process."""
+
+    def __init__(self, tb):
+        Exception.__init__(self, tb)
+        self.tb = tb
+
+    def __str__(self):
+        return '\n\n' + self.tb
+
+
+class Parallel(object):
+    """Process data items with a pool of worker processes.
+
+    This follows the producer/consumer model of biolib's Parallel
+    class: the producer is called on each data item within a worker
+    process and the value it returns is passed to the consumer,
+    which runs in the main process and therefore acts as the single
+    writer of results. Workers are forked so the producer can use
+    any state set on its object before run() is called, and data
+    items are never sent to workers.
+
+    Data items are divided evenly between workers, with each worker
+    processing its items in chunks. A worker which runs out of items
+    takes the second half of the remaining items from the worker
+    with the most items left, so workers stay busy when items take
+    very different amounts of time. Results are passed to the
+    consumer as soon as they are produced or, if requested, in the
+    order of the data items.
+
+    If a producer raises an exception, or a worker exits
+    unexpectedly, all workers and any programs they started are
+    terminated and the exception is raised in the main process.
+    """
+
+    def __init__(self, cpus=1, chunk_size=None, ordered=False):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of worker processes to create.
+        chunk_size : int
+            Number of items taken by a worker at a time, or None to
+            select a size based on the number of items.
+        ordered : bool
+            Flag indicating if results should be consumed in the
+            order of the data items.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = max(1, cpus)
+        self.chunk_size = chunk_size
+        self.ordered = ordered
+
+        # seconds between checks that workers are still running
+        self.poll_interval = 0.5
+
+    def _next_chunk(self, worker_id, start, end, lock):
+        """Get next chunk of items for worker, taking items from another worker if necessary."""
+
+        with lock:
+            if start[worker_id] >= end[worker_id]:
+                # take second half of items from worker with the most items remaining
+                victim = max(range(len(start)), key=lambda w: end[w] - start[w])
+                remaining = end[victim] - start[victim]
+                if remaining <= 0:
+                    return None
+
+                mid = end[victim] - (remaining + 1) // 2
+                start[worker_id] = mid
+                end[worker_id] = end[victim]
+                end[victim] = mid
+
+            chunk_start = start[worker_id]
+            chunk_end = min(chunk_start + self.cur_chunk_size, end[worker_id])
+            start[worker_id] = chunk_end
+
+        return chunk_start, chunk_end
+
+    def _worker(self, worker_id, producer, start, end, lock, cancel, result_queue):
+        """Process chunks of data items until all items have been processed."""
+
+        # place worker in its own process group so programs it starts
+        # can be terminated along with it
+        os.setpgrp()
+
+        while not cancel.is_set():
+            chunk = self._next_chunk(worker_id, start, end, lock)
+            if chunk is None:
+                break
+
+            for pos in range(*chunk):
+                if cancel.is_set():
+                    break
+
+                item_index = self.order[pos]
+                try:
+                    produced = producer(self.data_items[item_index])
+                except Exception as e:
+                    tb = traceback.format_exc()
+                    try:
+                        pickle.dumps(e)
+                    except Exception:
+                        e = GenomeTreeTkError('%s: %s' % (type(e).__name__, e))
+                    result_queue.put((item_index, False, (e, tb)))
+                    result_queue.close()
+                    result_queue.join_thread()
+                    return
+
+                result_queue.put((item_index, True, produced))
+
+        result_queue.close()
+        result_queue.join_thread()
+
+    def _terminate(self, workers):
+        """Terminate workers along with any programs they started."""
+
+        workers = [p for p in workers if p.pid is not None]
+        for p in workers:
+            if p.exitcode is None:
+                try:
+                    os.killpg(p.pid, signal.SIGTERM)
+                except OSError:
+                    p.terminate()
+
+        for p in workers:
+            p.join()
+
+    def _report(self, progress, processed_items, total_items):
+        """Report progress string."""
+
+        if progress:
+            status = progress(processed_items, total_items)
+            sys.stdout.write('%s\r' % status)
+            sys.stdout.flush()
+
+    def _run_serial(self, producer, consumer, progress):
+        """Process data items within the main process."""
+
+        consumer_data = None
+        self._report(progress, 0, len(self.data_items))
+        for i, item in enumerate(self.data_items):
+            produced = producer(item)
+            if consumer:
+                consumer_data = consumer(produced, consumer_data)
+            self._report(progress, i + 1, len(self.data_items))
+
+        return consumer_data
+
+    def run(self, producer, consumer, data_items, progress=None):
+        """Process data items in parallel.
+
+        Parameters
+        ----------
+        producer : function
+            Function to process a data item.
+        consumer : function
+            Function to consume produced value, or None.
+        data_items : iterable
+            Data items to process.
+        progress : function
+            Function returning progress string, or None.
+
+        Returns
+        -------
+        <user specified>
+            Value returned by final call to consumer function.
+        """
+
+        self.data_items = list(data_items)
+        num_items = len(self.data_items)
+        num_workers = min(self.cpus, num_items)
+
+        profiler.count('parallel_items', num_items)
+
+        if num_workers <= 1:
+            try:
+                consumer_data = self._run_serial(producer, consumer, progress)
+            finally:
+                if progress:
+                    sys.stdout.write('\n')
+                del self.data_items
+
+            return consumer_data
+
+        self.cur_chunk_size = self.chunk_size
+        if not self.cur_chunk_size:
+            self.cur_chunk_size = max(1, min(64, num_items // (16 * num_workers)))
+
+        # assign every n-th item to each worker so all workers start with
+        # the first items, which are often the largest
+        self.order = [i for w in range(num_workers) for i in range(w, num_items, num_workers)]
+
+        ctx = mp.get_context('fork')
+        start = ctx.Array('l', num_workers, lock=False)
+        end = ctx.Array('l', num_workers, lock=False)
+        pos = 0
+        for w in range(num_workers):
+            start[w] = pos
+            pos += len(range(w, num_items, num_workers))
+            end[w] = pos
+
+        lock = ctx.Lock()
+        cancel = ctx.Event()
+        result_queue = ctx.Queue()
+
+        workers = [ctx.Process(target=self._worker,
+                                args=(w, producer, start, end, lock, cancel, result_queue))
+                    for w in range(num_workers)]
+
+        consumer_data = None
+        processed_items = 0
+        next_index = 0
+        pending = {}
+        finished_polls = 0
+        try:
+            for p in workers:
+                p.start()
+
+            self._report(progress, processed_items, num_items)
+            while processed_items < num_items:
+                try:
+                    item_index, success, produced = result_queue.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    for w, p in enumerate(workers):
+                        if p.exitcode is not None and p.exitcode != 0:
+                            raise GenomeTreeTkError('Worker process %d exited unexpectedly with code %d.' % (w, p.exitcode))
+
+                    # results are flushed before a worker exits, so if all workers
+                    # have finished and no results arrive then results were lost
+                    if all(p.exitcode == 0 for p in workers):
+                        finished_polls += 1
+                        if finished_polls > 1:
+                            raise GenomeTreeTkError('Worker processes finished without processing %d items.' % (num_items - processed_items))
+                    continue
+
+                if not success:
+                    e, tb = produced
+                    raise e from WorkerTraceback(tb)
+
+                if self.ordered:
+                    pending[item_index] = produced
+                    ready = []
+                    while next_index in pending:
+                        ready.append(pending.pop(next_index))
+                        next_index += 1
+                else:
+                    ready = [produced]
+
+                for produced in ready:
+                    if consumer:
+                        consumer_data = consumer(produced, consumer_data)
+                    processed_items += 1
+                    self._report(progress, processed_items, num_items)
+
+            if progress:
+                sys.stdout.write('\n')
+
+            for p in workers:
+                p.join()
+        except BaseException:
+            cancel.set()
+            self._terminate(workers)
+            if progress:
+                sys.stdout.write('\n')
+            raise
+        finally:
+            del self.data_items
+            del self.order
+
+        return consumer_data
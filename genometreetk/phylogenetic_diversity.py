@@ -15,23 +15,43 @@
 #                                                                             #
 ###############################################################################
 
+import os
+import sys
 import logging
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from math import floor
 
-import dendropy
+import numpy as np
 
 from biolib.common import is_float
 from biolib.taxonomy import Taxonomy
 
+from genometreetk.array_tree import ArrayTree
+from genometreetk.parallel import Parallel
+from genometreetk.profiler import profiler, profiled
+
+
+# traversal indices for a tree with nodes numbered in preorder
+# so the subtree of node i spans the index range [i, subtree_end[i])
+TreeIndex = namedtuple('TreeIndex', 'edge_lengths subtree_end leaf_index clades')
+
 
 class PhylogeneticDiversity():
     """Calculate phylogenetic diversity."""
 
-    def __init__(self):
-        """Initialize."""
+    def __init__(self, cpus=1):
+        """Initialize.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use when processing taxa lists in batch.
+        """
+
         self.logger = logging.getLogger()
+
+        self.cpus = cpus
         
     def _read_taxa_list(self, taxa_list):
         """Read taxa from file."""
@@ -42,18 +62,88 @@ class PhylogeneticDiversity():
             
         return taxa
         
-    def _total_pd(self, tree):
-        """Calculate PD over entire tree."""
-        
-        total_pd = 0
-        total_taxa = 0
-        for node in tree.preorder_node_iter():
-            if node.parent_node is not None:
-                total_pd += node.edge.length
-                if node.is_leaf():
-                    total_taxa += 1
-                    
-        return total_pd, total_taxa
+    def _clade_name(self, label):
+        """Get name of clade from label of internal node."""
+
+        if not label:
+            return None
+
+        if ':' in label:
+            _support, taxon = label.split(':')
+            return taxon
+
+        if not is_float(label):
+            return label
+
+        return None
+
+    @profiled('index_tree')
+    def _tree_index(self, tree):
+        """Precompute traversal indices used to calculate PD over many sets of taxa.
+
+        Parameters
+        ----------
+        tree : ArrayTree
+            Tree to index.
+
+        Returns
+        -------
+        TreeIndex
+            Edge length, subtree extent, and named clades of nodes in preorder.
+        """
+
+        edge_lengths = np.nan_to_num(tree.edge_lengths)
+        edge_lengths[0] = 0.0
+
+        clades = []
+        for node in tree.internal_nodes().tolist():
+            taxon = self._clade_name(tree.labels[node])
+            if taxon:
+                clades.append((node, taxon))
+
+        profiler.count('nodes', len(edge_lengths))
+        profiler.count('clades', len(clades))
+
+        return TreeIndex(edge_lengths, tree.subtree_end, tree.leaf_index(), clades)
+
+    def _taxa_below(self, tree_index, leaf_values):
+        """Sum values assigned to leaves over the subtree of each node."""
+
+        cumulative = np.concatenate(([0], np.cumsum(leaf_values)))
+        return cumulative[tree_index.subtree_end] - cumulative[:-1]
+
+    def _subset_pd(self, tree_index, taxa):
+        """Calculate PD of the subtree spanning a set of taxa.
+
+        This is equivalent to pruning the tree to the specified
+        taxa and summing the branch lengths of the pruned tree.
+
+        Parameters
+        ----------
+        tree_index : TreeIndex
+            Traversal indices of tree.
+        taxa : iterable
+            Taxa to calculate PD over.
+
+        Returns
+        -------
+        float
+            PD of taxa.
+        int
+            Number of taxa in tree.
+        """
+
+        in_subset = np.zeros(len(tree_index.edge_lengths))
+        for taxon in taxa:
+            leaf = tree_index.leaf_index.get(taxon, None)
+            if leaf is not None:
+                in_subset[leaf] = 1
+
+        taxa_below = self._taxa_below(tree_index, in_subset)
+        num_taxa = taxa_below[0]
+        spanning_edges = (taxa_below > 0) & (taxa_below < num_taxa)
+
+        return tree_index.edge_lengths[spanning_edges].sum(), int(num_taxa)
         
     def _read_reps(self, rep_list):
         """Read genomes assigned to a representative."""
@@ -120,110 +210,128 @@ class PhylogeneticDiversity():
             rep_id = genome_reps.get(taxon, None)
             if rep_id and rep_id not in ingroup:
                 pg_taxon[taxon] = [0, rep_id + ' (assigned to outgroup representative)']
-            
-        for leaf in tree.leaf_node_iter():
-            if leaf.taxon.label in ingroup:
+                
+        # ingroup genomes represented by each genome
+        represented_genomes = defaultdict(list)
+        for genome_id, rep_id in genome_reps.items():
+            if genome_id in ingroup:
+                represented_genomes[rep_id].append(genome_id)
+
+        # number of outgroup taxa below each node
+        out_leaves = np.array(sorted([leaf for taxon, leaf in tree.leaf_index().items() 
+                                        if taxon in out_taxa_with_reps]), dtype=np.int64)
+        out_mask = np.zeros(len(tree), dtype=np.int64)
+        out_mask[out_leaves] = 1
+        out_below = tree.leaf_counts(out_mask).tolist()
+
+        edge_lengths = np.nan_to_num(tree.edge_lengths).tolist()
+        parent = tree.parent.tolist()
+        for leaf in tree.leaves().tolist():
+            taxon = tree.labels[leaf]
+            if taxon in ingroup:
                 # find first internal node containing an outgroup taxon
                 pg = 0
-                parent = leaf
+                node = leaf
                 outgroup_taxon = 'None'
-                while parent:
-                    # check for outgroup taxon
-                    stop = False
-                    for tip in parent.leaf_iter():
-                        if tip.taxon.label in out_taxa_with_reps:
-                            outgroup_taxon = tip.taxon.label
-                            if outgroup_taxon in ingroup:
-                                outgroup_taxon += ' (one or more outgroup taxa are assigned to this ingroup taxon)'
-                            stop = True
-                            
-                    if stop:
+                while node != -1:
+                    if out_below[node] > 0:
+                        last_out_leaf = np.searchsorted(out_leaves, tree.subtree_end[node]) - 1
+                        outgroup_taxon = tree.labels[out_leaves[last_out_leaf]]
+                        if outgroup_taxon in ingroup:
+                            outgroup_taxon += ' (one or more outgroup taxa are assigned to this ingroup taxon)'
                         break
                     
-                    pg += parent.edge.length
-                    parent = parent.parent_node
+                    pg += edge_lengths[node]
+                    node = parent[node]
                     
-                pg_taxon[leaf.taxon.label] = [pg, outgroup_taxon]
+                pg_taxon[taxon] = [pg, outgroup_taxon]
                 
                 # propagate information to genomes represented by this genome_id
-                for genome_id, rep_id in genome_reps.items():
-                    if genome_id in ingroup and rep_id == leaf.taxon.label:
-                        pg_taxon[genome_id] = [pg, outgroup_taxon]
+                for genome_id in represented_genomes[taxon]:
+                    pg_taxon[genome_id] = [pg, outgroup_taxon]
 
         return pg_taxon
 
+    def _pd_summary(self, tree_index, ingroup, genome_reps):
+        """Calculate PD of ingroup and outgroup taxa.
+
+        Parameters
+        ----------
+        tree_index : TreeIndex
+            Traversal indices of tree.
+        ingroup : set
+            Ingroup taxa.
+        genome_reps : d[genome_id] -> representative
+            Representative of each genome.
+
+        Returns
+        -------
+        dict
+            Taxa counts and PD of ingroup and outgroup.
+        """
+
+        # calculate PD for ingroup with additional genomes assigned to a representative
+        in_taxa = ingroup.intersection(tree_index.leaf_index)
+        ingroup_with_reps, in_rep_is_ingroup, in_rep_is_outgroup = self._include_reps(ingroup, None, genome_reps, True)
+        in_pd, _ = self._subset_pd(tree_index, ingroup_with_reps)
+
+        # calculate PD for outgroup with additional genomes assigned to a representative
+        outgroup = set(tree_index.leaf_index).difference(ingroup)
+        outgroup_with_reps, out_rep_is_ingroup, out_rep_is_outgroup = self._include_reps(ingroup, outgroup, genome_reps, False)
+        out_pd, _ = self._subset_pd(tree_index, outgroup_with_reps)
+
+        summary = {}
+        summary['in_taxa'] = in_taxa
+        summary['in_rep_is_ingroup'] = in_rep_is_ingroup
+        summary['in_rep_is_outgroup'] = in_rep_is_outgroup
+        summary['in_pd'] = in_pd
+        summary['ingroup_taxa'] = len(in_taxa) + len(in_rep_is_ingroup) + len(in_rep_is_outgroup)
+        summary['ingroup_taxa_derep'] = len(in_taxa) + len(set(in_rep_is_outgroup))
+
+        summary['outgroup'] = outgroup
+        summary['out_rep_is_ingroup'] = out_rep_is_ingroup
+        summary['out_rep_is_outgroup'] = out_rep_is_outgroup
+        summary['out_pd'] = out_pd
+        summary['outgroup_taxa'] = len(outgroup) + len(out_rep_is_outgroup) + len(out_rep_is_ingroup)
+        summary['outgroup_taxa_derep'] = len(outgroup) + len(set(out_rep_is_ingroup))
+
+        return summary
+
     def pd(self, tree, taxa_list, rep_list, per_taxa_pg_file):
         """Calculate phylogenetic diversity of extant taxa."""
 
         genome_reps = self._read_reps(rep_list)
         
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree = ArrayTree.read(tree)
+        tree_index = self._tree_index(tree)
                                                                             
         # get total branch length of tree
         self.logger.info('Calculating total PD.')
-        total_pd, total_taxa = self._total_pd(tree)
+        total_pd = tree_index.edge_lengths.sum()
+        total_taxa = len(tree_index.leaf_index)
         self.logger.info('Total PD for %d taxa = %.2f' % (total_taxa, total_pd))
 
-        # get PD of ingroup taxa
+        # get PD of ingroup and outgroup taxa
         self.logger.info('Calculating total PD for specified taxa.')
         ingroup = self._read_taxa_list(taxa_list)
-        
-        in_taxa = set()
-        for leaf in tree.leaf_node_iter():
-            if leaf.taxon.label in ingroup:
-                in_taxa.add(leaf.taxon.label)
-            
-        #tree_in = dendropy.Tree(tree)
-        #tree_in.retain_taxa_with_labels(ingroup)
-        #in_pd, in_taxa = self._total_pd(tree_in)
+        summary = self._pd_summary(tree_index, ingroup, genome_reps)
         
         self.logger.info('Specified ingroup taxa: %d' % len(ingroup))
-        self.logger.info('Ingroup taxa as representatives or singletons in tree: %d' % len(in_taxa))
-
-        # calculate PD for ingroup with additional genomes assigned to a representative
-        ingroup_with_reps, rep_is_ingroup, rep_is_outgroup = self._include_reps(ingroup, None, genome_reps, True)
-        tree_in_with_reps = dendropy.Tree(tree)
-        tree_in_with_reps.retain_taxa_with_labels(ingroup_with_reps)
-        in_pd_with_reps, in_taxa_with_reps = self._total_pd(tree_in_with_reps)
-        
-        self.logger.info('Ingroup taxa represented by another ingroup taxa: %d' % len(rep_is_ingroup))
-        self.logger.info('Ingroup taxa represented by an outgroup taxa: %d' % len(rep_is_outgroup))
-        self.logger.info('Unique outgroup taxa representing an ingroup taxa: %d' % len(set(rep_is_outgroup)))
-        ingroup_taxa = len(in_taxa) + len(rep_is_ingroup) + len(rep_is_outgroup)
-        ingroup_taxa_derep = len(in_taxa) + len(set(rep_is_outgroup))
-        
-        # get PD of outgroup taxa
-        outgroup = set()
-        for leaf in tree.leaf_node_iter():
-            if leaf.taxon.label not in ingroup:
-                outgroup.add(leaf.taxon.label)
+        self.logger.info('Ingroup taxa as representatives or singletons in tree: %d' % len(summary['in_taxa']))
+        self.logger.info('Ingroup taxa represented by another ingroup taxa: %d' % len(summary['in_rep_is_ingroup']))
+        self.logger.info('Ingroup taxa represented by an outgroup taxa: %d' % len(summary['in_rep_is_outgroup']))
+        self.logger.info('Unique outgroup taxa representing an ingroup taxa: %d' % len(set(summary['in_rep_is_outgroup'])))
                 
-        self.logger.info('Outgroup taxa as representatives or singletons in tree: %d' % len(outgroup))
-        
-        # calculate PD for outgroup with additional genomes assigned to a representative
-        #tree_out = dendropy.Tree(tree)
-        #tree_out.retain_taxa_with_labels(outgroup)
-        #out_pd, out_taxa = self._total_pd(tree_out)
-
-        outgroup_with_reps, rep_is_ingroup, rep_is_outgroup = self._include_reps(ingroup, outgroup, genome_reps, False)
-        tree_out_with_reps = dendropy.Tree(tree)
-        tree_out_with_reps.retain_taxa_with_labels(outgroup_with_reps)
-        out_pd_with_reps, out_taxa_with_reps = self._total_pd(tree_out_with_reps)
-                
-        self.logger.info('Outgroup taxa represented by another outgroup taxa: %d' % len(rep_is_outgroup))
-        self.logger.info('Outgroup taxa represented by an ingroup taxa: %d' % len(rep_is_ingroup))
-        self.logger.info('Unique ingroup taxa representing an outgroup taxa: %d' % len(set(rep_is_ingroup)))
-        outgroup_taxa = len(outgroup) + len(rep_is_outgroup) + len(rep_is_ingroup)
-        outgroup_taxa_derep = len(outgroup) + len(set(rep_is_ingroup))
+        self.logger.info('Outgroup taxa as representatives or singletons in tree: %d' % len(summary['outgroup']))
+        self.logger.info('Outgroup taxa represented by another outgroup taxa: %d' % len(summary['out_rep_is_outgroup']))
+        self.logger.info('Outgroup taxa represented by an ingroup taxa: %d' % len(summary['out_rep_is_ingroup']))
+        self.logger.info('Unique ingroup taxa representing an outgroup taxa: %d' % len(set(summary['out_rep_is_ingroup'])))
         
         # calculate PG of each ingroup taxon relative to outgroup in requested
         if per_taxa_pg_file:
             self.logger.info('Calculating PG of each ingroup taxon relative to outgroup.')
-            pg_taxon = self._taxon_pd(tree, ingroup, outgroup.union(rep_is_ingroup), genome_reps)
+            pg_taxon = self._taxon_pd(tree, ingroup, summary['outgroup'].union(summary['out_rep_is_ingroup']), genome_reps)
             
             fout = open(per_taxa_pg_file, 'w')
             fout.write('Taxon\tPG\tPercent PG\tFirst outgroup taxon\n')
@@ -232,85 +340,91 @@ class PhylogeneticDiversity():
                 fout.write('%s\t%f\t%f\t%s\n' % (taxon, pg, pg * 100.0 / total_pd, outgroup_taxon))
             fout.close()
                    
-        return total_pd, ingroup_taxa, ingroup_taxa_derep, in_pd_with_reps, outgroup_taxa, outgroup_taxa_derep, out_pd_with_reps
+        return (total_pd, 
+                summary['ingroup_taxa'], 
+                summary['ingroup_taxa_derep'], 
+                summary['in_pd'], 
+                summary['outgroup_taxa'], 
+                summary['outgroup_taxa_derep'], 
+                summary['out_pd'])
         
-    def _clade_pd(self, tree, ingroup_count, outgroup_count):
-        """Calculate PD for named clades."""
-        
-        pd = {}
-        for node in tree.preorder_node_iter():
-            if not node.label:
-                continue
+    def _leaf_counts(self, leaf_labels, ingroup, genome_reps):
+        """Determine number of ingroup and outgroup genomes represented by each leaf.
 
-            taxon = None
-            if ':' in node.label:
-                _support, taxon = node.label.split(':')
-            else:
-                if not is_float(node.label):
-                    taxon = node.label
+        Parameters
+        ----------
+        leaf_labels : iterable
+            Labels of leaf nodes in tree.
+        ingroup : set
+            Ingroup taxa.
+        genome_reps : d[genome_id] -> representative
+            Representative of each genome.
 
-            if taxon:
-                taxon_pd = 0
-                taxon_count = 0
-                in_taxon_pd = 0
-                in_taxon_count = 0
-                in_taxon_derep = 0
-                out_taxon_pd = 0
-                out_taxon_count = 0
-                out_taxon_derep = 0
-                for nn in node.postorder_iter():
-                    if nn == node:
-                        continue
-                        
-                    # check if group contains taxa from
-                    # the ingroup and/or outgroup
-                    ingroup_leaves = False
-                    outgroup_leaves = False
-                    for leaf in nn.leaf_iter():
-                        genome_id = leaf.taxon.label
-                        if genome_id in ingroup_count:
-                            ingroup_leaves = True
-                        
-                        if genome_id in outgroup_count:
-                            outgroup_leaves = True
-                            
-                    if ingroup_leaves:
-                        in_taxon_pd += nn.edge.length
-
-                    if outgroup_leaves:
-                        out_taxon_pd += nn.edge.length
-                        
-                    if nn.is_leaf():
-                        genome_id = nn.taxon.label
-                        
-                        in_taxon_count += ingroup_count.get(genome_id, 0)
-                        if genome_id in ingroup_count:
-                            in_taxon_derep += 1
-                            
-                        out_taxon_count += outgroup_count.get(genome_id, 0)
-                        if genome_id in outgroup_count:
-                            out_taxon_derep += 1
-                            
-                    taxon_pd += nn.edge.length
-
-                if taxon == 'd__Archaea':
-                    print(taxon_count, in_taxon_count, out_taxon_count, in_taxon_pd, out_taxon_pd)
-                pd[taxon] = [taxon_pd, in_taxon_pd, in_taxon_count, in_taxon_derep, out_taxon_pd, out_taxon_count, out_taxon_derep]
+        Returns
+        -------
+        d[genome_id] -> count
+            Number of ingroup genomes represented by each genome.
+        d[genome_id] -> count
+            Number of outgroup genomes represented by each genome.
+        """
+
+        ingroup_count = defaultdict(int)
+        outgroup_count = defaultdict(int)
+        for genome_id in genome_reps:
+            rep_id = genome_reps[genome_id]
                 
-        return pd
+            if genome_id in ingroup:
+                ingroup_count[rep_id] += 1
+            else:
+                outgroup_count[rep_id] += 1
+                
+        # add count for singletons
+        for genome_id in leaf_labels:
+            if genome_id in ingroup and genome_id not in ingroup_count:
+                ingroup_count[genome_id] = 1 # ingroup singleton
+            elif genome_id not in ingroup and genome_id not in  outgroup_count:
+                outgroup_count[genome_id] = 1 # outgroup singleton
+
+        return ingroup_count, outgroup_count
+
+    def _clade_header(self):
+        """Header for table reporting PD of named clades."""
+
+        header = 'Clade'
+        header += '\tTaxa\tTaxa (derep)\tPD\tPercent PD'
+        header += '\tOut Taxa\tOut Taxa (derep)\tOut PD\tOut Percent PD'
+        header += '\tIn Taxa\tIn Taxa (derep)\tIn PD\tIn Percent PD'
+        header += '\tIn PG\tIn Percent PG'
+
+        return header
+
+    def _clade_row(self, taxon, clade_stats, total_pd):
+        """Row for table reporting PD of named clades."""
+
+        taxon_pd, in_taxon_pd, in_taxon_count, in_taxon_derep, out_taxon_pd, out_taxon_count, out_taxon_derep = clade_stats
+        taxon_count = in_taxon_count + out_taxon_count
+        taxon_derep = in_taxon_derep + out_taxon_derep
+        in_taxon_pg = taxon_pd - out_taxon_pd
+        
+        taxon_pd = max(taxon_pd, 1e-9) # make sure PD is never exactly zero to avoid division errors
         
+        row = taxon
+        row += '\t%d\t%d\t%.2f\t%.2f' % (taxon_count, taxon_derep, taxon_pd, taxon_pd * 100 / total_pd)
+        row += '\t%d\t%d\t%.2f\t%.2f' % (out_taxon_count, out_taxon_derep, out_taxon_pd, out_taxon_pd * 100 / taxon_pd)
+        row += '\t%d\t%d\t%.2f\t%.2f' % (in_taxon_count, in_taxon_derep, in_taxon_pd, in_taxon_pd * 100 / taxon_pd)
+        row += '\t%.2f\t%.2f' % (in_taxon_pg, in_taxon_pg * 100 / taxon_pd)
+
+        return row
+
     def pd_clade(self, decorated_tree, output_file, taxa_list, rep_list):
         """Calculate phylogenetic diversity of named groups."""
         
         # calculate PD for entire tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(decorated_tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree_index = self._tree_index(ArrayTree.read(decorated_tree))
  
         self.logger.info('Calculating total PD.')
-        total_pd, total_taxa = self._total_pd(tree)
+        total_pd = tree_index.edge_lengths.sum()
         
         # get ingroup and outgroup taxa
         ingroup = self._read_taxa_list(taxa_list)
@@ -319,53 +433,404 @@ class PhylogeneticDiversity():
         # get number of ingroup and outgroup genomes 
         # representated by each leaf node
         genome_reps = self._read_reps(rep_list)
-        
-        ingroup_count = defaultdict(int)
-        outgroup_count = defaultdict(int)
-        for genome_id in genome_reps:
-            rep_id = genome_reps[genome_id]
-                
-            if genome_id in ingroup:
-                ingroup_count[rep_id] += 1
-            else:
-                outgroup_count[rep_id] += 1
-                
-        # add count for singletons
-        for leaf in tree.leaf_node_iter():
-            genome_id = leaf.taxon.label
-            
-            if genome_id in ingroup and genome_id not in ingroup_count:
-                ingroup_count[genome_id] = 1 # ingroup singleton
-            elif genome_id not in ingroup and genome_id not in  outgroup_count:
-                outgroup_count[genome_id] = 1 # outgroup singleton
+        ingroup_count, outgroup_count = self._leaf_counts(tree_index.leaf_index, ingroup, genome_reps)
 
         # PD for named groups
         self.logger.info('Calculating PD for named clades.')
-        pd_clade = self._clade_pd(tree, ingroup_count, outgroup_count)
-        
-        print('ingroup_count, outgroup_count', len(ingroup_count), len(outgroup_count))
+        pd_clade = self._clade_pd(tree_index, ingroup_count, outgroup_count)
 
         # report results
         fout = open(output_file, 'w')
-        fout.write('Clade')
-        fout.write('\tTaxa\tTaxa (derep)\tPD\tPercent PD')
-        fout.write('\tOut Taxa\tOut Taxa (derep)\tOut PD\tOut Percent PD')
-        fout.write('\tIn Taxa\tIn Taxa (derep)\tIn PD\tIn Percent PD')
-        fout.write('\tIn PG\tIn Percent PG\n')
+        fout.write(self._clade_header() + '\n')
         
         ordered_taxa = Taxonomy().sort_taxa(list(pd_clade.keys()))
         for taxon in ordered_taxa:
-            taxon_pd, in_taxon_pd, in_taxon_count, in_taxon_derep, out_taxon_pd, out_taxon_count, out_taxon_derep = pd_clade[taxon]
-            taxon_count = in_taxon_count + out_taxon_count
-            taxon_derep = in_taxon_derep + out_taxon_derep
-            in_taxon_pg = taxon_pd - out_taxon_pd
-            
-            taxon_pd = max(taxon_pd, 1e-9) # make sure PD is never exactly zero to avoid division errors
-            
-            row = taxon
-            row += '\t%d\t%d\t%.2f\t%.2f' % (taxon_count, taxon_derep, taxon_pd, taxon_pd * 100 / total_pd)
-            row += '\t%d\t%d\t%.2f\t%.2f' % (out_taxon_count, out_taxon_derep, out_taxon_pd, out_taxon_pd * 100 / taxon_pd)
-            row += '\t%d\t%d\t%.2f\t%.2f' % (in_taxon_count, in_taxon_derep, in_taxon_pd, in_taxon_pd * 100 / taxon_pd)
-            row += '\t%.2f\t%.2f' % (in_taxon_pg, in_taxon_pg * 100 / taxon_pd)
+            fout.write(self._clade_row(taxon, pd_clade[taxon], total_pd) + '\n')
+        fout.close()
+
+    def _clade_pd(self, tree_index, ingroup_count, outgroup_count):
+        """Calculate PD for named clades.
+
+        Statistics for all named clades are calculated with a
+        constant number of array operations per clade.
+        """
+
+        num_nodes = len(tree_index.edge_lengths)
+        in_count = np.zeros(num_nodes)
+        in_derep = np.zeros(num_nodes)
+        out_count = np.zeros(num_nodes)
+        out_derep = np.zeros(num_nodes)
+        for genome_id, leaf in tree_index.leaf_index.items():
+            if genome_id in ingroup_count:
+                in_count[leaf] = ingroup_count[genome_id]
+                in_derep[leaf] = 1
+
+            if genome_id in outgroup_count:
+                out_count[leaf] = outgroup_count[genome_id]
+                out_derep[leaf] = 1
+
+        # edges leading to ingroup or outgroup leaves
+        in_edges = tree_index.edge_lengths * (self._taxa_below(tree_index, in_derep) > 0)
+        out_edges = tree_index.edge_lengths * (self._taxa_below(tree_index, out_derep) > 0)
+
+        # sum values over all nodes below each named clade
+        clade_nodes = np.array([node for node, _taxon in tree_index.clades], dtype=int)
+        first_desc = clade_nodes + 1
+        subtree_end = tree_index.subtree_end[clade_nodes]
+        stats = []
+        for values in [tree_index.edge_lengths, 
+                        in_edges, in_count, in_derep, 
+                        out_edges, out_count, out_derep]:
+            cumulative = np.concatenate(([0], np.cumsum(values)))
+            stats.append(cumulative[subtree_end] - cumulative[first_desc])
+
+        pd = {}
+        for i, (_node, taxon) in enumerate(tree_index.clades):
+            pd[taxon] = [stats[0][i], 
+                            stats[1][i], int(stats[2][i]), int(stats[3][i]), 
+                            stats[4][i], int(stats[5][i]), int(stats[6][i])]
+
+        return pd
+
+    def _read_manifest(self, manifest_file):
+        """Read taxa lists and representative lists to process in batch.
+
+        The manifest file should have the format:
+          <taxa list>\t<rep list>\n
+        where the representative list is optional.
+        """
+
+        manifest = []
+        for line in open(manifest_file):
+            if line[0] == '#' or not line.strip():
+                continue
+
+            line_split = [x.strip() for x in line.split('\t')]
+            taxa_list = line_split[0]
+            rep_list = None
+            if len(line_split) >= 2 and line_split[1]:
+                rep_list = line_split[1]
+
+            manifest.append((taxa_list, rep_list))
+
+        return manifest
+
+    def _pd_batch_producer(self, batch_item):
+        """Calculate PD statistics for a single taxa list.
+
+        Parameters
+        ----------
+        batch_item : (int, str, str)
+            Index, taxa list, and representative list to process.
+        """
+
+        list_index, taxa_list, rep_list = batch_item
+
+        ingroup = self._read_taxa_list(taxa_list)
+        genome_reps = self._read_reps(rep_list)
+        summary = self._pd_summary(self.tree_index, ingroup, genome_reps)
+
+        pd_clade = None
+        if self.tree_index.clades:
+            ingroup_count, outgroup_count = self._leaf_counts(self.tree_index.leaf_index, 
+                                                                ingroup, 
+                                                                genome_reps)
+            pd_clade = self._clade_pd(self.tree_index, ingroup_count, outgroup_count)
+
+        return (list_index,
+                summary['ingroup_taxa'],
+                summary['ingroup_taxa_derep'],
+                summary['in_pd'],
+                summary['outgroup_taxa'],
+                summary['outgroup_taxa_derep'],
+                summary['out_pd'],
+                pd_clade)
+
+    def _pd_batch_consumer(self, produced_data, consumer_data):
+        """Collect PD statistics for each taxa list."""
+
+        if consumer_data == None:
+            consumer_data = {}
+
+        consumer_data[produced_data[0]] = produced_data[1:]
+
+        return consumer_data
+
+    def _pd_batch_progress(self, processed_items, total_items):
+        """Report progress of taxa lists."""
+
+        return '==> Processed %d of %d taxa lists.' % (processed_items, total_items)
+
+    def pd_batch(self, tree, manifest_file, output_dir):
+        """Calculate phylogenetic diversity for many taxa lists.
+
+        The tree is read and indexed once, and all taxa lists
+        are then evaluated in parallel. If the tree contains
+        named clades, the PD of each clade is also reported
+        for each taxa list.
+
+        Parameters
+        ----------
+        tree : str
+            Newick tree.
+        manifest_file : str
+            File indicating taxa list and optional representative list to process.
+        output_dir : str
+            Directory to store results.
+
+        Returns
+        -------
+        str
+            Table with PD of each taxa list.
+        str
+            Table with PD of named clades for each taxa list, or None if tree has no named clades.
+        """
+
+        manifest = self._read_manifest(manifest_file)
+        self.logger.info('Read %d taxa lists to process.' % len(manifest))
+
+        self.logger.info('Reading tree.')
+        self.tree_index = self._tree_index(ArrayTree.read(tree))
+
+        total_pd = self.tree_index.edge_lengths.sum()
+        self.logger.info('Total PD for %d taxa = %.2f' % (len(self.tree_index.leaf_index), total_pd))
+        self.logger.info('Identified %d named clades.' % len(self.tree_index.clades))
+
+        self.logger.info('Calculating PD for each taxa list:')
+        batch_items = [(i, taxa_list, rep_list) for i, (taxa_list, rep_list) in enumerate(manifest)]
+        parallel = Parallel(self.cpus)
+        results = parallel.run(self._pd_batch_producer, 
+                                self._pd_batch_consumer, 
+                                batch_items, 
+                                self._pd_batch_progress)
+
+        # report PD and PG of each taxa list
+        pd_file = os.path.join(output_dir, 'pd_batch.tsv')
+        fout = open(pd_file, 'w')
+        fout.write('Taxa list\tRep list')
+        fout.write('\tIngroup taxa\tIngroup taxa (derep)\tIngroup PD\tIngroup percent PD')
+        fout.write('\tOutgroup taxa\tOutgroup taxa (derep)\tOutgroup PD\tOutgroup percent PD')
+        fout.write('\tIngroup PG\tIngroup percent PG\n')
+        for i, (taxa_list, rep_list) in enumerate(manifest):
+            in_taxa, in_taxa_derep, in_pd, out_taxa, out_taxa_derep, out_pd, _pd_clade = results[i]
+            in_pg = total_pd - out_pd
+
+            row = '%s\t%s' % (taxa_list, rep_list if rep_list else '')
+            row += '\t%d\t%d\t%.2f\t%.3f' % (in_taxa, in_taxa_derep, in_pd, in_pd * 100 / total_pd)
+            row += '\t%d\t%d\t%.2f\t%.3f' % (out_taxa, out_taxa_derep, out_pd, out_pd * 100 / total_pd)
+            row += '\t%.2f\t%.3f' % (in_pg, in_pg * 100 / total_pd)
             fout.write(row + '\n')
         fout.close()
+
+        # report PD of named clades for each taxa list
+        pd_clade_file = None
+        if self.tree_index.clades:
+            pd_clade_file = os.path.join(output_dir, 'pd_clade_batch.tsv')
+            fout = open(pd_clade_file, 'w')
+            fout.write('Taxa list\t' + self._clade_header() + '\n')
+
+            ordered_taxa = Taxonomy().sort_taxa(list(set([taxon for _node, taxon in self.tree_index.clades])))
+            for i, (taxa_list, _rep_list) in enumerate(manifest):
+                pd_clade = results[i][-1]
+                for taxon in ordered_taxa:
+                    fout.write('%s\t%s\n' % (taxa_list, self._clade_row(taxon, pd_clade[taxon], total_pd)))
+            fout.close()
+
+        return pd_file, pd_clade_file
+
+    def _sample_range(self, tree_index, leaves):
+        """Determine range of preorder indices spanned by the MRCA of a set of leaves.
+
+        Edges outside the subtree of the MRCA always lead to either
+        all or none of the leaves so can never contribute to PD.
+        """
+
+        first_leaf = leaves.min()
+        last_leaf = leaves.max()
+        node_indices = np.arange(len(tree_index.edge_lengths))
+        spanning = (node_indices <= first_leaf) & (tree_index.subtree_end > last_leaf)
+        mrca = node_indices[spanning].max()
+
+        return mrca, tree_index.subtree_end[mrca]
+
+    def _batch_subset_pd(self, edge_lengths, subtree_end, samples):
+        """Calculate PD of many equal sized sets of taxa.
+
+        Each set of taxa is encoded as a row of a leaf-membership
+        matrix with nodes in preorder so the number of sampled taxa
+        below each node is the difference between two cumulative sums.
+
+        Parameters
+        ----------
+        edge_lengths : np.array
+            Edge length of nodes in preorder.
+        subtree_end : np.array
+            End of subtree range of nodes in preorder.
+        samples : np.array
+            Index of sampled leaves, one set of taxa per row.
+
+        Returns
+        -------
+        np.array
+            PD of each set of taxa.
+        """
+
+        num_samples, sample_size = samples.shape
+
+        cumulative = np.zeros((num_samples, len(edge_lengths) + 1), dtype=np.int32)
+        rows = np.repeat(np.arange(num_samples), sample_size)
+        cumulative[rows, samples.ravel() + 1] = 1
+        np.cumsum(cumulative, axis=1, out=cumulative)
+
+        taxa_below = cumulative[:, subtree_end] - cumulative[:, :-1]
+        spanning_edges = (taxa_below > 0) & (taxa_below < sample_size)
+
+        return spanning_edges.dot(edge_lengths)
+
+    def _rarefaction_producer(self, rarefaction_job):
+        """Calculate PD of random subsamples of taxa.
+
+        Parameters
+        ----------
+        rarefaction_job : (int, int, np.random.SeedSequence)
+            Subsample size, number of replicates, and seed for random draws.
+        """
+
+        sample_size, replicates, seed = rarefaction_job
+
+        rng = np.random.default_rng(seed)
+        draws = rng.random((replicates, len(self.sample_leaves)))
+        if sample_size < len(self.sample_leaves):
+            draws = np.argpartition(draws, sample_size - 1, axis=1)[:, 0:sample_size]
+        else:
+            draws = np.argsort(draws, axis=1)
+        samples = self.sample_leaves[draws]
+
+        pd = self._batch_subset_pd(self.sample_edge_lengths, 
+                                    self.sample_subtree_end, 
+                                    samples)
+
+        return (sample_size, tuple(pd))
+
+    def _rarefaction_consumer(self, produced_data, consumer_data):
+        """Collect PD of random subsamples for each subsample size."""
+
+        if consumer_data == None:
+            consumer_data = defaultdict(list)
+
+        sample_size, pd = produced_data
+        consumer_data[sample_size].extend(pd)
+
+        return consumer_data
+
+    def _rarefaction_progress(self, processed_items, total_items):
+        """Report progress of rarefaction batches."""
+
+        return '==> Processed %d of %d batches of random subsamples.' % (processed_items, total_items)
+
+    def pd_rarefaction(self, tree, output_file, taxa_list, clade, num_sizes, replicates, confidence, seed):
+        """Calculate expected PD of random subsamples of taxa.
+
+        Taxa are subsampled without replacement at a series of
+        subsample sizes and the PD of each subsample calculated.
+        Replicates are evaluated in batches as leaf-membership
+        matrices, with batches processed in parallel.
+
+        Parameters
+        ----------
+        tree : str
+            Newick tree.
+        output_file : str
+            Output file.
+        taxa_list : str
+            List of taxa to subsample, or None to subsample all taxa in clade or tree.
+        clade : str
+            Named clade to subsample, or None to subsample all taxa in taxa list or tree.
+        num_sizes : int
+            Number of subsample sizes to evaluate.
+        replicates : int
+            Number of random subsamples to draw at each subsample size.
+        confidence : float
+            Width of confidence band to report [0, 100].
+        seed : int
+            Seed for random number generator.
+        """
+
+        self.logger.info('Reading tree.')
+        tree_index = self._tree_index(ArrayTree.read(tree))
+
+        # get taxa to subsample
+        taxa = set(tree_index.leaf_index)
+        if clade:
+            clade_node = [node for node, taxon in tree_index.clades if taxon == clade]
+            if not clade_node:
+                self.logger.error('Clade %s is not a named group in the tree.' % clade)
+                sys.exit(-1)
+
+            clade_node = clade_node[0]
+            clade_end = tree_index.subtree_end[clade_node]
+            taxa = set([taxon for taxon, leaf in tree_index.leaf_index.items() 
+                            if clade_node <= leaf < clade_end])
+
+        if taxa_list:
+            taxa = taxa.intersection(self._read_taxa_list(taxa_list))
+
+        if len(taxa) < 2:
+            self.logger.error('At least 2 taxa must be in the tree in order to calculate rarefied PD.')
+            sys.exit(-1)
+
+        self.logger.info('Subsampling %d taxa.' % len(taxa))
+
+        # restrict calculations to the subtree spanning the taxa 
+        leaves = np.array(sorted([tree_index.leaf_index[taxon] for taxon in taxa]))
+        start, end = self._sample_range(tree_index, leaves)
+        self.sample_leaves = leaves - start
+        self.sample_edge_lengths = tree_index.edge_lengths[start:end]
+        self.sample_subtree_end = tree_index.subtree_end[start:end] - start
+
+        total_pd = self._batch_subset_pd(self.sample_edge_lengths,
+                                            self.sample_subtree_end,
+                                            self.sample_leaves[np.newaxis, :])[0]
+        self.logger.info('PD of all subsampled taxa = %.2f' % total_pd)
+
+        # divide replicates into batches with a bounded membership matrix
+        max_cells = 2**24
+        batch_size = max(1, min(replicates, max_cells // len(self.sample_edge_lengths)))
+        sample_sizes = np.unique(np.linspace(1, len(taxa), num_sizes).round().astype(int))
+
+        seed_seq = np.random.SeedSequence(seed)
+        rarefaction_jobs = []
+        for sample_size in sample_sizes:
+            for batch_start in range(0, replicates, batch_size):
+                num_reps = min(batch_size, replicates - batch_start)
+                rarefaction_jobs.append((int(sample_size), num_reps, seed_seq.spawn(1)[0]))
+
+        self.logger.info('Calculating PD for %d subsample sizes with %d replicates each:' % (len(sample_sizes), replicates))
+        parallel = Parallel(self.cpus)
+        pd = parallel.run(self._rarefaction_producer,
+                            self._rarefaction_consumer,
+                            rarefaction_jobs,
+                            self._rarefaction_progress)
+
+        # report expected PD and confidence band at each subsample size
+        lower_percentile = 0.5 * (100 - confidence)
+        upper_percentile = 100 - lower_percentile
+
+        fout = open(output_file, 'w')
+        fout.write('Subsample size\tReplicates\tMean PD\tStd PD')
+        fout.write('\tLower PD (%g%%)\tUpper PD (%g%%)\tMean percent PD\n' % (lower_percentile, upper_percentile))
+        for sample_size in sample_sizes:
+            sample_pd = np.array(pd[sample_size])
+            mean_pd = sample_pd.mean()
+            lower_pd, upper_pd = np.percentile(sample_pd, [lower_percentile, upper_percentile])
+
+            fout.write('%d\t%d\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\n' % (sample_size, 
+                                                                    len(sample_pd),
+                                                                    mean_pd,
+                                                                    sample_pd.std(),
+                                                                    lower_pd,
+                                                                    upper_pd,
+                                                                    mean_pd * 100 / max(total_pd, 1e-9)))
+        fout.close()
+
+        return total_pd, len(taxa)
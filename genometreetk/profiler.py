@@ -0,0 +1,298 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+class Profiler(object):
+    """Record resource usage of workflow stages as JSON lines.
+
+    Each stage produces a record with its wall time, CPU time of
+    the process and of waited for child processes, peak resident
+    set size, number of files opened for reading, bytes read, and
+    any item counters incremented during the stage. Stages can be
+    nested, in which case the name of a stage includes the names
+    of all enclosing stages. Each external program run through
+    os.system or subprocess is recorded along with its exit code
+    and duration, including programs run by forked worker
+    processes. Profiling is disabled unless open() is called, in
+    which case stages and counters have no effect.
+    """
+
+    def __init__(self):
+        """Initialization."""
+
+        self.fd = None
+        self.stack = []
+        self.local = threading.local()
+        self.audit_hook = False
+
+    def open(self, profile_file):
+        """Start writing profiling records to file.
+
+        Parameters
+        ----------
+        profile_file : str
+            Output file for JSON lines records.
+        """
+
+        # records are written with a single unbuffered write so
+        # lines from worker processes are never interleaved
+        self.fd = os.open(profile_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+
+        if not self.audit_hook:
+            sys.addaudithook(self._audit)
+            self.audit_hook = True
+
+        self._wrap_tools()
+
+    @property
+    def enabled(self):
+        """Check if profiling is enabled."""
+
+        return self.fd is not None
+
+    def _write(self, record):
+        """Write record as a single JSON line."""
+
+        record['pid'] = os.getpid()
+        record['time'] = time.time()
+        os.write(self.fd, (json.dumps(record, sort_keys=True) + '\n').encode('utf-8'))
+
+    def _audit(self, event, args):
+        """Count files opened for reading by the current stage."""
+
+        if event != 'open' or not self.stack or getattr(self.local, 'reading_io', False):
+            return
+
+        path, mode, flags = args
+        if not isinstance(path, (str, bytes)):
+            return
+
+        if mode is not None:
+            reading = 'r' in mode or '+' in mode
+        else:
+            reading = (flags & os.O_ACCMODE) != os.O_WRONLY
+
+        if reading:
+            self.stack[-1]['files_read'] += 1
+
+    def _bytes_read(self):
+        """Get number of bytes read by this process, if available."""
+
+        self.local.reading_io = True
+        try:
+            with open('/proc/self/io') as f:
+                for line in f:
+                    if line.startswith('rchar:'):
+                        return int(line.split()[1])
+        except (IOError, OSError):
+            return None
+        finally:
+            self.local.reading_io = False
+
+        return None
+
+    def _usage(self):
+        """Get CPU time and peak memory of process and its children."""
+
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        return {'cpu': self_usage.ru_utime + self_usage.ru_stime,
+                'cpu_children': child_usage.ru_utime + child_usage.ru_stime,
+                'peak_rss': self_usage.ru_maxrss,
+                'peak_rss_children': child_usage.ru_maxrss}
+
+    @contextmanager
+    def stage(self, name):
+        """Record resource usage of a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of stage.
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        path = '/'.join([s['name'] for s in self.stack] + [name])
+        start_usage = self._usage()
+        start_bytes = self._bytes_read()
+        state = {'name': name,
+                    'path': path,
+                    'files_read': 0,
+                    'counters': defaultdict(int)}
+        self.stack.append(state)
+
+        start = time.time()
+        status = 'failed'
+        try:
+            yield
+            status = 'completed'
+        finally:
+            wall = time.time() - start
+            end_usage = self._usage()
+            end_bytes = self._bytes_read()
+            self.stack.pop()
+
+            bytes_read = None
+            if start_bytes is not None and end_bytes is not None:
+                bytes_read = end_bytes - start_bytes
+
+            self._write({'type': 'stage',
+                            'stage': path,
+                            'status': status,
+                            'wall_time': wall,
+                            'cpu_time': end_usage['cpu'] - start_usage['cpu'],
+                            'cpu_time_children': end_usage['cpu_children'] - start_usage['cpu_children'],
+                            'peak_rss_kb': end_usage['peak_rss'],
+                            'peak_rss_children_kb': end_usage['peak_rss_children'],
+                            'files_read': state['files_read'],
+                            'bytes_read': bytes_read,
+                            'counters': dict(state['counters'])})
+
+            # counts also apply to enclosing stage
+            if self.stack:
+                self.stack[-1]['files_read'] += state['files_read']
+                for counter, value in state['counters'].items():
+                    self.stack[-1]['counters'][counter] += value
+
+    def count(self, counter, value=1):
+        """Increment item counter of current stage.
+
+        Parameters
+        ----------
+        counter : str
+            Name of counter (e.g., genomes, pairs, markers).
+        value : int
+            Amount to increment counter.
+        """
+
+        if self.enabled and self.stack:
+            self.stack[-1]['counters'][counter] += value
+
+    def event(self, event_type, **fields):
+        """Record an event occurring within the current stage.
+
+        Parameters
+        ----------
+        event_type : str
+            Type of event.
+        fields : dict
+            Values describing event.
+        """
+
+        if not self.enabled:
+            return
+
+        record = dict(fields)
+        record['type'] = event_type
+        record['stage'] = self.stack[-1]['path'] if self.stack else None
+        self._write(record)
+
+    def _tool_name(self, cmd):
+        """Get name of program from command."""
+
+        if isinstance(cmd, (list, tuple)):
+            cmd = cmd[0] if cmd else ''
+            return os.path.basename(str(cmd))
+
+        # ignore shell options set before command
+        tokens = str(cmd).split(';')[-1].split()
+        if not tokens:
+            return ''
+
+        return os.path.basename(tokens[0])
+
+    def _timed(self, func, wait_status=False):
+        """Wrap function running an external program so it is recorded."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # only record outermost call as subprocess functions call one another
+            if getattr(self.local, 'in_tool', False):
+                return func(*args, **kwargs)
+
+            cmd = args[0] if args else kwargs.get('args', '')
+            self.local.in_tool = True
+            start = time.time()
+            rtn = None
+            try:
+                rtn = func(*args, **kwargs)
+                return rtn
+            finally:
+                self.local.in_tool = False
+                exit_code = rtn
+                if wait_status and isinstance(rtn, int):
+                    exit_code = os.waitstatus_to_exitcode(rtn)
+                elif isinstance(rtn, subprocess.CompletedProcess):
+                    exit_code = rtn.returncode
+                elif not isinstance(rtn, int):
+                    exit_code = None
+
+                self.event('tool',
+                            tool=self._tool_name(cmd),
+                            command=cmd if isinstance(cmd, str) else ' '.join(map(str, cmd)),
+                            exit_code=exit_code,
+                            wall_time=time.time() - start)
+
+        wrapper.profiled = True
+        return wrapper
+
+    def _wrap_tools(self):
+        """Record external programs run through os.system or subprocess."""
+
+        if getattr(os.system, 'profiled', False):
+            return
+
+        os.system = self._timed(os.system, wait_status=True)
+        for func_name in ['call', 'check_call', 'check_output', 'run']:
+            setattr(subprocess, func_name, self._timed(getattr(subprocess, func_name)))
+
+
+profiler = Profiler()
+
+
+def profiled(stage_name):
+    """Decorator recording resource usage of a function as a stage.
+
+    Parameters
+    ----------
+    stage_name : str
+        Name of stage.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -30,6 +30,8 @@ from genometreetk.common import (read_gtdb_metadata,
                                     read_gtdb_taxonomy,
                                     read_gtdb_ncbi_taxonomy,
                                     read_gtdb_ncbi_type_strain)
+from genometreetk.minhash import MinHashSketch
+from genometreetk.profiler import profiler, profiled
 import genometreetk.ncbi as ncbi
 
 class Representatives(object):
@@ -51,10 +53,18 @@ class Representatives(object):
     to User representatives.
     """
 
-    def __init__(self):
-        """Initialization."""
+    def __init__(self, cpus=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use when calculating distances from genome sketches.
+        """
 
         self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
         
         self.prev_rep_quality_boost = 5.0
         
@@ -106,6 +116,7 @@ class Representatives(object):
            
         return genome_ids
         
+    @profiled('genome_stats')
     def _genome_stats(self, metadata_file):
         """Genome genome and assembly quality metadata."""
         
@@ -126,6 +137,8 @@ class Representatives(object):
                                                     'ncbi_taxonomy',
                                                     'ncbi_organism_name',
                                                     'lpsn_strain'])
+
+        profiler.count('genomes', len(stats))
  
         return stats
 
@@ -151,6 +164,7 @@ class Representatives(object):
 
         self.logger.info('Retained %d additional genomes to ensure a LPSN type strain in each species.' % lpsn_genomes)
    
+    @profiled('dereplicate_species')
     def _dereplicate_species(self, 
                                 genomes_to_consider,
                                 max_species,
@@ -583,8 +597,20 @@ class Representatives(object):
                     + sorted_genbank_rep_genomes
                     + sorted_trusted_user_rep_genomes)
                     
+    @profiled('read_mash_dists')
     def _read_mash_dists(self, mash_pairwise_file):
-        """Read Mash distance file."""
+        """Read Mash distance file.
+
+        Distances within the largest clustering threshold are
+        calculated directly from genome sketches if a directory
+        created with the sketch command is given instead of a file.
+        """
+
+        if os.path.isdir(mash_pairwise_file):
+            max_dist = max(self.mash_strict_threshold,
+                            self.mash_gtdb_species_threshold,
+                            self.mash_ncbi_species_threshold)
+            return defaultdict(lambda: {}, MinHashSketch(self.cpus).read_dists(mash_pairwise_file, max_dist))
 
         dists = defaultdict(lambda: {})
         for line in open(mash_pairwise_file):
@@ -597,8 +623,11 @@ class Representatives(object):
                 
             dists[query_genome][ref_genome] = float(line_split[2])
 
+        profiler.count('pairs', sum(len(d) for d in dists.values()))
+
         return dists
 
+    @profiled('greedy_representatives')
     def _greedy_representatives(self,
                                 representatives,
                                 ordered_genomes,
@@ -680,6 +709,9 @@ class Representatives(object):
         sys.stdout.flush()
         sys.stdout.write('\n')
 
+        profiler.count('genomes', total_genomes)
+        profiler.count('representatives', len(representatives))
+
         return representatives
 
     def representatives(self,
@@ -718,7 +750,7 @@ class Representatives(object):
         trusted_user_file : str
             File listing trusted User genomes that should be treated as if they are in GenBank.
         mash_pairwise_file : str
-          File with pairwise Mash distances.
+          File with pairwise Mash distances, or directory with genome sketches.
         min_rep_comp : float [0, 100]
             Minimum completeness for a genome to be a representative.
         max_rep_cont : float [0, 100]
@@ -858,7 +890,7 @@ class Representatives(object):
         metadata_file : str
           Metadata, including CheckM estimates, for all genomes.
         mash_pairwise_file : str
-          File with pairwise Mash distances.
+          File with pairwise Mash distances, or directory with genome sketches.
         output_file : str
           Output file indicating genome clusters.
         """
@@ -946,4 +978,5 @@ class Representatives(object):
 
         fout.close()
         
-        self.logger.info('Assigned %d genomes to representatives.' % clustered_genomes)
\ No newline at end of file
+        self.logger.info('Assigned %d genomes to representatives.' % clustered_genomes)
+        profiler.count('clustered_genomes', clustered_genomes)
\ No newline at end of file
@@ -15,6 +15,7 @@
 #                                                                             #
 ###############################################################################
 
+import os
 import sys
 import logging
 
@@ -22,37 +23,69 @@ import dendropy
 
 from biolib.newick import parse_label, create_label
 
+from genometreetk.parallel import Parallel
+
 
 class RerootTree(object):
     """Reroot tree."""
 
-    def __init__(self):
-        """Initialization."""
+    def __init__(self, cpus=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use when rerooting trees in batch.
+        """
+
         self.logger = logging.getLogger()
+
+        self.cpus = cpus
         
     def _reroot(self, tree, outgroup_node, max_support=100):
         """Reroot tree taking proper care of bootstrap values."""
 
-        # determine support values for each bipartition
+        # collapse a basal bifurcation and suppress unifurcations
+        # as neither define a bipartition in an unrooted tree
         tree.encode_bipartitions()
+
+        # determine support values for the bipartition of each node
         support_values = {}
+        label_info = {}
         for nd in tree:
             support, taxon, aux_info = parse_label(nd.label)
+            label_info[nd] = (taxon, aux_info)
             if nd.is_leaf():
-                support_values[nd.bipartition] = max_support
+                support_values[nd] = max_support
             else:
                 if support:
-                    support_values[nd.bipartition] = int(support)
+                    support_values[nd] = int(support)
                 else:
-                    support_values[nd.bipartition] = None
+                    support_values[nd] = None
+
+        # a basal bifurcation remaining after suppressing unifurcations
+        # is a single bipartition, which takes the support of the last
+        # of the two nodes defining it
+        if len(tree.seed_node.child_nodes()) == 2:
+            child1, child2 = tree.seed_node.child_nodes()
+            support_values[child1] = support_values[child2]
      
-        # move support values for desired re-rooting
+        # move support values for desired re-rooting; the bipartition
+        # of an edge is unchanged by reseeding the tree, but edges on
+        # the path from the new to the old root change direction so
+        # their support values shift to the parent node, and the new
+        # root takes on the support of the old root
         new_root = outgroup_node.parent_node
+        path_support = support_values[tree.seed_node]
+        nd = new_root
+        while nd is not None:
+            support_values[nd], path_support = path_support, support_values[nd]
+            nd = nd.parent_node
+
         tree.reseed_at(new_root)
-        tree.encode_bipartitions()
         for nd in tree:
-            _, taxon, aux_info = parse_label(nd.label)
-            nd.label = create_label(support_values.get(nd.bipartition, "not_specified"), taxon, aux_info)
+            taxon, aux_info = label_info[nd]
+            nd.label = create_label(support_values[nd], taxon, aux_info)
         tree.seed_node.edge.length = None
      
         # do a hard re-rooting of the tree
@@ -76,6 +109,53 @@ class RerootTree(object):
  
         return tree
 
+    def _outgroup_in_tree(self, tree, outgroup):
+        """Get outgroup taxa in tree.
+
+        Parameters
+        ----------
+        tree : dendropy.Tree
+          Tree to search for outgroup taxa.
+        outgroup : set
+          Labels of taxa in outgroup.
+
+        Returns
+        -------
+        list
+          Labels of outgroup taxa in tree.
+        """
+
+        taxa_labels = set(leaf.taxon.label for leaf in tree.leaf_node_iter())
+
+        return sorted(outgroup.intersection(taxa_labels))
+
+    def _root_tree(self, tree, outgroup_labels):
+        """Reroot tree on the MRCA of the outgroup.
+
+        Parameters
+        ----------
+        tree : dendropy.Tree
+          Tree to reroot.
+        outgroup_labels : iterable
+          Labels of outgroup taxa in tree.
+
+        Returns
+        -------
+        int
+          Number of leaf nodes below the MRCA of the outgroup.
+        bool
+          True if tree was rerooted, False if already rooted on the outgroup.
+        """
+
+        mrca = tree.mrca(taxon_labels=outgroup_labels)
+        mrca_leaf_count = len(mrca.leaf_nodes())
+
+        if mrca.edge_length is None:
+            return mrca_leaf_count, False
+
+        self._reroot(tree, mrca)
+        return mrca_leaf_count, True
+
     def root_with_outgroup(self, input_tree, output_tree, outgroup):
         """Reroot the tree using the given outgroup.
 
@@ -89,16 +169,12 @@ class RerootTree(object):
           Labels of taxa in outgroup.
         """
 
-        outgroup_in_tree = set()
         tree = dendropy.Tree.get_from_path(input_tree, 
                                             schema='newick', 
                                             rooting='force-unrooted', 
                                             preserve_underscores=True)
 
-        outgroup = set(outgroup)
-        for n in tree.leaf_node_iter():
-            if n.taxon.label in outgroup:
-                outgroup_in_tree.add(n.taxon)
+        outgroup_in_tree = self._outgroup_in_tree(tree, set(outgroup))
 
         self.logger.info('Identified %d outgroup taxa in the tree.' % len(outgroup_in_tree))
 
@@ -107,29 +183,142 @@ class RerootTree(object):
             self.logger.warning('Tree was not rerooted.')
             sys.exit(0)
 
-        mrca = tree.mrca(taxa=outgroup_in_tree)
+        mrca_leaf_count, rerooted = self._root_tree(tree, outgroup_in_tree)
 
-        if len(mrca.leaf_nodes()) != len(outgroup_in_tree):
+        if mrca_leaf_count != len(outgroup_in_tree):
             self.logger.info('Outgroup is not monophyletic. Tree will be rerooted at the MRCA of the outgroup.')
-            self.logger.info('The outgroup consisted of %d taxa, while the MRCA has %d leaf nodes.' % (len(outgroup_in_tree), len(mrca.leaf_nodes())))
-            if len(mrca.leaf_nodes()) == len(tree.leaf_nodes()):
+            self.logger.info('The outgroup consisted of %d taxa, while the MRCA has %d leaf nodes.' % (len(outgroup_in_tree), mrca_leaf_count))
+            if mrca_leaf_count == len(tree.leaf_nodes()):
                 self.logger.warning('The MRCA spans all taxa in the tree.')
                 self.logger.warning('This indicating the selected outgroup is likely polyphyletic in the current tree.')
                 self.logger.warning('Polyphyletic outgroups are not suitable for rooting. Try another outgroup.')
         else:
             self.logger.info('Outgroup is monophyletic.')
 
-        if mrca.edge_length is None:
+        if not rerooted:
             self.logger.info('Tree appears to already be rooted on this outgroup.')
         else:
             self.logger.info('Rerooting tree.')
-            self._reroot(tree, mrca)
             tree.write_to_path(output_tree, 
                                 schema='newick', 
                                 suppress_rooting=True, 
                                 unquoted_underscores=True)
             self.logger.info('Rerooted tree written to: %s' % output_tree)
 
+    def _reroot_producer(self, tree_files):
+        """Reroot a single tree and write it to file.
+
+        Parameters
+        ----------
+        tree_files : (str, str)
+          Input tree and output tree.
+        """
+
+        input_tree, output_tree = tree_files
+
+        tree = dendropy.Tree.get_from_path(input_tree, 
+                                            schema='newick', 
+                                            rooting='force-unrooted', 
+                                            preserve_underscores=True)
+
+        outgroup_in_tree = self._outgroup_in_tree(tree, self.outgroup)
+        if len(outgroup_in_tree) == 0:
+            return (input_tree, None, 0, 0)
+
+        mrca_leaf_count, rerooted = self._root_tree(tree, outgroup_in_tree)
+        if not rerooted:
+            return (input_tree, None, len(outgroup_in_tree), mrca_leaf_count)
+
+        tree.write_to_path(output_tree, 
+                            schema='newick', 
+                            suppress_rooting=True, 
+                            unquoted_underscores=True)
+
+        return (input_tree, output_tree, len(outgroup_in_tree), mrca_leaf_count)
+
+    def _reroot_consumer(self, produced_data, consumer_data):
+        """Collect results of rerooting each tree."""
+
+        if consumer_data == None:
+            consumer_data = []
+
+        consumer_data.append(produced_data)
+
+        return consumer_data
+
+    def _reroot_progress(self, processed_items, total_items):
+        """Report progress of rerooted trees."""
+
+        return '==> Rerooted %d of %d trees.' % (processed_items, total_items)
+
+    def root_with_outgroup_batch(self, input_trees, output_dir, outgroup):
+        """Reroot a set of trees using the given outgroup.
+
+        Trees are rerooted in parallel with each worker writing
+        the rerooted trees it processes. Rerooted trees are given
+        the same name as the input tree, so input trees must have
+        distinct names and can not reside in the output directory.
+        Each tree is read into its own taxon namespace, so outgroup
+        taxa are identified separately for each tree.
+
+        Parameters
+        ----------
+        input_trees : iterable
+          Files containing Newick trees to rerooted.
+        output_dir : str
+          Directory for rerooted trees.
+        outgroup : iterable
+          Labels of taxa in outgroup.
+
+        Returns
+        -------
+        list
+          Rerooted trees.
+        """
+
+        self.outgroup = set(outgroup)
+
+        tree_files = []
+        input_for_output = {}
+        for input_tree in input_trees:
+            output_tree = os.path.join(output_dir, os.path.basename(input_tree))
+            if os.path.abspath(output_tree) == os.path.abspath(input_tree):
+                self.logger.error('Rerooted tree would overwrite input tree: %s' % input_tree)
+                sys.exit(-1)
+
+            if output_tree in input_for_output:
+                self.logger.error('Input trees %s and %s would be written to the same file: %s' % (input_for_output[output_tree],
+                                                                                                    input_tree,
+                                                                                                    output_tree))
+                sys.exit(-1)
+
+            input_for_output[output_tree] = input_tree
+            tree_files.append((input_tree, output_tree))
+
+        self.logger.info('Rerooting %d trees:' % len(tree_files))
+        parallel = Parallel(self.cpus)
+        results = parallel.run(self._reroot_producer,
+                                self._reroot_consumer,
+                                tree_files,
+                                self._reroot_progress)
+
+        rerooted_trees = []
+        for input_tree, output_tree, num_outgroup_taxa, mrca_leaf_count in sorted(results):
+            if num_outgroup_taxa == 0:
+                self.logger.warning('No outgroup taxa identified in %s. Tree was not rerooted.' % input_tree)
+            elif output_tree is None:
+                self.logger.info('Tree %s appears to already be rooted on this outgroup.' % input_tree)
+            else:
+                rerooted_trees.append(output_tree)
+                if mrca_leaf_count != num_outgroup_taxa:
+                    self.logger.warning('Outgroup is not monophyletic in %s (%d outgroup taxa, %d taxa in MRCA).' % (input_tree, 
+                                                                                                                    num_outgroup_taxa, 
+                                                                                                                    mrca_leaf_count))
+
+        self.logger.info('Rerooted %d of %d trees.' % (len(rerooted_trees), len(tree_files)))
+
+        return rerooted_trees
+
     def midpoint(self, input_tree, output_tree):
         """Reroot tree bat midpoint.
 
@@ -18,6 +18,9 @@
 import os
 import sys
 import logging
+import hashlib
+
+import numpy as np
 
 import biolib.seq_io as seq_io
 from biolib.misc.time_keeper import TimeKeeper
@@ -26,6 +29,9 @@ from biolib.external.blast import Blast
 from biolib.taxonomy import Taxonomy
 
 import genometreetk.ncbi as ncbi
+from genometreetk.dag import StepRunner
+from genometreetk.fasta_index import FastaIndex
+from genometreetk.profiler import profiler, profiled
 from genometreetk.common import (read_gtdb_metadata,
                                     read_genome_dir_file,
                                     read_gtdb_taxonomy)
@@ -46,6 +52,7 @@ class RNA_Workflow(object):
         self.logger = logging.getLogger()
         self.cpus = cpus
 
+    @profiled('extract_rna')
     def _get_rna_seqs(self,
                         rna_name,
                         rna_file,
@@ -122,55 +129,65 @@ class RNA_Workflow(object):
         output_msa : str
             New file with trimmed MSA.
         remove_identical : boolean
-            Flag indicating if identical sequence should be removed.
+            Flag indicating if identical sequence should be removed,
+            with the retained copy of each removed sequence written
+            to <output_msa>.identical.
         min_per_taxa : float [0, 1.0]
             Minimum required taxa to retain leading and trailing columns.
         min_bp : int
             Minimum required length to retain sequence.
         """
 
-        # read seqs
-        seqs = seq_io.read_fasta(input_msa)
-
-        # filter identical seqs
-        identical_seqs = set()
+        # read seqs into a matrix with a row per sequence, filtering
+        # identical seqs as they are read
         if remove_identical:
             self.logger.info('Filtering identical sequences.')
 
-            seq_ids = list(seqs.keys())
-            for i in range(0, len(seq_ids)):
-                seq_id_I = seq_ids[i]
-
-                if seq_id_I in identical_seqs:
+            identical_seq_file = output_msa + '.identical'
+            fout = open(identical_seq_file, 'w')
+            fout.write('Removed sequence\tRetained sequence\n')
+
+        seq_ids = []
+        rows = []
+        rep_seq_ids = {}
+        num_seqs = 0
+        msa_len = None
+        for seq_id, seq in seq_io.read_seq(input_msa):
+            num_seqs += 1
+            row = seq.encode('ascii')
+
+            if msa_len is None:
+                msa_len = len(row)
+            elif len(row) != msa_len:
+                self.logger.error('Sequence %s has a length of %d instead of %d.' % (seq_id, len(row), msa_len))
+                sys.exit(-1)
+
+            if remove_identical:
+                digest = hashlib.sha1(row).digest()
+                rep_seq_id = rep_seq_ids.get(digest, None)
+                if rep_seq_id is not None:
+                    fout.write('%s\t%s\n' % (seq_id, rep_seq_id))
                     continue
+                rep_seq_ids[digest] = seq_id
 
-                for j in range(i + 1, len(seqIds)):
-                    seq_id_J = seq_ids[j]
-                    if seqs[seq_id_I] == seqs[seq_id_J]:
-                      self.logger.info('Seq %s and %s are identical.' % (seq_id_I, seq_id_J))
-                      identical_seqs.add(seq_id_J)
+            seq_ids.append(seq_id)
+            rows.append(row)
 
-            self.logger.info('Identified %d of %d sequences as identical.' % (len(identical_seqs), len(seqs)))
+        if remove_identical:
+            fout.close()
 
-        # trim start and end columns to consensus alignment
-        first_char = []
-        last_char = []
-        for seq_id, seq in seqs.items():
-            if seq_id in identical_seqs:
-                continue
+            self.logger.info('Identified %d of %d sequences as identical.' % (num_seqs - len(seq_ids), num_seqs))
+            self.logger.info('Identical sequences written to: %s' % identical_seq_file)
 
-            for i, ch in enumerate(seq):
-                if ch != '.' and ch != '-':
-                    first_char.append(i)
-                    break
+        msa = np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(len(rows), msa_len)
+        del rows
 
-            for i in range(len(seq) - 1, -1, -1):
-                if seq[i] != '.' and seq[i] != '-':
-                    last_char.append(i)
-                    break
+        # trim start and end columns to consensus alignment
+        aligned = (msa != ord('.')) & (msa != ord('-'))
+        has_aligned = aligned.any(axis=1)
 
-        first_char.sort()
-        last_char.sort(reverse=True)
+        first_char = np.sort(np.argmax(aligned, axis=1)[has_aligned])
+        last_char = np.sort(msa_len - 1 - np.argmax(aligned[:, ::-1], axis=1)[has_aligned])[::-1]
 
         trim_index = int((len(first_char) * min_per_taxa) + 1)
 
@@ -179,35 +196,31 @@ class RNA_Workflow(object):
 
         self.logger.info('Trimming seqs from %d to %d leaving a %dbp length alignment.' % (start, end, end - start + 1))
 
+        valid_bps = aligned[:, start:end + 1].sum(axis=1)
+        del aligned
+
         short_seq_file = output_msa + '.short'
         fout = open(output_msa, 'w')
         fout_short = open(short_seq_file, 'w')
         num_filtered_seq = 0
-        for seq_id, seq in seqs.items():
-            if seq_id in identical_seqs:
-                continue
-
-            valid_bp = 0
-            for i in range(start, min(len(seq), end + 1)):
-                ch = seq[i]
-                if ch != '.' and ch != '-':
-                    valid_bp += 1
-
+        for seq_id, row, valid_bp in zip(seq_ids, msa, valid_bps.tolist()):
+            trimmed_seq = row[start:end + 1].tobytes().decode('ascii')
             if valid_bp >= min_bp:
                 fout.write('>' + seq_id + '\n')
-                fout.write(seq[start:end + 1] + '\n')
+                fout.write(trimmed_seq + '\n')
             else:
                 self.logger.info('Filtering seq %s with %d of %d (%.1f%%) aligned bases.' % (seq_id, valid_bp, (end - start + 1), valid_bp * 100.0 / (end - start + 1)))
                 num_filtered_seq += 1
                 fout_short.write('>' + seq_id + '\n')
-                fout_short.write(seq[start:end + 1] + '\n')
+                fout_short.write(trimmed_seq + '\n')
 
         fout.close()
         fout_short.close()
 
-        self.logger.info('Filtered %d of %d sequences due to length.' % (num_filtered_seq, len(seqs) - len(identical_seqs)))
+        self.logger.info('Filtered %d of %d sequences due to length.' % (num_filtered_seq, len(seq_ids)))
         self.logger.info('Short sequence written to: %s' % short_seq_file)
 
+    @profiled('taxonomy_filter')
     def _tax_filter(self, ssu_output_file, taxonomy, output_dir):
         """Identify sequence to filter based on taxonomy of best BLAST hit.
 
@@ -436,103 +449,166 @@ class RNA_Workflow(object):
 
                 rna_output_file = rna_filtered_output
 
-        # align sequences
+        # align sequences, trim alignments, and infer trees with
+        # independent steps for each domain run concurrently
         align_dir = os.path.join(output_dir, '%s_align' % rna_name)
+        workflow = StepRunner(self.cpus)
+        domain_cpus = max(1, self.cpus // 2)
+
+        masked_msas = {}
         if rna_name == 'ssu':
-            os.system('ssu-align --dna %s %s' % (rna_output_file, align_dir))
-            os.system('ssu-mask --afa %s' % align_dir)
+            # outputs depend on the domains present so completion is marked explicitly
+            align_done = os.path.join(align_dir, 'ssu_align.done')
+            workflow.add('ssu_align',
+                            'ssu-align -f --dna %s %s > /dev/null && touch %s' % (rna_output_file, align_dir, align_done),
+                            inputs=[rna_output_file],
+                            outputs=[align_done])
+
+            mask_done = os.path.join(align_dir, 'ssu_mask.done')
+            workflow.add('ssu_mask',
+                            'ssu-mask --afa %s > /dev/null && touch %s' % (align_dir, mask_done),
+                            inputs=[align_done],
+                            outputs=[mask_done])
+
+            for domain in ['archaea', 'bacteria']:
+                masked_msas[domain] = os.path.join(align_dir, 'ssu_align.' + domain + '.mask.afa')
         elif rna_name == 'lsu':
             if not os.path.exists(align_dir):
                 os.makedirs(align_dir)
-                
-            os.system('esl-sfetch --index %s' % rna_output_file)
-                  
+
+            ssi_index = rna_output_file + '.ssi'
+            workflow.add('sfetch_index',
+                            'esl-sfetch --index %s > /dev/null' % rna_output_file,
+                            inputs=[rna_output_file],
+                            outputs=[ssi_index])
+
             # search fo sequences using domain-specific LSU HMMs
+            cm_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cm_files')
+            cm_files = {}
+            table_outs = {}
+            search_cpus = max(1, self.cpus // 3)
             for domain in ['archaea', 'bacteria', 'eukaryote']:
-                self.logger.info('Matching LSU rRNA genes to %s-specific HMM.' % domain)
                 table_out = os.path.join(align_dir, 'cmsearch.%s.%s.tblout' % (rna_name, domain))
-                cm_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cm_files')            
                 cm_file = os.path.join(cm_dir, 'lsu_%s.cm' % domain)
                 log_file = os.path.join(align_dir, 'cmsearch.%s.%s.out' % (rna_name, domain))
-                os.system('cmsearch --hmmonly --cpu %d --noali --tblout %s %s %s > %s' % (self.cpus, table_out, cm_file, rna_output_file, log_file))
-                
+                workflow.add('cmsearch_%s' % domain,
+                                'cmsearch --hmmonly --cpu %d --noali --tblout %s %s %s > %s' % (search_cpus, table_out, cm_file, rna_output_file, log_file),
+                                inputs=[rna_output_file, cm_file],
+                                outputs=[table_out],
+                                cpus=search_cpus)
+                cm_files[domain] = cm_file
+                table_outs[domain] = table_out
+
             # identify top hits for each domain
-            self.logger.info('Identifying best domain-specific HMM for each LSU rRNA gene.')
-            top_hits = {}
-            for domain in ['archaea', 'bacteria', 'eukaryote']:
-                table_out = os.path.join(align_dir, 'cmsearch.%s.%s.tblout' % (rna_name, domain))
-                for line in open(table_out):
-                    if line[0] == '#':
-                        continue
-                        
-                    line_split = line.split()
-                    seq_id = line_split[0]
-                    start_seq = int(line_split[7])
-                    end_seq = int(line_split[8])
-                    bitscore = float(line_split[14])
-
-                    prev_bitscore = top_hits.get(seq_id, [None, 0, 0, 0, 0])[4]
-                    if bitscore > prev_bitscore:
-                        top_hits[seq_id] = [domain, seq_id, start_seq, end_seq, bitscore]
-              
+            top_hits_outs = dict((domain, os.path.join(align_dir, 'top_hits.%s.%s.tsv' % (rna_name, domain)))
+                                    for domain in ['archaea', 'bacteria'])
+            workflow.add('top_hits',
+                            lambda: self._lsu_top_hits(table_outs, top_hits_outs),
+                            inputs=list(table_outs.values()),
+                            outputs=list(top_hits_outs.values()))
+
             # create MSA for each bacteria and archaea
             for domain in ['archaea', 'bacteria']:
-                # creat file of top hits
-                top_hits_out = os.path.join(align_dir, 'top_hits.%s.%s.tsv' % (rna_name, domain))
-                fout = open(top_hits_out, 'w')
-                num_hits = 0
-                for top_domain, seq_id, start_seq, end_seq, bitscore in list(top_hits.values()):
-                    if top_domain == domain:
-                        fout.write('%s\t%d\t%d\%f\n' % (seq_id, start_seq, end_seq, bitscore))
-                        num_hits += 1
-                fout.close()
-                
-                # align top hits
-                self.logger.info('Creating MSA for %s LSU rRNA genes (%d sequences).' % (domain, num_hits))
-                
-                if num_hits > 0:
-                    seq_file = os.path.join(align_dir, 'cmsearch.%s.%s.fna' % (rna_name, domain))
-                    os.system("grep -v '^#' %s | awk '{print $1, $2, $3, $1}' | esl-sfetch -Cf %s - > %s" % (top_hits_out, rna_output_file, seq_file))
-                    
-                    align_file = os.path.join(align_dir, 'cmalign.%s.%s.stk' % (rna_name, domain))
-                    os.system('cmalign --dnaout --outformat Pfam %s %s > %s' % (cm_file, seq_file, align_file))
-                    
-                    masked_file = os.path.join(align_dir, 'cmalign.%s.%s.mask.afa' % (rna_name, domain))
-                    os.system('esl-alimask -p --outformat AFA %s > %s' % (align_file, masked_file))
-            
-        # trim sequences
+                top_hits_out = top_hits_outs[domain]
+                seq_file = os.path.join(align_dir, 'cmsearch.%s.%s.fna' % (rna_name, domain))
+                workflow.add('sfetch_%s' % domain,
+                                "grep -v '^#' %s | awk '{print $1, $2, $3, $1}' | esl-sfetch -Cf %s - > %s" % (top_hits_out, rna_output_file, seq_file),
+                                inputs=[top_hits_out, ssi_index],
+                                outputs=[seq_file],
+                                condition=lambda top_hits_out=top_hits_out: os.path.getsize(top_hits_out) > 0)
+
+                align_file = os.path.join(align_dir, 'cmalign.%s.%s.stk' % (rna_name, domain))
+                workflow.add('cmalign_%s' % domain,
+                                'cmalign --cpu %d --dnaout --outformat Pfam %s %s > %s' % (domain_cpus, cm_files[domain], seq_file, align_file),
+                                inputs=[cm_files[domain], seq_file],
+                                outputs=[align_file],
+                                cpus=domain_cpus)
+
+                masked_msas[domain] = os.path.join(align_dir, 'cmalign.%s.%s.mask.afa' % (rna_name, domain))
+                workflow.add('alimask_%s' % domain,
+                                'esl-alimask -p --outformat AFA %s > %s' % (align_file, masked_msas[domain]),
+                                inputs=[align_file],
+                                outputs=[masked_msas[domain]])
+
+        # trim sequences and infer tree
         for domain in ['archaea', 'bacteria']:
-            if rna_name == 'ssu':
-                input_msa = os.path.join(align_dir, 'ssu_align.' + domain + '.mask.afa')
-            elif rna_name == 'lsu':
-                input_msa = os.path.join(align_dir, 'cmalign.%s.%s.mask.afa' % (rna_name, domain))
-                
-            if not os.path.exists(input_msa):
-                continue
-                
+            input_msa = masked_msas[domain]
             trimmed_msa = os.path.join(output_dir, domain + '.trimmed.fna')
-            self._trim_seqs(input_msa, trimmed_msa)
+            after = ['ssu_mask'] if rna_name == 'ssu' else []
+            workflow.add('trim_%s' % domain,
+                            lambda input_msa=input_msa, trimmed_msa=trimmed_msa: self._trim_seqs(input_msa, trimmed_msa),
+                            inputs=[input_msa],
+                            outputs=[trimmed_msa],
+                            after=after,
+                            condition=lambda input_msa=input_msa: os.path.exists(input_msa))
 
-            # infer tree
-            self.logger.info('Inferring tree for %s LSU rRNA genes.' % domain)
             output_tree = os.path.join(output_dir, domain + '.tree')
-            os.system('FastTreeMP -nosupport -nt -gamma %s > %s' % (trimmed_msa, output_tree))
-  
-            
+            workflow.add('tree_%s' % domain,
+                            'FastTreeMP -nosupport -nt -gamma %s > %s 2> %s' % (trimmed_msa, output_tree, output_tree + '.log'),
+                            inputs=[trimmed_msa],
+                            outputs=[output_tree],
+                            cpus=domain_cpus)
+
+        # steps run in separate threads so are recorded as events
+        # within a single stage rather than as nested stages
+        with profiler.stage('align_and_infer'):
+            workflow.run()
+
+    def _lsu_top_hits(self, table_outs, top_hits_outs):
+        """Identify best domain-specific HMM for each LSU rRNA gene.
+
+        Parameters
+        ----------
+        table_outs : d[domain] -> file
+            Table with cmsearch hits for each domain.
+        top_hits_outs : d[domain] -> file
+            Output file for top hits to each domain.
+        """
+
+        self.logger.info('Identifying best domain-specific HMM for each LSU rRNA gene.')
+        top_hits = {}
+        for domain in ['archaea', 'bacteria', 'eukaryote']:
+            for line in open(table_outs[domain]):
+                if line[0] == '#':
+                    continue
+
+                line_split = line.split()
+                seq_id = line_split[0]
+                start_seq = int(line_split[7])
+                end_seq = int(line_split[8])
+                bitscore = float(line_split[14])
+
+                prev_bitscore = top_hits.get(seq_id, [None, 0, 0, 0, 0])[4]
+                if bitscore > prev_bitscore:
+                    top_hits[seq_id] = [domain, seq_id, start_seq, end_seq, bitscore]
+
+        for domain, top_hits_out in top_hits_outs.items():
+            fout = open(top_hits_out, 'w')
+            num_hits = 0
+            for top_domain, seq_id, start_seq, end_seq, bitscore in list(top_hits.values()):
+                if top_domain == domain:
+                    fout.write('%s\t%d\t%d\t%f\n' % (seq_id, start_seq, end_seq, bitscore))
+                    num_hits += 1
+            fout.close()
+
+            self.logger.info('Identified %d %s LSU rRNA genes.' % (num_hits, domain))
+
     def combine(self, ssu_msa, ssu_tree, lsu_msa, lsu_tree, output_dir):
         """Infer 16S + 23S tree spanning GTDB genomes."""
         
         # identify common 16S and 23S sequences
+        ssu_index = FastaIndex(ssu_msa)
         ssu_seqs = {}
-        for seq_id, seq, annotation in seq_io.read_seq(ssu_msa, keep_annotation=True):
+        for seq_id in ssu_index.ids():
             genome_id = seq_id.split('~')[0]
-            ssu_seqs[genome_id] = [seq, annotation]
+            ssu_seqs[genome_id] = seq_id
         self.logger.info('Read %d SSU rRNA sequences.' % len(ssu_seqs))
             
+        lsu_index = FastaIndex(lsu_msa)
         lsu_seqs = {}
-        for seq_id, seq, annotation in seq_io.read_seq(lsu_msa, keep_annotation=True):
+        for seq_id in lsu_index.ids():
             genome_id = seq_id.split('~')[0]
-            lsu_seqs[genome_id] = [seq, annotation]
+            lsu_seqs[genome_id] = seq_id
         self.logger.info('Read %d LSU rRNA sequences.' % len(lsu_seqs))
               
         common_seqs = set(ssu_seqs.keys()).intersection(list(lsu_seqs.keys()))
@@ -565,8 +641,10 @@ class RNA_Workflow(object):
         concatenated_msa = os.path.join(output_dir, 'ssu_lsu_concatenated.fna')
         fout = open(concatenated_msa, 'w')
         for seq_id in common_seqs:
-            fout.write('>%s %s %s\n' % (seq_id, ssu_seqs[seq_id][1], lsu_seqs[seq_id][1]))
-            fout.write('%s%s\n' % (ssu_seqs[seq_id][0], lsu_seqs[seq_id][0]))
+            ssu_id = ssu_seqs[seq_id]
+            lsu_id = lsu_seqs[seq_id]
+            fout.write('>%s %s %s\n' % (seq_id, ssu_index.annotation(ssu_id), lsu_index.annotation(lsu_id)))
+            fout.write('%s%s\n' % (ssu_index.sequence(ssu_id), lsu_index.sequence(lsu_id)))
         fout.close()
         
         # infer tree
@@ -0,0 +1,252 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import heapq
+import shutil
+import logging
+import tempfile
+
+from genometreetk.exceptions import GenomeTreeTkError
+
+
+class TaxonomyStream(object):
+    """Process Greengenes-style taxonomy files one row at a time.
+
+    Rows are parsed as in biolib's Taxonomy.read, but are never
+    held in memory together, so row-local transforms write each
+    row as it is read. Two taxonomy files are compared with a
+    sorted-merge join; files which are not sorted by identifier
+    are first sorted externally in runs of a bounded number of
+    rows. Memory use is therefore independent of file size.
+    """
+
+    def __init__(self, max_rows=500000, tmp_dir=None):
+        """Initialization.
+
+        Parameters
+        ----------
+        max_rows : int
+            Maximum number of rows held in memory when sorting.
+        tmp_dir : str
+            Directory for sorted runs, or None for the system default.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.max_rows = max_rows
+        self.tmp_dir = tmp_dir
+
+    def _parse(self, line):
+        """Parse identifier and taxa from a row of a taxonomy file."""
+
+        line_split = line.split('\t')
+        unique_id = line_split[0]
+
+        tax_str = line_split[1].rstrip()
+        if tax_str[-1] == ';':
+            # remove trailing semicolons which sometimes
+            # appear in Greengenes-style taxonomy files
+            tax_str = tax_str[0:-1]
+
+        return unique_id, [x.strip() for x in tax_str.split(';')]
+
+    def _parse_lines(self, lines, source):
+        """Parse rows, reporting the row which could not be parsed."""
+
+        row = 0
+        try:
+            for row, line in enumerate(lines):
+                yield self._parse(line)
+        except (IndexError, ValueError):
+            raise GenomeTreeTkError('Failed to parse taxonomy file %s on line %d.' % (source, row + 1))
+
+    def read(self, taxonomy_file):
+        """Read taxonomy file one row at a time.
+
+        Parameters
+        ----------
+        taxonomy_file : str
+            Greengenes-style taxonomy file.
+
+        Yields
+        ------
+        str, list
+            Unique id and taxa [d__<taxon>, ..., s__<taxon>] of each row.
+        """
+
+        with open(taxonomy_file) as f:
+            for unique_id, taxa in self._parse_lines(f, taxonomy_file):
+                yield unique_id, taxa
+
+    def transform(self, input_taxonomy, output_taxonomy, func):
+        """Write revised taxonomy string for each row as it is read.
+
+        Parameters
+        ----------
+        input_taxonomy : str
+            Greengenes-style taxonomy file.
+        output_taxonomy : str
+            Output taxonomy file.
+        func : function
+            Function taking the unique id and taxa of a row and
+            returning revised taxa, or None to omit the row.
+
+        Returns
+        -------
+        int
+            Number of rows written.
+        """
+
+        rows = 0
+        with open(output_taxonomy, 'w') as fout:
+            for unique_id, taxa in self.read(input_taxonomy):
+                taxa = func(unique_id, taxa)
+                if taxa is None:
+                    continue
+
+                fout.write('%s\t%s\n' % (unique_id, ';'.join(taxa)))
+                rows += 1
+
+        return rows
+
+    def _is_sorted(self, taxonomy_file):
+        """Check if rows are sorted by unique id."""
+
+        prev_id = None
+        with open(taxonomy_file) as f:
+            for line in f:
+                unique_id = line.split('\t', 1)[0]
+                if prev_id is not None and unique_id < prev_id:
+                    return False
+                prev_id = unique_id
+
+        return True
+
+    def _write_run(self, lines, run_dir, run_index):
+        """Sort rows by unique id and write them as a run."""
+
+        lines.sort(key=lambda line: line.split('\t', 1)[0])
+
+        run_file = os.path.join(run_dir, 'run_%d.tsv' % run_index)
+        with open(run_file, 'w') as fout:
+            for line in lines:
+                fout.write(line if line.endswith('\n') else line + '\n')
+
+        return run_file
+
+    def read_sorted(self, taxonomy_file):
+        """Read rows of taxonomy file in order of unique id.
+
+        Files already sorted by unique id are read directly. Otherwise,
+        rows are sorted in runs of at most max_rows rows which are
+        written to disk and then merged. As with Taxonomy.read, only
+        the last row of an id occurring multiple times is reported.
+
+        Parameters
+        ----------
+        taxonomy_file : str
+            Greengenes-style taxonomy file.
+
+        Yields
+        ------
+        str, list
+            Unique id and taxa of each row, in order of unique id.
+        """
+
+        if self._is_sorted(taxonomy_file):
+            rows = self.read(taxonomy_file)
+            for unique_id, taxa in self._last_of_duplicates(rows):
+                yield unique_id, taxa
+            return
+
+        run_dir = tempfile.mkdtemp(prefix='taxonomy_sort_', dir=self.tmp_dir)
+        try:
+            run_files = []
+            with open(taxonomy_file) as f:
+                lines = []
+                for line in f:
+                    lines.append(line)
+                    if len(lines) == self.max_rows:
+                        run_files.append(self._write_run(lines, run_dir, len(run_files)))
+                        lines = []
+
+                if lines:
+                    run_files.append(self._write_run(lines, run_dir, len(run_files)))
+                del lines
+
+            self.logger.info('Sorting %s in %d run(s).' % (taxonomy_file, len(run_files)))
+
+            # merge is stable across runs, so rows with the same id
+            # remain in the order they appeared in the file
+            run_handles = [open(run_file) for run_file in run_files]
+            try:
+                merged = heapq.merge(*run_handles, key=lambda line: line.split('\t', 1)[0])
+                rows = self._parse_lines(merged, taxonomy_file)
+                for unique_id, taxa in self._last_of_duplicates(rows):
+                    yield unique_id, taxa
+            finally:
+                for f in run_handles:
+                    f.close()
+        finally:
+            shutil.rmtree(run_dir)
+
+    def _last_of_duplicates(self, rows):
+        """Report only the last of consecutive rows with the same id."""
+
+        prev = None
+        for row in rows:
+            if prev is not None and prev[0] != row[0]:
+                yield prev
+            prev = row
+
+        if prev is not None:
+            yield prev
+
+    def join(self, taxonomy_file1, taxonomy_file2):
+        """Join two taxonomy files on unique id with a sorted-merge join.
+
+        Parameters
+        ----------
+        taxonomy_file1 : str
+            First Greengenes-style taxonomy file.
+        taxonomy_file2 : str
+            Second Greengenes-style taxonomy file.
+
+        Yields
+        ------
+        str, list, list
+            Unique id along with its taxa in each file, or None
+            if the id is not in a file, in order of unique id.
+        """
+
+        rows1 = self.read_sorted(taxonomy_file1)
+        rows2 = self.read_sorted(taxonomy_file2)
+
+        row1 = next(rows1, None)
+        row2 = next(rows2, None)
+        while row1 is not None or row2 is not None:
+            if row2 is None or (row1 is not None and row1[0] < row2[0]):
+                yield row1[0], row1[1], None
+                row1 = next(rows1, None)
+            elif row1 is None or row2[0] < row1[0]:
+                yield row2[0], None, row2[1]
+                row2 = next(rows2, None)
+            else:
+                yield row1[0], row1[1], row2[1]
+                row1 = next(rows1, None)
+                row2 = next(rows2, None)
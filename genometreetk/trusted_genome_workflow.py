@@ -18,6 +18,7 @@
 import logging
 
 from genometreetk.common import read_gtdb_taxonomy, read_gtdb_ncbi_taxonomy
+from genometreetk.profiler import profiler, profiled
 import genometreetk.ncbi as ncbi
 
 import csv
@@ -31,6 +32,7 @@ class TrustedGenomeWorkflow(object):
 
         self.logger = logging.getLogger()
 
+    @profiled('trusted_genomes')
     def _trusted_genomes(self, metadata_file,
                                 trusted_comp,
                                 trusted_cont,
@@ -129,6 +131,7 @@ class TrustedGenomeWorkflow(object):
                     del trusted_genomes_stats[genome_id]
 
         self.logger.info('Identified %d trusted genomes.' % len(trusted_genomes_stats))
+        profiler.count('trusted_genomes', len(trusted_genomes_stats))
 
         fout = open(output_file, 'w')
         fout.write('# Selection criteria:\n')
@@ -0,0 +1,69 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+from genometreetk.array_tree import ArrayTree
+from genometreetk.bipartitions import HashedSplits, split_distances
+
+
+def _distances(newick1, newick2, scale):
+    """Calculate distances between two trees over their shared taxa."""
+
+    tree1 = ArrayTree.from_string(newick1)
+    tree2 = ArrayTree.from_string(newick2)
+
+    namespace = {}
+    for tree in (tree1, tree2):
+        for leaf in tree.leaves():
+            namespace.setdefault(tree.labels[leaf], len(namespace))
+
+    rs = np.random.RandomState(1)
+    taxon_keys = np.frombuffer(rs.bytes(8 * len(namespace)), dtype=np.uint64)
+
+    splits1 = HashedSplits(tree1, namespace)
+    splits2 = HashedSplits(tree2, namespace)
+    shared_taxa = np.intersect1d(splits1.taxa, splits2.taxa, assume_unique=True)
+
+    return split_distances(splits1.project(taxon_keys, shared_taxa),
+                            splits2.project(taxon_keys, shared_taxa),
+                            scale)
+
+
+def test_identical_pruned_trees():
+    """Edges above all shared taxa do not contribute to distances."""
+
+    newick1 = '((A:1,B:1):1,(C:1,D:1):1);'
+    newick2 = '((((A:1,B:1):1,(C:1,D:1):1):5,(E:1,F:1):1):1,G:1);'
+
+    for scale in (False, True):
+        rf, weighted_rf, euclidean = _distances(newick1, newick2, scale)
+        assert rf == 0
+        assert weighted_rf == 0
+        assert euclidean == 0
+
+
+def test_pruned_trees_differ():
+    """Distances over shared taxa reflect the differing bipartition."""
+
+    newick1 = '((A:1,B:1):1,(C:1,D:1):1);'
+    newick2 = '((((A:1,C:1):1,(B:1,D:1):1):5,(E:1,F:1):1):1,G:1);'
+
+    rf, weighted_rf, euclidean = _distances(newick1, newick2, False)
+    assert rf == 2
+    assert np.isclose(weighted_rf, 4)
+    assert np.isclose(euclidean, np.sqrt(8))